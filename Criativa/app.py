@@ -10,6 +10,7 @@ from api_caixa import api_caixa
 
 # Importar funções de HWID
 from hwid import obter_hwid, validar_hwid_licenca
+from license_keys import is_valid_key
 
 from database import (
     init_db,
@@ -163,9 +164,8 @@ def verificar_licenca_middleware():
         if not license_key or license_key.strip() == '':
             return redirect(url_for('licenca_expirada'))
         
-        # Valida formato básico
-        partes = license_key.split('-')
-        if len(partes) != 4 or not all(len(p) == 4 for p in partes):
+        # Valida formato (e o dígito verificador das chaves LIC2)
+        if not is_valid_key(license_key):
             return redirect(url_for('licenca_expirada'))
         
         # Verifica se a licença está bloqueada localmente
@@ -3108,10 +3108,9 @@ def api_salvar_licenca():
     if not chave_licenca:
         return jsonify({'success': False, 'error': 'Chave de licença não informada'}), 400
     
-    # Valida formato básico
-    partes = chave_licenca.split('-')
-    if len(partes) != 4 or not all(len(p) == 4 for p in partes):
-        return jsonify({'success': False, 'error': 'Formato inválido. Use: XXXX-XXXX-XXXX-XXXX'}), 400
+    # Valida formato (e o dígito verificador das chaves LIC2)
+    if not is_valid_key(chave_licenca):
+        return jsonify({'success': False, 'error': 'Chave inválida. Confira os caracteres (ex.: LIC2-XXXX-XXXX-XXXX-XXXX)'}), 400
     
     try:
         # Obtém o HWID atual do computador
@@ -3190,9 +3189,8 @@ def api_validar_licenca():
                 'mensagem': 'Nenhuma chave de licença cadastrada. Entre em contato com o suporte.'
             })
         
-        # Valida formato básico
-        partes = license_key.split('-')
-        if len(partes) != 4 or not all(len(p) == 4 for p in partes):
+        # Valida formato (e o dígito verificador das chaves LIC2)
+        if not is_valid_key(license_key):
             return jsonify({
                 'valida': False,
                 'mensagem': 'Formato de licença inválido. Entre em contato com o suporte.'
@@ -0,0 +1,48 @@
+"""
+FORMATO DAS CHAVES DE LICENÇA (VERIFICAÇÃO)
+Cópia da parte de verificação de license_keys.py da raiz do repositório:
+o PDV é distribuído sem o resto do código. Mantenha as duas em sincronia.
+
+    LIC2-XXXX-XXXX-XXXX-XXXC   chave v2 com verificador ISO 7064 MOD 37-2
+    CRIAT2-XXXX-XXXX-XXXC      chave v2 emitida pelo bot
+    XXXX-XXXX-XXXX-XXXX        formato antigo (aceito sem verificador)
+    CRIAT-XXXX-XXXX-XXXX       formato antigo do bot
+"""
+
+import re
+
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+_VALUES = {ch: i for i, ch in enumerate(ALPHABET)}
+
+_V2_PATTERN = re.compile(r'^(LIC2-[0-9A-Z]{4}-[0-9A-Z]{4}-[0-9A-Z]{4}-[0-9A-Z]{4}'
+                         r'|CRIAT2-[0-9A-Z]{4}-[0-9A-Z]{4}-[0-9A-Z]{4})$')
+_LEGACY_PATTERN = re.compile(r'^([0-9A-Z]{4}-[0-9A-Z]{4}-[0-9A-Z]{4}-[0-9A-Z]{4}'
+                             r'|CRIAT-[0-9A-Z]{4}-[0-9A-Z]{4}-[0-9A-Z]{4})$')
+
+
+def check_char(payload):
+    """
+    Caractere verificador ISO 7064 MOD 37-2 de `payload` (alfanumérico maiúsculo).
+    Módulo primo com pesos 2^i: pega toda troca de um caractere e toda
+    transposição de vizinhos. O resto 36 dá '*', que nunca sai numa chave
+    (generate_key sorteia outra e o formato só aceita [0-9A-Z]).
+    """
+    p = 0
+    for ch in payload:
+        p = (2 * (p + _VALUES[ch])) % 37
+    return (ALPHABET + '*')[(38 - p) % 37]
+
+
+def _payload(key):
+    # O prefixo entra no cálculo: uma chave LIC2 não vira CRIAT2 válida trocando o prefixo
+    return key[:-1].replace('-', '')
+
+
+def is_valid_key(key):
+    """True se `key` tem formato reconhecido (e verificador correto, nas chaves v2)"""
+    if not key or len(key) > 32:
+        return False
+    key = key.upper()
+    if _V2_PATTERN.match(key):
+        return check_char(_payload(key)) == key[-1]
+    return bool(_LEGACY_PATTERN.match(key))
@@ -2,6 +2,18 @@
 VALIDADOR DE LICENÇA - CLIENTE PDV
 Sistema híbrido online/offline com cache criptografado
 Proteção anti-clonagem e grace period de 30 dias
+
+Com token offline (Ed25519, assinado pelo servidor) a licença é conferida
+localmente com a chave pública embutida e a consulta online cai para uma a
+cada TOKEN_CHECK_INTERVAL (dias, em vez de toda hora). Token vencido ou
+inválido não derruba o PDV offline: vale o grace period de GRACE_PERIOD_DAYS
+contado da última validação online. Entre as consultas
+completas, o feed de revogações (GET /api/revocations, leve e em cache no
+servidor) é lido a cada REVOCATION_POLL_INTERVAL: revogação ou bloqueio da
+chave força a validação online na hora.
+
+Respostas 429 (limite de taxa) e 5xx não dizem nada sobre a licença: o cache
+e o token continuam valendo e a próxima consulta espera o Retry-After.
 """
 
 import os
@@ -14,6 +26,9 @@ from datetime import datetime, timedelta
 from cryptography.fernet import Fernet
 import base64
 
+from license_keys import is_valid_key
+from offline_tokens import InvalidToken, LicenseExpired, decode_token, load_public_keys
+
 class LicenseValidator:
     """Validador de licença com modo híbrido online/offline"""
     
@@ -22,7 +37,24 @@ class LicenseValidator:
     GRACE_PERIOD_DAYS = 90        # 90 dias offline permitidos
     REQUEST_TIMEOUT = 5           # 5 segundos timeout
     
-    def __init__(self, api_url, api_key, secret_key):
+    # Tokens offline: com um token válido no cache, consulta online só a cada 3 dias
+    # (ou quando faltar menos de TOKEN_RENEW_BEFORE para o token vencer)
+    TOKEN_CHECK_INTERVAL = 3 * 86400
+    TOKEN_RENEW_BEFORE = 86400
+    
+    # Feed de revogações: consulta entre validações completas (0 = desligado)
+    REVOCATION_POLL_INTERVAL = 900
+    REVOCATION_MAX_PAGES = 10
+    
+    # 429 ou 5xx sem Retry-After (ou com data em vez de segundos): espera antes de tentar de novo
+    RETRY_AFTER_DEFAULT = 60
+    
+    # Chaves públicas embutidas (kid -> base64url), geradas com
+    # `python offline_tokens.py gerar-chave <kid>`. Na rotação, mantenha a chave
+    # antiga e a nova até os tokens antigos vencerem.
+    OFFLINE_PUBLIC_KEYS = {}
+    
+    def __init__(self, api_url, api_key, secret_key, public_keys=None):
         """
         Inicializa o validador
         
@@ -30,6 +62,7 @@ class LicenseValidator:
             api_url: URL da API de validação (ex: https://seu-servidor.onrender.com)
             api_key: Chave de API para autenticação
             secret_key: Chave secreta para criptografia do cache (min 32 chars)
+            public_keys: kid -> chave pública dos tokens offline (padrão: OFFLINE_PUBLIC_KEYS)
         """
         self.api_url = api_url.rstrip('/')
         self.api_key = api_key
@@ -40,6 +73,11 @@ class LicenseValidator:
         self.cipher_key = base64.urlsafe_b64encode(key_material)
         self.cipher = Fernet(self.cipher_key)
         
+        # Chaves públicas dos tokens offline (carregadas uma vez)
+        self.public_keys = load_public_keys(
+            public_keys if public_keys is not None else self.OFFLINE_PUBLIC_KEYS
+        )
+        
         # Caminho do cache
         self.cache_file = os.path.join(
             os.path.dirname(__file__),
@@ -88,11 +126,19 @@ class LicenseValidator:
         Valida a licença (método principal)
         
         Args:
-            license_key: Chave da licença no formato XXXX-XXXX-XXXX-XXXX
+            license_key: Chave da licença (LIC2-XXXX-XXXX-XXXX-XXXX ou formato antigo XXXX-XXXX-XXXX-XXXX)
         
         Returns:
             tuple: (bool, dict) - (válida?, informações)
         """
+        # Chave digitada errado: recusa sem rede nem cache
+        if not is_valid_key(license_key):
+            return (False, {
+                'valid': False,
+                'message': 'Formato de chave de licença inválido. Confira os caracteres digitados.',
+                'status': 'invalid_format'
+            })
+        
         hwid = self.get_hwid()
         
         # Carrega cache local
@@ -101,18 +147,28 @@ class LicenseValidator:
         # Decide se deve validar online
         should_check_online = self._should_check_online(cache)
         
+        # Entre validações completas: o feed diz se a chave foi revogada/bloqueada
+        if not should_check_online and self._revocation_poll_due(cache):
+            should_check_online = self._poll_revocations(license_key, cache)
+        
         if should_check_online:
             # Tenta validação online
             online_result = self._check_online(license_key, hwid)
             
             if online_result['success']:
                 # Validação online bem-sucedida
-                self._save_cache(license_key, online_result['data'])
+                saved = self._save_cache(license_key, online_result['data'],
+                                         cache.get('revocation_cursor') if cache else None)
+                if saved['revocation_cursor'] is None and self.REVOCATION_POLL_INTERVAL:
+                    # Primeira validação: guarda já o cursor atual do feed (sem lacuna até a próxima leitura)
+                    self._poll_revocations(license_key, saved)
                 return (online_result['data']['valid'], online_result['data'])
             else:
                 # Falha online - usa cache se disponível
                 print(f"⚠️  Validação online falhou: {online_result.get('error', 'Timeout')}")
                 print(f"   Usando cache local (modo offline)")
+                if cache and online_result.get('retry_after'):
+                    self._defer_online(cache, online_result['retry_after'])
         
         # Usa cache local
         if cache:
@@ -134,9 +190,83 @@ class LicenseValidator:
         now = datetime.now().timestamp()
         elapsed = now - cached_at
         
+        # Servidor pediu para esperar (429/5xx com Retry-After): segue com o cache até lá
+        if now < cache.get('online_retry_at', 0):
+            return False
+        
+        # Token offline válido: a licença se confere localmente por dias
+        claims = self._token_claims(cache, now)
+        if claims is not None:
+            return (elapsed > self.TOKEN_CHECK_INTERVAL
+                    or claims['not_after'] - now < self.TOKEN_RENEW_BEFORE)
+        
         # Verifica se passou do intervalo de check online
         return elapsed > self.ONLINE_CHECK_INTERVAL
     
+    def _token_claims(self, cache, now=None):
+        """Conteúdo do token offline do cache; None se não há token (ou não confere)"""
+        token = cache.get('offline_token')
+        if not token or not self.public_keys:
+            return None
+        try:
+            return decode_token(token, self.public_keys, now)
+        except InvalidToken:
+            return None
+    
+    def _revocation_poll_due(self, cache):
+        """True se já passou REVOCATION_POLL_INTERVAL desde a última leitura do feed"""
+        if not cache or not self.REVOCATION_POLL_INTERVAL:
+            return False
+        if datetime.now().timestamp() < cache.get('online_retry_at', 0):
+            return False
+        checked_at = cache.get('revocations_checked_at') or cache.get('cached_at', 0)
+        return datetime.now().timestamp() - checked_at > self.REVOCATION_POLL_INTERVAL
+    
+    def _poll_revocations(self, license_key, cache):
+        """
+        Lê o feed de revogações a partir do cursor salvo e atualiza o cache.
+        
+        Returns:
+            bool: True se a chave mudou (revogada, bloqueada...): validar online
+        """
+        key_hash = hashlib.sha256(license_key.encode('utf-8')).hexdigest()[:16]
+        cursor = cache.get('revocation_cursor')
+        changes = []
+        try:
+            for _ in range(self.REVOCATION_MAX_PAGES):
+                params = {} if cursor is None else {'since': cursor}
+                response = requests.get(
+                    f'{self.api_url}/api/revocations',
+                    params=params,
+                    headers={'X-API-Key': self.api_key},
+                    timeout=self.REQUEST_TIMEOUT
+                )
+                if response.status_code != 200:
+                    if self._is_transient(response):
+                        self._defer_online(cache, self._retry_after(response))
+                    return False
+                page = response.json()
+                changes += [item for item in page['changes'] if item['key_hash'] == key_hash]
+                cursor = page['next_cursor']
+                if not page['more']:
+                    break
+        except Exception as e:
+            # Sem rede: segue com o cache e tenta de novo no próximo intervalo
+            print(f"⚠️  Feed de revogações indisponível: {e}")
+            return False
+        
+        cache['revocation_cursor'] = cursor
+        cache['revocations_checked_at'] = datetime.now().timestamp()
+        if changes and changes[-1]['status'] in ('revoked', 'blocked_multiple_pc'):
+            # Vale mesmo que a validação online a seguir falhe: o token deixa de ser aceito
+            cache['offline_token'] = None
+            cache['license'].update(status=changes[-1]['status'],
+                                    message='Licença revogada ou bloqueada. Entre em contato com o suporte.')
+        self._write_cache(cache)
+        if changes:
+            print("⚠️  Licença alterada no servidor (feed de revogações): validando online")
+        return bool(changes)
+    
     def _check_online(self, license_key, hwid):
         """
         Tenta validação online
@@ -155,6 +285,12 @@ class LicenseValidator:
             if response.status_code == 200:
                 data = response.json()
                 return {'success': True, 'data': data}
+            elif self._is_transient(response):
+                # Limite de taxa ou falha do servidor: não diz nada sobre a licença,
+                # o cache (e o token offline) continuam valendo
+                return {'success': False,
+                        'error': f'Servidor respondeu {response.status_code}',
+                        'retry_after': self._retry_after(response)}
             else:
                 error_data = response.json()
                 return {'success': True, 'data': error_data}  # Retorna erro mas com sucesso na requisição
@@ -166,6 +302,23 @@ class LicenseValidator:
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
+    @staticmethod
+    def _is_transient(response):
+        """429 (limite de taxa) e 5xx: tentar de novo mais tarde, sem mexer no cache"""
+        return response.status_code == 429 or response.status_code >= 500
+    
+    def _retry_after(self, response):
+        """Segundos do header Retry-After (RETRY_AFTER_DEFAULT se ausente ou em formato de data)"""
+        try:
+            return max(1, int(response.headers.get('Retry-After', '')))
+        except ValueError:
+            return self.RETRY_AFTER_DEFAULT
+    
+    def _defer_online(self, cache, seconds):
+        """Adia consultas online e ao feed de revogações por `seconds` (Retry-After)"""
+        cache['online_retry_at'] = datetime.now().timestamp() + seconds
+        self._write_cache(cache)
+    
     def _validate_from_cache(self, cache, license_key, hwid):
         """Valida usando cache local"""
         license_data = cache.get('license', {})
@@ -179,6 +332,12 @@ class LicenseValidator:
                 'status': 'cache_mismatch'
             })
         
+        # Token válido decide; vencido (passou do not-after) ou inválido cai no grace period abaixo
+        if cache.get('offline_token') and self.public_keys:
+            result = self._validate_token(cache['offline_token'], license_key, hwid, cached_at)
+            if result is not None:
+                return result
+        
         # Verifica HWID
         if license_data.get('bound_hwid') and license_data.get('bound_hwid') != hwid:
             return (False, {
@@ -221,6 +380,55 @@ class LicenseValidator:
             'bound_hwid': license_data.get('bound_hwid')
         })
     
+    def _validate_token(self, token, license_key, hwid, cached_at):
+        """
+        Valida localmente pelo token offline assinado pelo servidor.
+        Retorna None se o token não serve (vencido, chave desconhecida...):
+        quem chama segue para o grace period do cache.
+        """
+        try:
+            claims = decode_token(token, self.public_keys)
+        except LicenseExpired as e:
+            return (False, {
+                'valid': False,
+                'message': f'{e}. Entre em contato com o suporte para renovar.',
+                'status': 'expired'
+            })
+        except InvalidToken:
+            return None
+        
+        if claims['license_key'] != license_key:
+            return (False, {
+                'valid': False,
+                'message': 'Licença diferente da armazenada em cache',
+                'status': 'cache_mismatch'
+            })
+        
+        if claims['hwid'] != hwid:
+            return (False, {
+                'valid': False,
+                'message': 'HWID não corresponde ao vinculado',
+                'status': 'hwid_mismatch'
+            })
+        
+        now = datetime.now().timestamp()
+        days_offline = int((now - cached_at) / 86400)
+        # Depois do token vencer ainda vale o grace period (contado da última validação online)
+        days_remaining_offline = max(int((claims['not_after'] - now) / 86400),
+                                     self.GRACE_PERIOD_DAYS - days_offline)
+        expires_at = claims['expires_at']
+        
+        return (True, {
+            'valid': True,
+            'message': f'Licença válida (modo offline - {days_remaining_offline} dias restantes)',
+            'status': 'offline',
+            'days_offline': days_offline,
+            'days_remaining_offline': days_remaining_offline,
+            'expires_at': datetime.fromtimestamp(expires_at).isoformat() if expires_at else None,
+            'plan': claims['plan'],
+            'bound_hwid': claims['hwid']
+        })
+    
     def _load_cache(self):
         """Carrega e valida cache local"""
         if not os.path.exists(self.cache_file):
@@ -250,22 +458,30 @@ class LicenseValidator:
             print(f"Erro ao carregar cache: {e}")
             return None
     
-    def _save_cache(self, license_key, data):
-        """Salva cache criptografado"""
+    def _save_cache(self, license_key, data, revocation_cursor=None):
+        """Salva cache criptografado (e retorna os dados gravados)"""
+        now = datetime.now().timestamp()
+        cache_data = {
+            'license': {
+                'license_key': license_key,
+                'valid': data.get('valid'),
+                'bound_hwid': data.get('bound_hwid'),
+                'plan': data.get('plan'),
+                'expires_at': data.get('expires_at'),
+                'status': data.get('status'),
+                'message': data.get('message')
+            },
+            'offline_token': data.get('offline_token'),
+            'revocation_cursor': revocation_cursor,
+            'revocations_checked_at': now,
+            'cached_at': now
+        }
+        self._write_cache(cache_data)
+        return cache_data
+    
+    def _write_cache(self, cache_data):
+        """Assina, criptografa e grava o cache"""
         try:
-            cache_data = {
-                'license': {
-                    'license_key': license_key,
-                    'valid': data.get('valid'),
-                    'bound_hwid': data.get('bound_hwid'),
-                    'plan': data.get('plan'),
-                    'expires_at': data.get('expires_at'),
-                    'status': data.get('status'),
-                    'message': data.get('message')
-                },
-                'cached_at': datetime.now().timestamp()
-            }
-            
             # Gera assinatura HMAC
             signature = self._generate_signature(cache_data)
             
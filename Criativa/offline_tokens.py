@@ -0,0 +1,92 @@
+"""
+TOKENS DE LICENÇA OFFLINE (Ed25519) - VERIFICAÇÃO
+Cópia da parte de verificação de offline_tokens.py (raiz do repositório):
+mantenha as duas em sincronia.
+
+    LT1.<kid>.<payload>.<assinatura>       (base64url sem '=')
+
+O token é assinado pelo servidor e conferido aqui com a chave pública
+embutida no cliente (kid -> chave), sem segredo compartilhado nem rede.
+"""
+
+import base64
+import json
+import time
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+
+TOKEN_PREFIX = 'LT1'
+
+# Tolerância para relógios um pouco adiantados/atrasados entre servidor e PDV
+CLOCK_SKEW = 300
+
+
+class InvalidToken(ValueError):
+    """Token malformado, com assinatura inválida, de chave desconhecida ou vencido"""
+
+
+class LicenseExpired(InvalidToken):
+    """Token autêntico, mas a licença que ele descreve já expirou"""
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def load_public_keys(public_keys):
+    """kid -> chave pública (base64url dos 32 bytes) em kid -> Ed25519PublicKey"""
+    return {kid: Ed25519PublicKey.from_public_bytes(_b64decode(value))
+            for kid, value in public_keys.items()}
+
+
+def decode_token(token, public_keys, now=None):
+    """
+    Confere assinatura e validade de um token.
+
+    Args:
+        public_keys: kid -> chave pública (base64url ou Ed25519PublicKey)
+        now: instante unix da conferência (padrão: agora)
+
+    Returns:
+        dict: license_key, hwid, plan, expires_at, not_after, issued_at, kid
+
+    Raises:
+        LicenseExpired: a licença expirou (token autêntico)
+        InvalidToken: qualquer outro problema
+    """
+    now = time.time() if now is None else now
+    parts = token.split('.') if isinstance(token, str) else []
+    if len(parts) != 4 or parts[0] != TOKEN_PREFIX:
+        raise InvalidToken('Token em formato desconhecido')
+    _, kid, payload, signature = parts
+
+    public_key = public_keys.get(kid)
+    if public_key is None:
+        raise InvalidToken(f'Token assinado com chave desconhecida ({kid})')
+    if not isinstance(public_key, Ed25519PublicKey):
+        public_key = load_public_keys({kid: public_key})[kid]
+
+    try:
+        public_key.verify(_b64decode(signature), f'{TOKEN_PREFIX}.{kid}.{payload}'.encode('ascii'))
+        claims = json.loads(_b64decode(payload))
+    except (InvalidSignature, ValueError):
+        raise InvalidToken('Assinatura do token inválida')
+
+    if now + CLOCK_SKEW < claims['i']:
+        raise InvalidToken('Relógio do computador anterior à emissão do token')
+    # Antes do not-after (que nunca passa da expiração): licença vencida não é só token vencido
+    if claims.get('e') is not None and now > claims['e']:
+        raise LicenseExpired('Licença expirada')
+    if now > claims['n']:
+        raise InvalidToken('Token vencido: conecte à internet para renovar')
+
+    return {
+        'license_key': claims['k'],
+        'hwid': claims['h'],
+        'plan': claims.get('p'),
+        'expires_at': claims.get('e'),
+        'not_after': claims['n'],
+        'issued_at': claims['i'],
+        'kid': kid,
+    }
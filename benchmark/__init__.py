@@ -0,0 +1,11 @@
+"""
+BENCHMARK DAS APIS DE VALIDAÇÃO
+Semeia um banco local, sobe o servidor no gunicorn e mede latência,
+vazão e queries por request de /api/validate (servidor_licencas_v3)
+e /api/validar + /api/ativar (servidor_validacao).
+
+Uso:
+    python -m benchmark run --target v3 --licenses 5000 --logs 200000 --duration 30
+    python -m benchmark run --target validacao --concurrency 32 --workers 4
+    python -m benchmark compare antes.json depois.json
+"""
@@ -0,0 +1,185 @@
+"""
+Linha de comando do benchmark (python -m benchmark)
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmark.load import GunicornServer, build_requests, run_load, server_env
+from benchmark.seed import REPO_DIR, seed
+
+DEFAULT_MIX = {
+    'v3': 'valid=70,cloned=10,expired=10,not_found=10',
+    'validacao': 'valid=60,cloned=10,expired=10,not_found=10,activate=10',
+}
+
+
+def percentile(sorted_values, pct):
+    """Percentil nearest-rank"""
+    if not sorted_values:
+        return None
+    rank = max(int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(latency for _, _, latency, _ in samples)
+    queries = [q for _, _, _, q in samples if q is not None]
+    statuses = {}
+    for _, status, _, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'requests': len(samples),
+        'errors': statuses.get('0', 0) + sum(n for s, n in statuses.items() if s.startswith('5')),
+        'rps': len(samples) / elapsed if elapsed else 0.0,
+        'latency_ms': {
+            'p50': _ms(percentile(latencies, 50)),
+            'p95': _ms(percentile(latencies, 95)),
+            'p99': _ms(percentile(latencies, 99)),
+            'mean': _ms(sum(latencies) / len(latencies)) if latencies else None,
+            'max': _ms(latencies[-1]) if latencies else None,
+        },
+        'db_queries_per_request': sum(queries) / len(queries) if queries else None,
+        'status_codes': statuses,
+    }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def cmd_run(args):
+    mix = parse_mix(args.mix or DEFAULT_MIX[args.target])
+    env = server_env(args.database_url)
+    workdir = args.workdir or tempfile.mkdtemp(prefix=f'bench_{args.target}_')
+    os.makedirs(workdir, exist_ok=True)
+
+    logs = args.logs if args.target == 'v3' else 0
+    print(f"🌱 Semeando {args.licenses} licenças e {logs} logs em {args.database_url or workdir}")
+    manifest = seed(args.target, workdir, env, args.licenses, logs, args.database_url)
+    builders = build_requests(args.target, manifest)
+    unknown = [name for name in mix if name not in builders]
+    if unknown:
+        print(f"❌ Cenários desconhecidos para {args.target}: {', '.join(unknown)}")
+        return 2
+
+    with GunicornServer(args.target, workdir, env, workers=args.workers, threads=args.threads) as server:
+        if args.warmup:
+            run_load(server.url, builders, mix, args.warmup, args.concurrency)
+        print(f"🚀 {args.duration}s com {args.concurrency} clientes contra {server.url}")
+        started = time.monotonic()
+        samples = run_load(server.url, builders, mix, args.duration, args.concurrency)
+        elapsed = time.monotonic() - started
+
+    by_scenario = {}
+    for name in mix:
+        subset = [s for s in samples if s[0] == name]
+        by_scenario[name] = summarize(subset, elapsed)
+
+    result = {
+        'commit': git_commit(),
+        'started_at': datetime.now().isoformat(),
+        'target': args.target,
+        'config': {
+            'licenses': args.licenses,
+            'logs': args.logs,
+            'duration': args.duration,
+            'concurrency': args.concurrency,
+            'workers': args.workers,
+            'threads': args.threads,
+            'database': 'postgres' if args.database_url else 'sqlite',
+            'mix': mix,
+        },
+        'overall': summarize(samples, elapsed),
+        'by_scenario': by_scenario,
+    }
+
+    output = args.output or f"bench_{args.target}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    overall = result['overall']
+    print(f"✅ {overall['requests']} requests | {overall['rps']:.1f} req/s | "
+          f"p50 {overall['latency_ms']['p50']} ms | p95 {overall['latency_ms']['p95']} ms | "
+          f"p99 {overall['latency_ms']['p99']} ms | queries/req {overall['db_queries_per_request']}")
+    print(f"📄 Resultado: {output}")
+    return 0
+
+
+def cmd_compare(args):
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    def row(label, old, new):
+        if old is None or new is None:
+            print(f"  {label:<24} {old!s:>12} {new!s:>12}")
+            return
+        delta = (new - old) / old * 100 if old else 0.0
+        print(f"  {label:<24} {old:>12.3f} {new:>12.3f} {delta:>+8.1f}%")
+
+    print(f"{(before.get('commit') or '?')[:10]} → {(after.get('commit') or '?')[:10]} ({after['target']})")
+    for scope in ['overall'] + sorted(set(before['by_scenario']) & set(after['by_scenario'])):
+        old = before['overall'] if scope == 'overall' else before['by_scenario'][scope]
+        new = after['overall'] if scope == 'overall' else after['by_scenario'][scope]
+        print(f"[{scope}]")
+        row('req/s', old['rps'], new['rps'])
+        for pct in ('p50', 'p95', 'p99'):
+            row(f'latency {pct} (ms)', old['latency_ms'][pct], new['latency_ms'][pct])
+        row('queries/request', old['db_queries_per_request'], new['db_queries_per_request'])
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmark', description='Benchmark das APIs de validação')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='semeia, sobe o gunicorn e mede')
+    run.add_argument('--target', choices=('v3', 'validacao'), default='v3')
+    run.add_argument('--licenses', type=int, default=2000)
+    run.add_argument('--logs', type=int, default=50000, help='linhas em validation_logs (só v3)')
+    run.add_argument('--duration', type=float, default=20, help='segundos de medição')
+    run.add_argument('--warmup', type=float, default=3, help='segundos de aquecimento (não medidos)')
+    run.add_argument('--concurrency', type=int, default=16)
+    run.add_argument('--workers', type=int, default=2, help='workers do gunicorn')
+    run.add_argument('--threads', type=int, default=1, help='threads por worker do gunicorn')
+    run.add_argument('--mix', help='pesos por cenário, ex.: valid=70,cloned=10,expired=10,not_found=10')
+    run.add_argument('--database-url', help='PostgreSQL local (padrão: SQLite no diretório de trabalho)')
+    run.add_argument('--workdir', help='diretório do banco semeado e do gunicorn.log (padrão: temporário)')
+    run.add_argument('--output', help='arquivo JSON de resultado')
+    run.set_defaults(func=cmd_run)
+
+    compare = commands.add_parser('compare', help='compara dois resultados JSON')
+    compare.add_argument('before')
+    compare.add_argument('after')
+    compare.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+Servidor sob gunicorn + cliente concorrente com mix de cenários
+"""
+
+import itertools
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+from benchmark.seed import REPO_DIR
+
+APPS = {
+    'v3': 'servidor_licencas_v3:app',
+    'validacao': 'servidor_validacao:app',
+}
+
+BENCH_API_KEY = 'benchmark-api-key'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def server_env(database_url=None):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = REPO_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    env['API_KEY'] = BENCH_API_KEY
+    env['DB_QUERY_HEADER'] = '1'
+    # O gerador de carga sai de um único IP: o limite de taxa derrubaria tudo em 429
+    env['RATE_LIMIT_ENABLED'] = '0'
+    if database_url:
+        env['DATABASE_URL'] = database_url
+    else:
+        env.pop('DATABASE_URL', None)
+    return env
+
+
+class GunicornServer:
+    """Sobe `gunicorn <app>` no diretório do banco semeado e espera o /health"""
+
+    def __init__(self, target, workdir, env, workers=2, threads=1, startup_timeout=30):
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self.command = [
+            sys.executable, '-m', 'gunicorn', APPS[target],
+            '-b', f'127.0.0.1:{self.port}',
+            '-w', str(workers),
+            '--threads', str(threads),
+            '--chdir', workdir,
+            '--log-level', 'warning',
+        ]
+        self.workdir = workdir
+        self.env = env
+        self.startup_timeout = startup_timeout
+        self.process = None
+
+    def __enter__(self):
+        self.log = open(os.path.join(self.workdir, 'gunicorn.log'), 'w')
+        self.process = subprocess.Popen(self.command, cwd=self.workdir, env=self.env,
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'gunicorn saiu com código {self.process.returncode} (veja gunicorn.log)')
+            try:
+                if requests.get(f'{self.url}/health', timeout=1).status_code == 200:
+                    return self
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        self.__exit__(None, None, None)
+        raise RuntimeError('gunicorn não respondeu ao /health a tempo')
+
+    def __exit__(self, *exc):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.log.close()
+
+
+def build_requests(target, manifest):
+    """
+    Para cada cenário, uma função rng -> (método, caminho, json).
+
+    v3: valid / cloned (HWID errado: bloqueia e depois cai em "blocked") / expired / not_found
+    validacao: os mesmos em /api/validar + activate (códigos pendentes em /api/ativar)
+    """
+    def pick(name):
+        pool = manifest.get(name) or manifest['not_found']
+        return lambda rng: rng.choice(pool)
+
+    builders = {}
+    if target == 'v3':
+        for name in ('valid', 'cloned', 'expired', 'not_found'):
+            chooser = pick(name)
+            wrong_hwid = name == 'cloned'
+
+            def build(rng, chooser=chooser, wrong_hwid=wrong_hwid):
+                key, hwid = chooser(rng)
+                return 'POST', '/api/validate', {
+                    'license_key': key,
+                    'hwid': 'CLON-E000-0000-0000' if wrong_hwid else hwid,
+                }
+            builders[name] = build
+    else:
+        for name in ('valid', 'cloned', 'expired', 'not_found'):
+            chooser = pick(name)
+            wrong_hwid = name == 'cloned'
+
+            def build(rng, chooser=chooser, wrong_hwid=wrong_hwid):
+                code, hwid = chooser(rng)
+                return 'POST', '/api/validar', {
+                    'codigo': code,
+                    'hwid': 'CLON-E000-0000-0000' if wrong_hwid else hwid,
+                }
+            builders[name] = build
+
+        # Cada código pendente é ativado uma vez; depois cai no caminho "já ativada"
+        pending = itertools.cycle(manifest.get('pending') or manifest['not_found'])
+        lock = threading.Lock()
+
+        def build_activate(rng):
+            with lock:
+                code, hwid = next(pending)
+            return 'POST', '/api/ativar', {'codigo': code, 'hwid': hwid}
+        builders['activate'] = build_activate
+
+    return builders
+
+
+def run_load(base_url, builders, mix, duration, concurrency, seed_value=42):
+    """
+    Dispara requisições por `duration` segundos com `concurrency` threads.
+
+    Returns:
+        list: (cenário, status, latência em segundos, queries ou None)
+    """
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = []
+    samples_lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+    headers = {'X-API-Key': BENCH_API_KEY}
+
+    def worker(index):
+        rng = random.Random(seed_value + index)
+        session = requests.Session()
+        local = []
+        while time.monotonic() < stop_at:
+            name = rng.choices(names, weights)[0]
+            method, path, payload = builders[name](rng)
+            start = time.perf_counter()
+            try:
+                response = session.request(method, base_url + path, json=payload, headers=headers, timeout=30)
+                status = response.status_code
+                queries = response.headers.get('X-DB-Queries')
+                queries = int(queries) if queries is not None else None
+            except requests.RequestException:
+                status, queries = 0, None
+            local.append((name, status, time.perf_counter() - start, queries))
+        with samples_lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
@@ -0,0 +1,141 @@
+"""
+Popula o banco do benchmark (SQLite no diretório de trabalho ou um PostgreSQL local)
+"""
+
+import json
+import os
+import random
+import string
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Fração das licenças semeadas para cada cenário; o resto é "valid"
+EXPIRED_FRACTION = 0.1
+CLONED_FRACTION = 0.1
+PENDING_FRACTION = 0.2   # só servidor_validacao: códigos para /api/ativar
+
+
+def random_block(rng):
+    return ''.join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(4))
+
+
+def v3_key(rng):
+    return '-'.join(random_block(rng) for _ in range(4))
+
+
+def criat_code(rng):
+    return 'CRIAT-' + '-'.join(random_block(rng) for _ in range(3))
+
+
+def hwid_for(i):
+    return f"BNCH-{i:04X}-{(i * 7919) % 65536:04X}-0000"[:19]
+
+
+def _connect(workdir, database_url, sqlite_name):
+    if database_url:
+        import psycopg2
+        return psycopg2.connect(database_url), '%s'
+    import sqlite3
+    return sqlite3.connect(os.path.join(workdir, sqlite_name)), '?'
+
+
+def _create_schema(target, workdir, env):
+    """O schema vem do próprio servidor (mesmo código de init_db/migrações)"""
+    script = 'servidor_licencas_v3.py' if target == 'v3' else 'servidor_validacao.py'
+    command = [sys.executable, os.path.join(REPO_DIR, script), 'init']
+    subprocess.run(command, cwd=workdir, env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+def seed(target, workdir, env, licenses, logs, database_url=None, seed_value=42):
+    """
+    Cria o schema e insere `licenses` licenças e `logs` linhas de log.
+
+    Returns:
+        dict: chaves separadas por cenário (gravado também em manifest.json)
+    """
+    rng = random.Random(seed_value)
+    _create_schema(target, workdir, env)
+    now = datetime.now()
+    manifest = {'target': target, 'valid': [], 'expired': [], 'cloned': [], 'pending': [], 'not_found': []}
+
+    if target == 'v3':
+        conn, ph = _connect(workdir, database_url, 'licenses.db')
+        rows = []
+        for i in range(licenses):
+            key = v3_key(rng)
+            hwid = hwid_for(i)
+            roll = rng.random()
+            if roll < EXPIRED_FRACTION:
+                scenario, expires_at = 'expired', now - timedelta(days=rng.randint(1, 90))
+            elif roll < EXPIRED_FRACTION + CLONED_FRACTION:
+                scenario, expires_at = 'cloned', now + timedelta(days=365)
+            else:
+                scenario, expires_at = 'valid', now + timedelta(days=365)
+            manifest[scenario].append([key, hwid])
+            rows.append((key, hwid, hwid, 'standard', (now - timedelta(days=30)).isoformat(),
+                         expires_at.isoformat(), 'active', f'Cliente {i}'))
+        cur = conn.cursor()
+        cur.executemany(f'''
+            INSERT INTO licenses (license_key, hwid, bound_hwid, plan, created_at, expires_at, status, client_name)
+            VALUES ({', '.join([ph] * 8)})
+        ''', rows)
+
+        all_keys = [row[0] for row in rows] or ['XXXX-XXXX-XXXX-XXXX']
+        batch = []
+        for i in range(logs):
+            key = rng.choice(all_keys)
+            batch.append((key, hwid_for(i % max(licenses, 1)),
+                          (now - timedelta(seconds=rng.randint(0, 90 * 86400))).isoformat(),
+                          '127.0.0.1', 'success', None, 'Validação bem-sucedida'))
+            if len(batch) >= 10000:
+                _insert_logs(cur, ph, batch)
+                batch = []
+        if batch:
+            _insert_logs(cur, ph, batch)
+    else:
+        conn, ph = _connect(workdir, database_url, 'licencas.db')
+        rows = []
+        for i in range(licenses):
+            code = criat_code(rng)
+            hwid = hwid_for(i)
+            roll = rng.random()
+            expiry = (now + timedelta(days=365)).strftime('%Y-%m-%d')
+            status, bound = 'ativa', hwid
+            if roll < EXPIRED_FRACTION:
+                scenario, expiry = 'expired', (now - timedelta(days=rng.randint(1, 90))).strftime('%Y-%m-%d')
+            elif roll < EXPIRED_FRACTION + CLONED_FRACTION:
+                scenario = 'cloned'
+            elif roll < EXPIRED_FRACTION + CLONED_FRACTION + PENDING_FRACTION:
+                scenario, status, bound = 'pending', 'pendente', None
+            else:
+                scenario = 'valid'
+            manifest[scenario].append([code, hwid])
+            rows.append((code, f'Cliente {i}', 365, (now - timedelta(days=30)).strftime('%Y-%m-%d'),
+                         expiry, bound, now.strftime('%Y-%m-%d') if bound else None, status, None))
+        cur = conn.cursor()
+        cur.executemany(f'''
+            INSERT INTO licencas (codigo, cliente, dias_validade, data_criacao, data_expiracao,
+                                  hwid, data_ativacao, status, observacoes)
+            VALUES ({', '.join([ph] * 9)})
+        ''', rows)
+
+    conn.commit()
+    conn.close()
+
+    # Chaves inexistentes com o mesmo formato das reais
+    make_key = v3_key if target == 'v3' else criat_code
+    manifest['not_found'] = [[make_key(rng), hwid_for(i)] for i in range(max(100, licenses // 10))]
+
+    with open(os.path.join(workdir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def _insert_logs(cur, ph, batch):
+    cur.executemany(f'''
+        INSERT INTO validation_logs (license_key, hwid, checked_at, ip_address, result, detected_hwid, message)
+        VALUES ({', '.join([ph] * 7)})
+    ''', batch)
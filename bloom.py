@@ -0,0 +1,228 @@
+"""
+FILTRO DE CHAVES EXISTENTES (BLOOM)
+Responde "com certeza não existe" sem ir ao banco, para cortar tráfego de
+força bruta ou de chaves digitadas errado nos endpoints de validação.
+
+O filtro nunca dá falso negativo para chaves que ele já viu; chaves criadas
+por outro worker/processo (bot, outro gunicorn worker) entram pela atualização
+incremental que um negativo dispara, no máximo uma a cada `refresh_interval`
+(uma enxurrada de chaves inventadas custa uma consulta por intervalo, não uma
+por chave). Entre atualizações o negativo é recusado direto: uma chave criada
+em outro processo pode levar até `refresh_interval` para ser aceita aqui.
+Se o carregamento falhar, o filtro fica "aberto" (deixa tudo passar para o banco).
+"""
+
+import hashlib
+import math
+import threading
+import time
+
+
+class BloomFilter:
+    """
+    Filtro de Bloom de tamanho fixo.
+
+    Args:
+        capacity: número de chaves previsto
+        error_rate: taxa de falso positivo desejada com `capacity` chaves
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(1, int(capacity))
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Hash duplo (Kirsch-Mitzenmacher): k posições a partir de dois hashes de 64 bits
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def estimated_error_rate(self):
+        """Falso positivo esperado com o número atual de chaves"""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+
+class KeyFilter:
+    """
+    Conjunto aproximado das chaves de licença existentes.
+
+    Args:
+        load_all: função -> (iterável de chaves, cursor) com todas as chaves
+        load_since: função(cursor) -> (iterável de chaves, novo cursor) com as criadas depois do cursor
+        refresh_interval: intervalo mínimo entre atualizações incrementais (e espera após falha)
+        rebuild_interval: idade máxima do filtro antes de reconstruí-lo (em segundo plano)
+        error_rate: taxa de falso positivo alvo
+        min_capacity: capacidade mínima (o filtro é dimensionado para o dobro das chaves atuais)
+        enabled: False faz might_exist() sempre responder True
+    """
+
+    def __init__(self, load_all, load_since, refresh_interval=5.0, rebuild_interval=600.0,
+                 error_rate=0.001, min_capacity=10000, enabled=True):
+        self._load_all = load_all
+        self._load_since = load_since
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.error_rate = error_rate
+        self.min_capacity = min_capacity
+        self.enabled = enabled
+        self._bloom = None
+        self._cursor = None
+        self._built_at = 0.0
+        self._refresh_started = None
+        self._refresh_ok = False
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._rebuilding = False
+        self._failed_at = None
+        self.rejected = 0
+        self.passed = 0
+        self.refreshes = 0
+        self.rebuilds = 0
+        self.failures = 0
+
+    def might_exist(self, key):
+        """False = a chave certamente não existe; True = consultar o banco"""
+        if not self.enabled:
+            return True
+        bloom = self._bloom
+        if bloom is None:
+            bloom = self._build_now()
+            if bloom is None:
+                return True
+        elif time.monotonic() - self._built_at > self.rebuild_interval:
+            self._rebuild_in_background()
+
+        if key in bloom:
+            self.passed += 1
+            return True
+
+        # Pode ter sido criada em outro processo: busca as novas (ou usa a atualização
+        # recente) antes de recusar; se a carga falhou, na dúvida consulta o banco
+        if not self.refresh() or key in self._bloom:
+            self.passed += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def add(self, key):
+        """Registra uma chave recém-criada neste processo"""
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(key)
+                if self._bloom.count > self._bloom.capacity:
+                    # Acima da capacidade a taxa de falso positivo sobe: redimensiona
+                    self._built_at = 0.0
+
+    def refresh(self, force=False):
+        """
+        Atualização incremental, no máximo uma a cada refresh_interval (`force` ignora o
+        intervalo). Dentro do intervalo, ou esperando uma atualização em andamento, devolve
+        o resultado da última. True se o filtro está atualizado; False se a carga falhou.
+        """
+        if self._bloom is None:
+            return False
+        with self._refresh_lock:
+            started = time.monotonic()
+            last = self._refresh_started
+            if not force and last is not None and started - last < self.refresh_interval:
+                return self._refresh_ok
+            try:
+                # I/O fora de self._lock: might_exist() de chaves conhecidas segue respondendo
+                keys, cursor = self._load_since(self._cursor)
+            except Exception as e:
+                self.failures += 1
+                self._refresh_started = started
+                self._refresh_ok = False
+                print(f"❌ Filtro de chaves: falha na atualização incremental: {e}")
+                return False
+            with self._lock:
+                bloom = self._bloom
+                for key in keys:
+                    # A janela relida pode repetir chaves: não infla a contagem
+                    if key not in bloom:
+                        bloom.add(key)
+                self._cursor = cursor
+            self._refresh_started = started
+            self._refresh_ok = True
+            self.refreshes += 1
+        return True
+
+    def rebuild(self):
+        """Recarrega todas as chaves em um filtro novo e troca de uma vez"""
+        keys, cursor = self._load_all()
+        keys = list(keys)
+        bloom = BloomFilter(max(self.min_capacity, 2 * len(keys)), self.error_rate)
+        for key in keys:
+            bloom.add(key)
+        with self._lock:
+            # Chaves criadas durante a carga entram na próxima atualização incremental
+            self._bloom = bloom
+            self._cursor = cursor
+            self._built_at = time.monotonic()
+            self.rebuilds += 1
+        return bloom
+
+    def _build_now(self, force=False):
+        with self._build_lock:
+            if not force:
+                if self._bloom is not None:
+                    return self._bloom
+                if self._failed_at is not None and time.monotonic() - self._failed_at < self.refresh_interval:
+                    return None
+            try:
+                bloom = self.rebuild()
+                self._failed_at = None
+                return bloom
+            except Exception as e:
+                self.failures += 1
+                self._failed_at = time.monotonic()
+                print(f"❌ Filtro de chaves: falha ao carregar (seguindo sem filtro): {e}")
+                return None
+
+    def _rebuild_in_background(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+
+        def run():
+            try:
+                if self._build_now(force=True) is None:
+                    # Banco fora do ar: mantém o filtro atual e tenta de novo em refresh_interval
+                    self._built_at = time.monotonic() - self.rebuild_interval + self.refresh_interval
+            finally:
+                self._rebuilding = False
+
+        threading.Thread(target=run, name='key-filter-rebuild', daemon=True).start()
+
+    def stats(self):
+        bloom = self._bloom
+        return {
+            'enabled': self.enabled,
+            'ready': bloom is not None,
+            'keys': bloom.count if bloom else 0,
+            'capacity': bloom.capacity if bloom else 0,
+            'size_bytes': len(bloom._bits) if bloom else 0,
+            'estimated_error_rate': round(bloom.estimated_error_rate(), 6) if bloom else None,
+            'rejected': self.rejected,
+            'passed': self.passed,
+            'refreshes': self.refreshes,
+            'rebuilds': self.rebuilds,
+            'failures': self.failures,
+        }
@@ -14,6 +14,8 @@ import random
 import string
 import requests
 
+from license_keys import generate_key, PREFIX_CRIAT
+
 # ============================================
 # CONFIGURAÇÕES - ALTERE AQUI
 # ============================================
@@ -87,6 +89,8 @@ db.execute('''
         observacoes TEXT
     )
 ''')
+# Mesmo índice do servidor_validacao: varredura de expiração e contagens por status
+db.execute('CREATE INDEX IF NOT EXISTS idx_licencas_status_expiracao ON licencas (status, data_expiracao)')
 db.commit()
 
 # ============================================
@@ -94,20 +98,8 @@ db.commit()
 # ============================================
 
 def gerar_codigo():
-    """Gera código único de licença no formato CRIAT-XXXX-XXXX-XXXX"""
-    # Gera 3 blocos de 4 caracteres hexadecimais
-    import random
-    import string
-    
-    def gerar_bloco():
-        """Gera um bloco de 4 caracteres alfanuméricos"""
-        caracteres = string.ascii_uppercase + string.digits
-        return ''.join(random.choice(caracteres) for _ in range(4))
-    
-    parte1 = gerar_bloco()
-    parte2 = gerar_bloco()
-    parte3 = gerar_bloco()
-    return f"CRIAT-{parte1}-{parte2}-{parte3}"
+    """Gera código único de licença no formato CRIAT2-XXXX-XXXX-XXXC (C = dígito verificador)"""
+    return generate_key(PREFIX_CRIAT)
 
 
 def gerar_assinatura(codigo, hwid, data_expiracao):
@@ -584,29 +576,29 @@ def cmd_stats(message):
         return
     
     try:
-        # Total de licenças
-        total = db.execute('SELECT COUNT(*) FROM licencas').fetchone()[0]
-        
-        # Por status
-        ativas = db.execute("SELECT COUNT(*) FROM licencas WHERE status = 'ativa'").fetchone()[0]
-        pendentes = db.execute("SELECT COUNT(*) FROM licencas WHERE status = 'pendente'").fetchone()[0]
-        revogadas = db.execute("SELECT COUNT(*) FROM licencas WHERE status = 'revogada'").fetchone()[0]
-        
-        # Expirando em 30 dias
+        # Por status (o servidor de validação marca as vencidas como 'expirada')
+        por_status = {
+            linha['status']: linha['total']
+            for linha in db.execute('SELECT status, COUNT(*) AS total FROM licencas GROUP BY status').fetchall()
+        }
+        total = sum(por_status.values())
+        
+        # Expirando em 30 dias (índice status + data_expiracao)
         data_limite = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
         expirando = db.execute('''
-            SELECT COUNT(*) FROM licencas 
+            SELECT COUNT(*) AS total FROM licencas 
             WHERE status = 'ativa' 
             AND data_expiracao <= ?
-        ''', (data_limite,)).fetchone()[0]
+        ''', (data_limite,)).fetchone()['total']
         
         resposta = f"""
 📊 *Estatísticas de Licenças*
 
 📋 *Total:* {total}
-✅ *Ativas:* {ativas}
-⏳ *Pendentes:* {pendentes}
-❌ *Revogadas:* {revogadas}
+✅ *Ativas:* {por_status.get('ativa', 0)}
+⏳ *Pendentes:* {por_status.get('pendente', 0)}
+❌ *Revogadas:* {por_status.get('revogada', 0)}
+⌛ *Expiradas:* {por_status.get('expirada', 0)}
 ⚠️ *Expirando em 30 dias:* {expirando}
         """
         
@@ -772,7 +764,8 @@ def processar_buscar(message):
     emoji_status = {
         'ativa': '✅',
         'pendente': '⏳',
-        'revogada': '❌'
+        'revogada': '❌',
+        'expirada': '⚠️'
     }.get(lic['status'], '❓')
     
     resposta = f"""
@@ -0,0 +1,305 @@
+"""
+DETECTOR DE CLONAGEM (JANELAS DESLIZANTES)
+Acompanha, por licença, quantos HWIDs e IPs distintos apareceram em cada
+janela de tempo (ex.: 5 min, 1 h, 24 h) e calcula um score de risco a cada
+validação, em tempo constante: nada de varrer validation_logs.
+
+Cada processo tem o seu estado (como o limite de taxa): com N workers cada
+um vê a parte do tráfego que recebeu. Com `state_dir`, cada processo grava
+um snapshot (clone_<pid>.json) periodicamente e, ao subir, junta os
+snapshots existentes; snapshots mais velhos que a maior janela são apagados.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class _LicenseWindows:
+    """HWIDs e IPs vistos por janela: valor -> último instante, em ordem de último uso"""
+
+    __slots__ = ('hwids', 'ips', 'last_seen', 'alerted_at')
+
+    def __init__(self, count):
+        self.hwids = [OrderedDict() for _ in range(count)]
+        self.ips = [OrderedDict() for _ in range(count)]
+        self.last_seen = 0.0
+        self.alerted_at = 0.0
+
+
+class CloneDetector:
+    """
+    Score de risco de clonagem por licença.
+
+    Por janela: hwid_points por HWID além do primeiro + ip_points por IP além
+    de `ip_allowance` (troca de rede, 4G...). O score é o da pior janela,
+    limitado a 100; ao passar de `alert_score` dispara os `alert_handlers`
+    (no máximo um alerta por licença a cada `alert_cooldown` segundos).
+
+    Args:
+        windows: tamanhos das janelas em segundos
+        max_licenses: licenças em memória; acima disso sai a menos recente (LRU)
+        max_values: valores distintos guardados por janela (o score satura antes)
+        state_dir: diretório dos snapshots ('' = sem persistência)
+        enabled: False faz observe() não fazer nada
+    """
+
+    def __init__(self, windows=(300, 3600, 86400), hwid_points=50, ip_points=10, ip_allowance=3,
+                 alert_score=50, alert_cooldown=3600, max_licenses=100000, max_values=32,
+                 state_dir='', enabled=True):
+        self.windows = tuple(sorted(float(w) for w in windows))
+        if not self.windows or self.windows[0] <= 0:
+            raise ValueError('windows deve ter ao menos uma janela > 0')
+        self.hwid_points = hwid_points
+        self.ip_points = ip_points
+        self.ip_allowance = ip_allowance
+        self.alert_score = alert_score
+        self.alert_cooldown = alert_cooldown
+        self.max_licenses = max_licenses
+        self.max_values = max_values
+        self.state_dir = state_dir
+        self.enabled = enabled
+        self.alert_handlers = []
+        self._licenses = OrderedDict()   # license_key -> _LicenseWindows
+        self._lock = threading.Lock()
+        self._pid = None
+        self.recent_alerts = deque(maxlen=100)
+        self.observed = 0
+        self.alerts = 0
+        self.evicted = 0
+
+    def observe(self, license_key, hwid, ip_address, now=None, context=None):
+        """
+        Registra uma validação e devolve o score atual da licença.
+        Dispara os alert_handlers (fora do lock) se o score passou do limite;
+        `context` (ex.: id da licença) vai junto no alerta.
+        """
+        if not self.enabled:
+            return 0
+        self._ensure_loaded()
+        now = time.time() if now is None else now
+        alert = None
+        with self._lock:
+            entry = self._licenses.get(license_key)
+            if entry is None:
+                entry = self._licenses[license_key] = _LicenseWindows(len(self.windows))
+                while len(self._licenses) > self.max_licenses:
+                    self._licenses.popitem(last=False)
+                    self.evicted += 1
+            else:
+                self._licenses.move_to_end(license_key)
+            for i, window in enumerate(self.windows):
+                self._touch(entry.hwids[i], hwid, now, window)
+                if ip_address:
+                    self._touch(entry.ips[i], ip_address, now, window)
+            entry.last_seen = now
+            self.observed += 1
+
+            score = self._score(entry, now)
+            if score >= self.alert_score and now - entry.alerted_at >= self.alert_cooldown:
+                entry.alerted_at = now
+                self.alerts += 1
+                alert = self._describe(license_key, entry, score, now)
+                alert.update(context or {}, hwid=hwid, ip_address=ip_address)
+                self.recent_alerts.append(alert)
+
+        if alert is not None:
+            for handler in self.alert_handlers:
+                try:
+                    handler(alert)
+                except Exception as e:
+                    print(f"❌ Detector de clonagem: falha no alerta de {license_key}: {e}")
+        return score
+
+    def _touch(self, values, value, now, window):
+        values[value] = now
+        values.move_to_end(value)
+        # Mais antigos na frente: sai tudo que ficou fora da janela (O(1) amortizado)
+        while values:
+            oldest, seen = next(iter(values.items()))
+            if now - seen > window or len(values) > self.max_values:
+                del values[oldest]
+            else:
+                break
+
+    def _counts(self, entry, now):
+        """HWIDs e IPs distintos por janela (no máximo max_values por janela: custo constante)"""
+        counts = []
+        for i, window in enumerate(self.windows):
+            counts.append((sum(1 for seen in entry.hwids[i].values() if now - seen <= window),
+                           sum(1 for seen in entry.ips[i].values() if now - seen <= window)))
+        return counts
+
+    def _score(self, entry, now):
+        worst = 0
+        for hwids, ips in self._counts(entry, now):
+            worst = max(worst, self.hwid_points * max(0, hwids - 1)
+                        + self.ip_points * max(0, ips - self.ip_allowance))
+        return min(100, worst)
+
+    def _describe(self, license_key, entry, score, now):
+        counts = self._counts(entry, now)
+        return {
+            'license_key': license_key,
+            'score': score,
+            'windows': {str(int(window)): {'hwids': hwids, 'ips': ips}
+                        for window, (hwids, ips) in zip(self.windows, counts)},
+            'last_seen': entry.last_seen,
+            'last_alert': entry.alerted_at or None,
+            'at': now,
+        }
+
+    def risk(self, license_key):
+        """Score e contagens atuais da licença (None se não foi vista neste processo)"""
+        self._ensure_loaded()
+        now = time.time()
+        with self._lock:
+            entry = self._licenses.get(license_key)
+            if entry is None:
+                return None
+            return self._describe(license_key, entry, self._score(entry, now), now)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'windows': [int(w) for w in self.windows],
+                'licenses': len(self._licenses),
+                'observed': self.observed,
+                'alerts': self.alerts,
+                'evicted': self.evicted,
+            }
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.state_dir, f'clone_{pid}.json')
+
+    def _ensure_loaded(self):
+        """Carrega os snapshots no primeiro uso de cada processo (workers nascem por fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._licenses = OrderedDict()
+            if self.state_dir and os.path.isdir(self.state_dir):
+                try:
+                    self._load()
+                except Exception as e:
+                    print(f"❌ Detector de clonagem: falha ao carregar snapshots: {e}")
+
+    def _load(self):
+        now = time.time()
+        horizon = self.windows[-1]
+        merged = {}
+        for filename in os.listdir(self.state_dir):
+            if not (filename.startswith('clone_') and filename.endswith('.json')):
+                continue
+            path = os.path.join(self.state_dir, filename)
+            if now - os.path.getmtime(path) > horizon:
+                # Tudo nele já saiu da maior janela
+                os.remove(path)
+                continue
+            with open(path) as f:
+                data = json.load(f)
+            for license_key, item in data.items():
+                target = merged.setdefault(license_key, {'hwids': {}, 'ips': {}, 'alerted_at': 0.0})
+                for kind in ('hwids', 'ips'):
+                    for value, seen in item[kind].items():
+                        if seen > target[kind].get(value, 0.0):
+                            target[kind][value] = seen
+                target['alerted_at'] = max(target['alerted_at'], item.get('alerted_at', 0.0))
+
+        for license_key, item in sorted(merged.items(), key=lambda kv: max(kv[1]['hwids'].values(), default=0.0)):
+            entry = _LicenseWindows(len(self.windows))
+            for i, window in enumerate(self.windows):
+                for kind in ('hwids', 'ips'):
+                    values = getattr(entry, kind)[i]
+                    for value, seen in sorted(item[kind].items(), key=lambda kv: kv[1]):
+                        if now - seen <= window:
+                            values[value] = seen
+            if not any(entry.hwids):
+                continue
+            entry.last_seen = max(item['hwids'].values())
+            entry.alerted_at = item['alerted_at']
+            self._licenses[license_key] = entry
+        while len(self._licenses) > self.max_licenses:
+            self._licenses.popitem(last=False)
+
+    def snapshot(self):
+        """Estado serializável: a maior janela já contém o último instante de cada valor"""
+        with self._lock:
+            return {
+                license_key: {
+                    'hwids': dict(entry.hwids[-1]),
+                    'ips': dict(entry.ips[-1]),
+                    'alerted_at': entry.alerted_at,
+                }
+                for license_key, entry in self._licenses.items()
+            }
+
+    def save(self):
+        """Grava o snapshot deste processo (escrita atômica)"""
+        if not self.state_dir or self._pid != os.getpid():
+            return
+        os.makedirs(self.state_dir, exist_ok=True)
+        path = self._snapshot_path(os.getpid())
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+
+
+class TelegramNotifier:
+    """
+    Envia mensagens ao chat do administrador pelo Bot API do Telegram,
+    em uma thread própria (fila limitada: alertas excedentes são descartados).
+    """
+
+    def __init__(self, token, chat_id, max_queue=100, timeout=10):
+        self.token = token
+        self.chat_id = chat_id
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self.enabled = bool(token and chat_id)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.max_queue)
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='telegram-notifier', daemon=True).start()
+
+    def send(self, text):
+        """Enfileira a mensagem sem bloquear"""
+        if not self.enabled:
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(text)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        import requests
+        url = f'https://api.telegram.org/bot{self.token}/sendMessage'
+        while True:
+            text = self._queue.get()
+            try:
+                response = requests.post(url, json={'chat_id': self.chat_id, 'text': text}, timeout=self.timeout)
+                response.raise_for_status()
+                self.sent += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"❌ Telegram: falha ao enviar alerta: {e}")
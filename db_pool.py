@@ -0,0 +1,359 @@
+"""
+POOL DE CONEXÕES
+Pool thread-safe por processo para PostgreSQL (psycopg2) ou SQLite,
+com health check, reconexão de sockets mortos e métricas de uso
+"""
+
+import os
+import threading
+import time
+
+
+class PoolTimeout(Exception):
+    """Nenhuma conexão ficou livre dentro do tempo limite"""
+
+
+class PooledConnection:
+    """
+    Proxy de uma conexão emprestada do pool.
+
+    Repassa tudo para a conexão real; close() devolve ao pool em vez de fechar.
+    Como context manager (`with pool.getconn() as conn:`) devolve ao sair do
+    bloco, inclusive em return antecipado ou exceção (a transação aberta é
+    desfeita na devolução; faça commit dentro do bloco).
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get('_conn')
+        if conn is None:
+            raise AttributeError(f"Conexão já devolvida ao pool ({name})")
+        return getattr(conn, name)
+
+    @property
+    def raw(self):
+        """Conexão real (psycopg2 ou sqlite3)"""
+        return self._conn
+
+    @property
+    def state(self):
+        """Dict que acompanha a conexão real entre checkouts (ex.: comandos já preparados)"""
+        return self._pool.connection_state(self._conn)
+
+    def discard(self):
+        """Descarta a conexão (ex.: erro de socket) em vez de reutilizá-la"""
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.putconn(conn, discard=True)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.putconn(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class ConnectionPool:
+    """
+    Pool genérico de conexões.
+
+    Args:
+        connect: função que abre uma conexão nova
+        ping: função que testa a conexão (deve levantar exceção se estiver morta)
+        is_broken: função que diz se a conexão já está fechada/quebrada
+        reset: função chamada na devolução (ex.: rollback de transação aberta)
+        minconn: conexões mantidas abertas mesmo ociosas (abertas por warmup(), não no construtor)
+        maxconn: máximo de conexões simultâneas neste processo
+        timeout: segundos esperando uma conexão livre antes de PoolTimeout
+        healthcheck_interval: conexões ociosas há mais tempo que isso são testadas (ping)
+        max_idle: conexões acima de minconn ociosas há mais tempo que isso são fechadas
+    """
+
+    def __init__(self, connect, ping, is_broken, reset, minconn=1, maxconn=10,
+                 timeout=10.0, healthcheck_interval=30.0, max_idle=300.0):
+        if maxconn < 1 or minconn < 0 or minconn > maxconn:
+            raise ValueError('Configuração de pool inválida (0 <= min <= max, max >= 1)')
+
+        self._connect = connect
+        self._ping = ping
+        self._is_broken = is_broken
+        self._reset = reset
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self.max_idle = max_idle
+
+        # Chamado com o tempo de espera (segundos) a cada checkout, ex.: histograma de métricas
+        self.on_checkout = None
+
+        self._cond = threading.Condition()
+        self._inherited = []
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._idle = []      # [(conn, instante da devolução)]
+        self._size = 0       # conexões abertas (ociosas + emprestadas)
+        self._state = {}     # id(conn) -> dict de estado da sessão (some quando a conexão fecha)
+        self._stats = {
+            'checkouts': 0,
+            'created': 0,
+            'reconnects': 0,
+            'discarded': 0,
+            'exhausted': 0,
+            'timeouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+
+    def _check_pid(self):
+        """Após fork (gunicorn --preload) o filho começa com um pool vazio"""
+        if self._pid != os.getpid():
+            with self._cond:
+                if self._pid != os.getpid():
+                    # Não fecha: o socket é compartilhado com o processo pai.
+                    # Só mantém a referência para o GC não encerrar a sessão dele.
+                    self._inherited.extend(conn for conn, _ in self._idle)
+                    self._reset_state()
+
+    def warmup(self):
+        """
+        Abre conexões até minconn, para os primeiros requests não pagarem o connect.
+        Chame no processo que vai usá-las (no worker, após o fork: o construtor
+        não conecta porque o pool costuma ser criado no master com --preload).
+
+        Returns:
+            int: conexões abertas
+        """
+        self._check_pid()
+        opened = 0
+        while True:
+            with self._cond:
+                if self._size >= self.minconn:
+                    return opened
+                self._size += 1
+            try:
+                conn = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+            opened += 1
+
+    def connection_state(self, conn):
+        return self._state.setdefault(id(conn), {})
+
+    def _close_quietly(self, conn):
+        self._state.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def getconn(self):
+        """Empresta uma conexão (bloqueia até `timeout` se o pool estiver cheio)"""
+        self._check_pid()
+        start = time.monotonic()
+        deadline = start + self.timeout
+        conn = None
+        idle_since = None
+        counted_exhaustion = False
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    break
+                if not counted_exhaustion:
+                    self._stats['exhausted'] += 1
+                    counted_exhaustion = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(
+                        f'Pool esgotado: {self.maxconn} conexões em uso há mais de {self.timeout}s'
+                    )
+                self._cond.wait(remaining)
+
+        try:
+            if conn is None:
+                conn = self._open()
+            else:
+                conn = self._validate(conn, idle_since)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self._stats['checkouts'] += 1
+            self._stats['wait_time_total'] += waited
+            if waited > self._stats['wait_time_max']:
+                self._stats['wait_time_max'] = waited
+        if self.on_checkout is not None:
+            self.on_checkout(waited)
+
+        return PooledConnection(self, conn)
+
+    def _open(self):
+        conn = self._connect()
+        with self._cond:
+            self._stats['created'] += 1
+        return conn
+
+    def _validate(self, conn, idle_since):
+        """Health check: descarta sockets fechados e testa os ociosos há muito tempo"""
+        stale = self._is_broken(conn)
+        if not stale and time.monotonic() - idle_since > self.healthcheck_interval:
+            try:
+                self._ping(conn)
+            except Exception:
+                stale = True
+
+        if not stale:
+            return conn
+
+        self._close_quietly(conn)
+        with self._cond:
+            self._stats['reconnects'] += 1
+        return self._open()
+
+    def putconn(self, conn, discard=False):
+        """Devolve uma conexão ao pool"""
+        if self._pid != os.getpid():
+            return
+
+        if not discard:
+            try:
+                discard = self._is_broken(conn)
+                if not discard:
+                    self._reset(conn)
+            except Exception:
+                discard = True
+
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            if discard:
+                self._size -= 1
+                self._stats['discarded'] += 1
+            else:
+                self._idle.append((conn, now))
+
+            # Fecha o excedente ocioso acima de minconn (mais antigos primeiro)
+            while self._size > self.minconn and self._idle and now - self._idle[0][1] > self.max_idle:
+                old, _ = self._idle.pop(0)
+                self._size -= 1
+                expired.append(old)
+
+            self._cond.notify()
+
+        if discard:
+            self._close_quietly(conn)
+        for old in expired:
+            self._close_quietly(old)
+
+    def stats(self):
+        """Métricas do pool para dimensionamento sob carga"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._size - len(self._idle)
+            stats['min'] = self.minconn
+            stats['max'] = self.maxconn
+            stats['pid'] = self._pid
+        checkouts = stats['checkouts']
+        stats['wait_time_avg'] = stats['wait_time_total'] / checkouts if checkouts else 0.0
+        return stats
+
+    def closeall(self):
+        """Fecha todas as conexões ociosas"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+
+# ============================================================================
+# FÁBRICAS POR BANCO
+# ============================================================================
+
+def create_postgres_pool(dsn, minconn=1, maxconn=10, timeout=10.0,
+                         healthcheck_interval=30.0, max_idle=300.0, **connect_kwargs):
+    """Pool de conexões psycopg2 (keepalive TCP ligado para detectar sockets mortos)"""
+    import psycopg2
+    from psycopg2 import extensions
+
+    connect_kwargs.setdefault('keepalives', 1)
+    connect_kwargs.setdefault('keepalives_idle', 30)
+    connect_kwargs.setdefault('keepalives_interval', 10)
+    connect_kwargs.setdefault('keepalives_count', 3)
+
+    def connect():
+        return psycopg2.connect(dsn, **connect_kwargs)
+
+    def ping(conn):
+        cur = conn.cursor()
+        cur.execute('SELECT 1')
+        cur.close()
+        conn.rollback()
+
+    def is_broken(conn):
+        return conn.closed != 0
+
+    def reset(conn):
+        status = conn.get_transaction_status()
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            raise ConnectionError('Conexão em estado desconhecido')
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+
+    return ConnectionPool(connect, ping, is_broken, reset, minconn=minconn, maxconn=maxconn,
+                          timeout=timeout, healthcheck_interval=healthcheck_interval,
+                          max_idle=max_idle)
+
+
+def create_sqlite_pool(path, minconn=1, maxconn=10, timeout=10.0,
+                       healthcheck_interval=30.0, max_idle=300.0):
+    """Pool de conexões sqlite3 (cada conexão é usada por uma thread de cada vez)"""
+    import sqlite3
+
+    def connect():
+        conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def ping(conn):
+        conn.execute('SELECT 1').fetchone()
+
+    def is_broken(conn):
+        return False
+
+    def reset(conn):
+        if conn.in_transaction:
+            conn.rollback()
+
+    return ConnectionPool(connect, ping, is_broken, reset, minconn=minconn, maxconn=maxconn,
+                          timeout=timeout, healthcheck_interval=healthcheck_interval,
+                          max_idle=max_idle)
@@ -6,10 +6,10 @@ Interface gráfica para gerenciar licenças no servidor
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
 import requests
-import random
-import string
 from datetime import datetime
 
+from license_keys import generate_key
+
 class LicenseGeneratorGUI:
     def __init__(self, root):
         self.root = root
@@ -307,6 +307,7 @@ class LicenseGeneratorGUI:
         try:
             response = requests.get(
                 f"{self.api_url}/api/licenses",
+                params={"fields": "license_key,client_name,bound_hwid,status,expires_at,last_check"},
                 headers={
                     "X-API-Key": self.api_key,
                     "X-Admin-Password": self.admin_password
@@ -341,13 +342,8 @@ class LicenseGeneratorGUI:
             messagebox.showerror("Erro", f"Erro ao conectar com servidor:\n{str(e)}")
     
     def _generate_key(self):
-        """Gera chave aleatória"""
-        chars = string.ascii_uppercase + string.digits
-        parts = []
-        for _ in range(4):
-            part = ''.join(random.choice(chars) for _ in range(4))
-            parts.append(part)
-        return '-'.join(parts)
+        """Gera chave aleatória no formato LIC2-XXXX-XXXX-XXXX-XXXC (C = dígito verificador)"""
+        return generate_key()
 
 
 if __name__ == '__main__':
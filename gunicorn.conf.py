@@ -0,0 +1,42 @@
+"""
+CONFIGURAÇÃO DO GUNICORN
+Lida automaticamente quando o gunicorn roda na raiz do repositório
+(ex.: `gunicorn servidor_licencas_v3:app` no Render).
+
+O schema é criado/migrado uma vez no master (on_starting), antes dos workers:
+o import dos servidores não faz mais DDL, então workers novos (cold start,
+reciclagem) sobem sem tocar no banco. Como o master importa o módulo do app,
+os workers já nascem com ele carregado (mesmo efeito do --preload).
+
+Variáveis:
+    SKIP_DB_INIT=1      não cria/migra no boot (schema gerenciado à parte com `init`)
+    METRICS_DIR         snapshots de métricas antigos são apagados no boot
+"""
+
+import importlib
+import os
+import time
+
+# Apps servidos por este repositório que expõem init_schema()
+INIT_SCHEMA_MODULES = ('servidor_licencas_v3', 'servidor_validacao')
+
+
+def _app_module(server):
+    uri = getattr(server.app, 'app_uri', None) or getattr(server.cfg, 'wsgi_app', None) or ''
+    return uri.split(':')[0]
+
+
+def on_starting(server):
+    from metrics import wipe_directory
+    wipe_directory(os.environ.get('METRICS_DIR'))
+
+    module_name = _app_module(server)
+    if os.environ.get('SKIP_DB_INIT') == '1' or module_name not in INIT_SCHEMA_MODULES:
+        return
+
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    imported = time.perf_counter()
+    module.init_schema()
+    server.log.info('Schema de %s pronto: import %.0f ms, init %.0f ms', module_name,
+                    (imported - started) * 1000, (time.perf_counter() - imported) * 1000)
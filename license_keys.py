@@ -0,0 +1,76 @@
+"""
+FORMATO DAS CHAVES DE LICENÇA
+Chaves v2 levam um caractere verificador (ISO 7064 MOD 37-2), então chaves
+digitadas errado ou inventadas são recusadas só com CPU, antes de qualquer I/O.
+
+    LIC2-XXXX-XXXX-XXXX-XXXC   geradores (GUI) / servidor_licencas_v3
+    CRIAT2-XXXX-XXXX-XXXC      bot do Telegram / servidor_validacao
+
+Formatos já emitidos continuam aceitos (sem verificador, só o formato):
+
+    XXXX-XXXX-XXXX-XXXX
+    CRIAT-XXXX-XXXX-XXXX
+
+Chaves fora desses quatro formatos (livres) são recusadas na validação e, por
+isso, também na criação (/api/licenses/create e /bulk): migre-as gerando
+chaves novas com generate_key().
+
+Criativa/license_keys.py é uma cópia da parte de verificação (o cliente PDV
+é distribuído sem o resto do repositório): mantenha as duas em sincronia.
+"""
+
+import re
+import secrets
+
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+_VALUES = {ch: i for i, ch in enumerate(ALPHABET)}
+
+PREFIX_LIC = 'LIC2'
+PREFIX_CRIAT = 'CRIAT2'
+
+# prefixo -> número de caracteres aleatórios (o verificador fecha o último bloco de 4)
+_V2_RANDOM_CHARS = {PREFIX_LIC: 15, PREFIX_CRIAT: 11}
+
+_V2_PATTERN = re.compile(r'^(LIC2-[0-9A-Z]{4}-[0-9A-Z]{4}-[0-9A-Z]{4}-[0-9A-Z]{4}'
+                         r'|CRIAT2-[0-9A-Z]{4}-[0-9A-Z]{4}-[0-9A-Z]{4})$')
+_LEGACY_PATTERN = re.compile(r'^([0-9A-Z]{4}-[0-9A-Z]{4}-[0-9A-Z]{4}-[0-9A-Z]{4}'
+                             r'|CRIAT-[0-9A-Z]{4}-[0-9A-Z]{4}-[0-9A-Z]{4})$')
+
+
+def check_char(payload):
+    """
+    Caractere verificador ISO 7064 MOD 37-2 de `payload` (alfanumérico maiúsculo).
+    Módulo primo com pesos 2^i: pega toda troca de um caractere e toda
+    transposição de vizinhos. O resto 36 dá '*', que nunca sai numa chave
+    (generate_key sorteia outra e o formato só aceita [0-9A-Z]).
+    """
+    p = 0
+    for ch in payload:
+        p = (2 * (p + _VALUES[ch])) % 37
+    return (ALPHABET + '*')[(38 - p) % 37]
+
+
+def _payload(key):
+    # O prefixo entra no cálculo: uma chave LIC2 não vira CRIAT2 válida trocando o prefixo
+    return key[:-1].replace('-', '')
+
+
+def is_valid_key(key):
+    """True se `key` tem formato reconhecido (e verificador correto, nas chaves v2)"""
+    if not key or len(key) > 32:
+        return False
+    key = key.upper()
+    if _V2_PATTERN.match(key):
+        return check_char(_payload(key)) == key[-1]
+    return bool(_LEGACY_PATTERN.match(key))
+
+
+def generate_key(prefix=PREFIX_LIC):
+    """Nova chave v2 com verificador (LIC2-... ou CRIAT2-...)"""
+    while True:
+        body = ''.join(secrets.choice(ALPHABET) for _ in range(_V2_RANDOM_CHARS[prefix]))
+        check = check_char(prefix + body)
+        if check != '*':
+            break
+    body += check
+    return '-'.join([prefix] + [body[i:i + 4] for i in range(0, len(body), 4)])
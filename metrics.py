@@ -0,0 +1,282 @@
+"""
+MÉTRICAS NO FORMATO PROMETHEUS
+Contadores e histogramas em memória, exportados em texto para o /metrics.
+
+Com vários workers do gunicorn, defina METRICS_DIR: cada processo grava
+um snapshot (metrics_<pid>.json) a cada poucos segundos e o /metrics soma
+todos os arquivos. Contadores de workers que já morreram continuam na soma;
+gauges só contam processos vivos. Limpe o diretório ao subir o master.
+"""
+
+import atexit
+import json
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+
+# Buckets de latência em segundos (1 ms a 10 s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+@lru_cache(maxsize=512)
+def statement_label(query):
+    """Rótulo curto de um comando SQL: 'select_licenses', 'update_licenses', ..."""
+    text = ' '.join(query.split()).lower()
+    verb = text.split(' ', 1)[0] if text else 'unknown'
+    match = re.search(r'\b(?:from|into|update|table(?: if not exists)?|on)\s+([a-z_][a-z0-9_]*)', text)
+    return f'{verb}_{match.group(1)}' if match else verb
+
+
+class Counter:
+    def __init__(self, registry, name):
+        self._registry = registry
+        self.name = name
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram:
+    def __init__(self, registry, name, buckets):
+        self._registry = registry
+        self.name = name
+        self.buckets = tuple(buckets)
+        self.values = {}   # labels -> [contagem por bucket..., +Inf, soma]
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._registry.lock:
+            data = self.values.get(key)
+            if data is None:
+                data = self.values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[index] += 1
+                    break
+            else:
+                data[len(self.buckets)] += 1
+            data[-1] += value
+
+
+class MetricsRegistry:
+    """
+    Registro de métricas do processo.
+
+    Args:
+        directory: diretório compartilhado entre workers (None = só este processo)
+        flush_interval: segundos entre snapshots gravados em `directory`
+    """
+
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.directory = directory or None
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self._metrics = {}      # nome -> (tipo, help, objeto)
+        self._callbacks = []    # (tipo, nome, help, func)
+        self._ratios = []       # (nome, help, numerador, denominadores)
+        self._pid = None
+
+    def counter(self, name, help_text):
+        metric = Counter(self, name)
+        self._metrics[name] = ('counter', help_text, metric)
+        return metric
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        metric = Histogram(self, name, buckets)
+        self._metrics[name] = ('histogram', help_text, metric)
+        return metric
+
+    def counter_callback(self, name, help_text, func):
+        """func() -> número ou {labels(dict como tupla de pares): valor}; acumulado por processo"""
+        self._callbacks.append(('counter', name, help_text, func))
+
+    def gauge_callback(self, name, help_text, func):
+        """func() -> valor atual; somado entre os processos vivos"""
+        self._callbacks.append(('gauge', name, help_text, func))
+
+    def ratio_gauge(self, name, help_text, numerator, denominators):
+        """Gauge calculado após somar os workers: numerador / soma(denominadores)"""
+        self._ratios.append((name, help_text, numerator, tuple(denominators)))
+
+    # ------------------------------------------------------------------
+    # Snapshot e agregação entre workers
+    # ------------------------------------------------------------------
+
+    def snapshot(self):
+        """Estado deste processo em formato serializável"""
+        metrics = {}
+        with self.lock:
+            for name, (kind, help_text, metric) in self._metrics.items():
+                samples = [[list(map(list, key)), list(value) if isinstance(value, list) else value]
+                           for key, value in metric.values.items()]
+                entry = {'type': kind, 'help': help_text, 'samples': samples}
+                if kind == 'histogram':
+                    entry['buckets'] = list(metric.buckets)
+                metrics[name] = entry
+
+        for kind, name, help_text, func in self._callbacks:
+            try:
+                value = func()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            if not isinstance(value, dict):
+                value = {(): value}
+            metrics[name] = {
+                'type': kind,
+                'help': help_text,
+                'samples': [[list(map(list, key)), v] for key, v in value.items()],
+            }
+        return {'pid': os.getpid(), 'written_at': time.time(), 'metrics': metrics}
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.directory, f'metrics_{pid}.json')
+
+    def write_snapshot(self):
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._snapshot_path(os.getpid())
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+
+    def start(self):
+        """Sobe a thread de snapshots deste processo (idempotente; no-op sem METRICS_DIR)"""
+        if not self.directory or self._pid == os.getpid():
+            return
+        with self.lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name='metrics-snapshot', daemon=True).start()
+        atexit.register(self.write_snapshot)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                print(f"❌ Métricas: falha ao gravar snapshot: {e}")
+
+    def _collect(self):
+        snapshots = [self.snapshot()]
+        if self.directory and os.path.isdir(self.directory):
+            own = os.getpid()
+            for filename in os.listdir(self.directory):
+                if not (filename.startswith('metrics_') and filename.endswith('.json')):
+                    continue
+                try:
+                    with open(os.path.join(self.directory, filename)) as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if data.get('pid') == own:
+                    continue
+                data['alive'] = _pid_alive(data.get('pid'))
+                snapshots.append(data)
+        return snapshots
+
+    def render(self):
+        """Texto no formato de exposição do Prometheus, somando todos os workers"""
+        merged = {}
+        for snap in self._collect():
+            alive = snap.get('alive', True)
+            for name, entry in snap['metrics'].items():
+                if entry['type'] == 'gauge' and not alive:
+                    continue
+                target = merged.setdefault(name, {
+                    'type': entry['type'], 'help': entry['help'],
+                    'buckets': entry.get('buckets'), 'samples': {},
+                })
+                for key, value in entry['samples']:
+                    key = tuple(tuple(pair) for pair in key)
+                    current = target['samples'].get(key)
+                    if current is None:
+                        target['samples'][key] = list(value) if isinstance(value, list) else value
+                    elif isinstance(value, list):
+                        target['samples'][key] = [a + b for a, b in zip(current, value)]
+                    else:
+                        target['samples'][key] = current + value
+
+        for name, help_text, numerator, denominators in self._ratios:
+            num = sum(merged.get(numerator, {}).get('samples', {}).values())
+            den = sum(sum(merged.get(d, {}).get('samples', {}).values()) for d in denominators)
+            merged[name] = {'type': 'gauge', 'help': help_text, 'buckets': None,
+                            'samples': {(): num / den if den else 0.0}}
+
+        lines = []
+        for name in sorted(merged):
+            entry = merged[name]
+            lines.append(f"# HELP {name} {entry['help']}")
+            lines.append(f"# TYPE {name} {entry['type']}")
+            for key, value in sorted(entry['samples'].items()):
+                if entry['type'] == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(entry['buckets'] + [float('inf')], value[:-1]):
+                        cumulative += count
+                        le = (('le', _format_value(bound)),)
+                        lines.append(f"{name}_bucket{_format_labels(key, le)} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_format_value(value[-1])}")
+                    lines.append(f"{name}_count{_format_labels(key)} {cumulative}")
+                else:
+                    lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def wipe_directory(directory):
+    """Apaga snapshots antigos (chamar no master, antes de subir os workers)"""
+    if not directory or not os.path.isdir(directory):
+        return
+    for filename in os.listdir(directory):
+        if filename.startswith('metrics_'):
+            try:
+                os.remove(os.path.join(directory, filename))
+            except OSError:
+                pass
+
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
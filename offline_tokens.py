@@ -0,0 +1,192 @@
+"""
+TOKENS DE LICENÇA OFFLINE (Ed25519)
+O servidor assina com a chave privada e o cliente PDV confere com a chave
+pública embutida: a verificação não precisa de segredo compartilhado nem de
+rede, então o cliente só volta a consultar o servidor a cada poucos dias.
+
+    LT1.<kid>.<payload>.<assinatura>       (base64url sem '=')
+
+O payload é um JSON compacto:
+
+    k  chave da licença          e  expiração da licença (unix, None = sem)
+    h  HWID vinculado            n  não usar depois de (unix)
+    p  plano                     i  emitido em (unix)
+
+O `kid` identifica o par de chaves. Rotação: gere um par novo, publique o
+cliente com as duas chaves públicas, troque OFFLINE_TOKEN_KEY/KID nos
+servidores e, quando os tokens antigos já tiverem passado do `n`, retire a
+chave velha do cliente.
+
+Criativa/offline_tokens.py é uma cópia da parte de verificação (o cliente PDV
+é distribuído sem o resto do repositório): mantenha as duas em sincronia.
+
+Gerar um par de chaves:
+
+    python offline_tokens.py gerar-chave 2026a
+"""
+
+import base64
+import json
+import re
+import sys
+import time
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+
+TOKEN_PREFIX = 'LT1'
+
+# Tolerância para relógios um pouco adiantados/atrasados entre servidor e PDV
+CLOCK_SKEW = 300
+
+_KID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+
+
+class InvalidToken(ValueError):
+    """Token malformado, com assinatura inválida, de chave desconhecida ou vencido"""
+
+
+class LicenseExpired(InvalidToken):
+    """Token autêntico, mas a licença que ele descreve já expirou"""
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def load_public_keys(public_keys):
+    """kid -> chave pública (base64url dos 32 bytes) em kid -> Ed25519PublicKey"""
+    return {kid: Ed25519PublicKey.from_public_bytes(_b64decode(value))
+            for kid, value in public_keys.items()}
+
+
+def decode_token(token, public_keys, now=None):
+    """
+    Confere assinatura e validade de um token.
+
+    Args:
+        public_keys: kid -> chave pública (base64url ou Ed25519PublicKey)
+        now: instante unix da conferência (padrão: agora)
+
+    Returns:
+        dict: license_key, hwid, plan, expires_at, not_after, issued_at, kid
+
+    Raises:
+        LicenseExpired: a licença expirou (token autêntico)
+        InvalidToken: qualquer outro problema
+    """
+    now = time.time() if now is None else now
+    parts = token.split('.') if isinstance(token, str) else []
+    if len(parts) != 4 or parts[0] != TOKEN_PREFIX:
+        raise InvalidToken('Token em formato desconhecido')
+    _, kid, payload, signature = parts
+
+    public_key = public_keys.get(kid)
+    if public_key is None:
+        raise InvalidToken(f'Token assinado com chave desconhecida ({kid})')
+    if not isinstance(public_key, Ed25519PublicKey):
+        public_key = load_public_keys({kid: public_key})[kid]
+
+    try:
+        public_key.verify(_b64decode(signature), f'{TOKEN_PREFIX}.{kid}.{payload}'.encode('ascii'))
+        claims = json.loads(_b64decode(payload))
+    except (InvalidSignature, ValueError):
+        raise InvalidToken('Assinatura do token inválida')
+
+    if now + CLOCK_SKEW < claims['i']:
+        raise InvalidToken('Relógio do computador anterior à emissão do token')
+    # Antes do not-after (que nunca passa da expiração): licença vencida não é só token vencido
+    if claims.get('e') is not None and now > claims['e']:
+        raise LicenseExpired('Licença expirada')
+    if now > claims['n']:
+        raise InvalidToken('Token vencido: conecte à internet para renovar')
+
+    return {
+        'license_key': claims['k'],
+        'hwid': claims['h'],
+        'plan': claims.get('p'),
+        'expires_at': claims.get('e'),
+        'not_after': claims['n'],
+        'issued_at': claims['i'],
+        'kid': kid,
+    }
+
+
+class TokenSigner:
+    """
+    Emite tokens offline com a chave privada ativa.
+
+    Args:
+        kid: identificador da chave (vai no token; o cliente escolhe a chave pública por ele)
+        private_key: semente Ed25519 de 32 bytes em base64url ('' = não emite tokens)
+        ttl: validade máxima do token em segundos (nunca passa da expiração da licença)
+    """
+
+    def __init__(self, kid, private_key, ttl=7 * 86400):
+        if private_key and not _KID_PATTERN.match(kid or ''):
+            raise ValueError('kid deve ter 1 a 32 caracteres [A-Za-z0-9_-]')
+        self.kid = kid
+        self.ttl = ttl
+        self._key = Ed25519PrivateKey.from_private_bytes(_b64decode(private_key)) if private_key else None
+        self.enabled = self._key is not None
+        self.issued = 0
+
+    def issue(self, license_key, hwid, plan, expires_at, now=None):
+        """Token para a licença (expires_at em unix ou None); None se não há chave configurada"""
+        if not self.enabled:
+            return None
+        now = int(time.time() if now is None else now)
+        not_after = now + int(self.ttl)
+        if expires_at is not None:
+            expires_at = int(expires_at)
+            not_after = min(not_after, expires_at)
+        claims = {'k': license_key, 'h': hwid, 'p': plan, 'e': expires_at, 'n': not_after, 'i': now}
+        payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+        signing_input = f'{TOKEN_PREFIX}.{self.kid}.{payload}'
+        self.issued += 1
+        return f'{signing_input}.{_b64encode(self._key.sign(signing_input.encode("ascii")))}'
+
+    def public_key(self):
+        """Chave pública (base64url) a embutir no cliente"""
+        if not self.enabled:
+            return None
+        return _b64encode(self._key.public_key().public_bytes(
+            serialization.Encoding.Raw, serialization.PublicFormat.Raw))
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'kid': self.kid if self.enabled else None,
+            'ttl_days': round(self.ttl / 86400, 2),
+            'issued': self.issued,
+        }
+
+
+def generate_keypair():
+    """Novo par (semente privada, chave pública), ambos em base64url"""
+    key = Ed25519PrivateKey.generate()
+    private = key.private_bytes(serialization.Encoding.Raw, serialization.PrivateFormat.Raw,
+                                serialization.NoEncryption())
+    public = key.public_key().public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+    return _b64encode(private), _b64encode(public)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'gerar-chave':
+        print('Uso: python offline_tokens.py gerar-chave [kid]')
+        sys.exit(1)
+    kid = sys.argv[2] if len(sys.argv) > 2 else time.strftime('%Y%m')
+    if not _KID_PATTERN.match(kid):
+        print('kid deve ter 1 a 32 caracteres [A-Za-z0-9_-]')
+        sys.exit(1)
+    private, public = generate_keypair()
+    print('# Servidores (variáveis de ambiente; a privada nunca sai do servidor):')
+    print(f'OFFLINE_TOKEN_KID={kid}')
+    print(f'OFFLINE_TOKEN_KEY={private}')
+    print('# Cliente (LicenseValidator.OFFLINE_PUBLIC_KEYS):')
+    print(f"'{kid}': '{public}',")
@@ -0,0 +1,112 @@
+"""
+LIMITE DE TAXA (TOKEN BUCKET)
+Limitador em memória por chave (IP do cliente, chave de licença, ...),
+aplicado antes de qualquer acesso ao banco nos endpoints de validação.
+
+Cada processo tem seus próprios baldes: com N workers do gunicorn o limite
+efetivo por cliente é até N vezes maior. Serve para cortar rajadas abusivas
+antes que virem leituras e gravações no banco, não como cota exata.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """
+    Balde de fichas por chave, com armazenamento limitado.
+
+    Args:
+        rate: fichas repostas por segundo
+        burst: capacidade do balde (rajada permitida)
+        max_keys: máximo de chaves em memória; acima disso sai a menos usada (LRU)
+        enabled: False deixa tudo passar
+    """
+
+    def __init__(self, rate, burst, max_keys=100000, enabled=True):
+        if rate <= 0 or burst < 1:
+            raise ValueError('rate deve ser > 0 e burst >= 1')
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_keys = max_keys
+        self.enabled = enabled
+        # Um balde ocioso por esse tempo já estaria cheio: pode ser descartado sem efeito
+        self.idle_ttl = self.burst / self.rate
+        self._buckets = OrderedDict()   # chave -> [fichas, instante da última atualização]
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+        self.evicted = 0
+
+    def acquire(self, key, cost=1):
+        """
+        Consome `cost` fichas do balde de `key`. Um custo acima de `burst` nunca
+        caberia no balde: é limitado a `burst` (um lote grande consome a rajada inteira).
+
+        Returns:
+            0.0 se liberado; senão os segundos até haver fichas suficientes (Retry-After)
+        """
+        if not self.enabled:
+            return 0.0
+
+        cost = min(cost, self.burst)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+                self._buckets.move_to_end(key)
+
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                self.allowed += 1
+                wait = 0.0
+            else:
+                self.limited += 1
+                wait = (cost - bucket[0]) / self.rate
+
+            self._evict(now)
+        return wait
+
+    def refund(self, key, cost=1):
+        """Devolve fichas de um acquire liberado cuja requisição acabou recusada por outro limite"""
+        if not self.enabled:
+            return
+        with self._lock:
+            bucket = self._buckets.get(key)
+            # Balde já descartado estaria cheio: nada a devolver
+            if bucket is not None:
+                bucket[0] = min(self.burst, bucket[0] + min(cost, self.burst))
+
+    def _evict(self, now):
+        """Remove baldes ociosos (já cheios) e o excedente acima de max_keys"""
+        buckets = self._buckets
+        while buckets:
+            key, (tokens, updated) = next(iter(buckets.items()))
+            if len(buckets) > self.max_keys or now - updated >= self.idle_ttl:
+                del buckets[key]
+                self.evicted += 1
+            else:
+                break
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'rate': self.rate,
+                'burst': self.burst,
+                'keys': len(self._buckets),
+                'allowed': self.allowed,
+                'limited': self.limited,
+                'evicted': self.evicted,
+            }
+
+
+def retry_after_header(wait):
+    """Valor do header Retry-After (segundos inteiros, no mínimo 1)"""
+    return str(max(1, math.ceil(wait)))
@@ -2,13 +2,36 @@
 SERVIDOR DE VALIDAÇÃO DE LICENÇAS - V3.0
 Sistema completo com proteção anti-clonagem e modo offline
 Suporte híbrido: PostgreSQL (Render) ou SQLite (local)
+
+O import não toca no banco: o schema é criado por `python servidor_licencas_v3.py init`
+(ou pelo on_starting do gunicorn.conf.py, uma vez no master antes dos workers).
 """
 
-from flask import Flask, request, jsonify
-from datetime import datetime, timedelta
+import time
+IMPORT_STARTED = time.perf_counter()    # STARTUP_TIMING: duração do import do módulo
+
+from flask import Flask, request, jsonify, stream_with_context, g, has_request_context
+from werkzeug.middleware.proxy_fix import ProxyFix
+from datetime import date, datetime, timedelta
 import os
+import sys
+import argparse
 import hashlib
 import hmac
+import threading
+import queue
+import atexit
+import itertools
+from collections import OrderedDict
+from functools import lru_cache
+
+from db_pool import create_postgres_pool, create_sqlite_pool
+from metrics import MetricsRegistry, statement_label, PROMETHEUS_CONTENT_TYPE
+from rate_limit import TokenBucketLimiter, retry_after_header
+from bloom import KeyFilter
+from license_keys import is_valid_key, generate_key
+from clone_detector import CloneDetector, TelegramNotifier
+from offline_tokens import TokenSigner
 
 app = Flask(__name__)
 
@@ -16,13 +39,83 @@ app = Flask(__name__)
 DATABASE_URL = os.environ.get('DATABASE_URL', '')
 API_KEY = os.environ.get('API_KEY', 'sua-chave-secreta-aqui')
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'Alicia2705@#@')
+VALIDATE_BATCH_MAX = int(os.environ.get('VALIDATE_BATCH_MAX', 50))
+LIST_PAGE_MAX = int(os.environ.get('LIST_PAGE_MAX', 1000))
+LICENSE_BULK_MAX = int(os.environ.get('LICENSE_BULK_MAX', 1000))
+# Leitura de auditoria: teto de linhas por página, leituras simultâneas por worker e timeout (PostgreSQL)
+AUDIT_PAGE_MAX = int(os.environ.get('AUDIT_PAGE_MAX', 500))
+AUDIT_MAX_CONCURRENT = int(os.environ.get('AUDIT_MAX_CONCURRENT', 2))
+AUDIT_STATEMENT_TIMEOUT_MS = int(os.environ.get('AUDIT_STATEMENT_TIMEOUT_MS', 5000))
+# Feed de revogações: eventos por página e cache da última página (s)
+REVOCATION_FEED_PAGE_MAX = int(os.environ.get('REVOCATION_FEED_PAGE_MAX', 1000))
+REVOCATION_FEED_MAX_AGE = int(os.environ.get('REVOCATION_FEED_MAX_AGE', 30))
+
+# Proxies confiáveis na frente do app (Render = 1): request.remote_addr passa a ser o IP real
+TRUST_PROXY_HOPS = int(os.environ.get('TRUST_PROXY_HOPS', 0))
+if TRUST_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUST_PROXY_HOPS)
+
+# Limite de taxa da validação (fichas por segundo e rajada, por processo)
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+RATE_LIMIT_IP_RATE = float(os.environ.get('RATE_LIMIT_IP_RATE', 10))
+RATE_LIMIT_IP_BURST = int(os.environ.get('RATE_LIMIT_IP_BURST', 60))
+RATE_LIMIT_KEY_RATE = float(os.environ.get('RATE_LIMIT_KEY_RATE', 1))
+RATE_LIMIT_KEY_BURST = int(os.environ.get('RATE_LIMIT_KEY_BURST', 10))
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+
+# Filtro (Bloom) de chaves existentes: chaves inexistentes são recusadas sem ir ao banco
+LICENSE_FILTER_ENABLED = os.environ.get('LICENSE_FILTER_ENABLED', '1') == '1'
+LICENSE_FILTER_REFRESH_SECONDS = float(os.environ.get('LICENSE_FILTER_REFRESH_SECONDS', 5))   # mínimo entre atualizações incrementais
+LICENSE_FILTER_REBUILD_MINUTES = float(os.environ.get('LICENSE_FILTER_REBUILD_MINUTES', 10))
+LICENSE_FILTER_ERROR_RATE = float(os.environ.get('LICENSE_FILTER_ERROR_RATE', 0.001))
+# Chaves desconhecidas: 1 linha de auditoria a cada N tentativas (o resto só nos contadores)
+UNKNOWN_KEY_LOG_SAMPLE = int(os.environ.get('UNKNOWN_KEY_LOG_SAMPLE', 100))
+
+# Detector de clonagem: HWIDs/IPs distintos por licença em janelas deslizantes (por processo)
+CLONE_DETECTOR_ENABLED = os.environ.get('CLONE_DETECTOR_ENABLED', '1') == '1'
+CLONE_WINDOWS = [float(w) for w in os.environ.get('CLONE_WINDOWS', '300,3600,86400').split(',')]
+CLONE_HWID_POINTS = int(os.environ.get('CLONE_HWID_POINTS', 50))
+CLONE_IP_POINTS = int(os.environ.get('CLONE_IP_POINTS', 10))
+CLONE_IP_ALLOWANCE = int(os.environ.get('CLONE_IP_ALLOWANCE', 3))
+CLONE_ALERT_SCORE = int(os.environ.get('CLONE_ALERT_SCORE', 50))
+CLONE_ALERT_COOLDOWN = float(os.environ.get('CLONE_ALERT_COOLDOWN', 3600))
+CLONE_STATE_DIR = os.environ.get('CLONE_STATE_DIR', '')
+CLONE_SNAPSHOT_INTERVAL = float(os.environ.get('CLONE_SNAPSHOT_INTERVAL', 60))
+# Alertas no Telegram (opcional): mesmo token do bot_licencas e o chat do administrador
+ALERT_TELEGRAM_TOKEN = os.environ.get('ALERT_TELEGRAM_TOKEN', os.environ.get('BOT_TOKEN', ''))
+ALERT_TELEGRAM_CHAT_ID = os.environ.get('ALERT_TELEGRAM_CHAT_ID', '')
+
+# Tokens offline Ed25519 (offline_tokens.py): sem OFFLINE_TOKEN_KEY as respostas saem sem token
+OFFLINE_TOKEN_KID = os.environ.get('OFFLINE_TOKEN_KID') or 'k1'   # vazio (ex.: render.yaml) também cai no padrão
+OFFLINE_TOKEN_KEY = os.environ.get('OFFLINE_TOKEN_KEY', '')
+OFFLINE_TOKEN_TTL_DAYS = float(os.environ.get('OFFLINE_TOKEN_TTL_DAYS', 7))
+
+# Pool de conexões (por processo; cada worker do gunicorn tem o seu)
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+DB_POOL_HEALTHCHECK = float(os.environ.get('DB_POOL_HEALTHCHECK', 30))
+DB_POOL_MAX_IDLE = float(os.environ.get('DB_POOL_MAX_IDLE', 300))
+# PREPARE/EXECUTE dos comandos quentes (desligue atrás de PgBouncer em modo transaction)
+DB_PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', '1') == '1'
+
+# Métricas (/metrics); METRICS_DIR agrega os workers do gunicorn
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+metrics = MetricsRegistry(METRICS_DIR, METRICS_FLUSH_INTERVAL)
+HTTP_REQUESTS = metrics.counter('http_requests_total', 'Requisições HTTP por rota, método e status')
+HTTP_LATENCY = metrics.histogram('http_request_duration_seconds', 'Latência das requisições HTTP')
+DB_QUERY_SECONDS = metrics.histogram('db_query_duration_seconds', 'Tempo de execução de SQL por comando')
+DB_POOL_WAIT = metrics.histogram('db_pool_wait_seconds', 'Espera para obter conexão do pool')
 
 # Detecta qual banco usar
 USE_POSTGRES = bool(DATABASE_URL and DATABASE_URL.startswith('postgres'))
 
 if USE_POSTGRES:
     import psycopg2
-    from psycopg2.extras import RealDictCursor
+    from psycopg2.extras import RealDictCursor, execute_values
     print("🐘 Usando PostgreSQL")
 else:
     import sqlite3
@@ -32,15 +125,38 @@ else:
 # BANCO DE DADOS - CAMADA DE ABSTRAÇÃO
 # ============================================================================
 
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Retorna o pool de conexões do processo (criado no primeiro uso)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                options = dict(
+                    minconn=DB_POOL_MIN,
+                    maxconn=DB_POOL_MAX,
+                    timeout=DB_POOL_TIMEOUT,
+                    healthcheck_interval=DB_POOL_HEALTHCHECK,
+                    max_idle=DB_POOL_MAX_IDLE,
+                )
+                if USE_POSTGRES:
+                    _pool = create_postgres_pool(DATABASE_URL, cursor_factory=RealDictCursor, **options)
+                else:
+                    _pool = create_sqlite_pool('licenses.db', **options)
+                _pool.on_checkout = DB_POOL_WAIT.observe
+    return _pool
+
+def pool_stats():
+    """Métricas do pool (checkouts, tempo de espera, esgotamentos)"""
+    if _pool is None:
+        return None
+    return _pool.stats()
+
 def get_db():
-    """Conecta ao banco de dados (PostgreSQL ou SQLite)"""
-    if USE_POSTGRES:
-        conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
-        return conn
-    else:
-        db = sqlite3.connect('licenses.db')
-        db.row_factory = sqlite3.Row
-        return db
+    """Empresta uma conexão do pool (PostgreSQL ou SQLite); close() devolve ao pool"""
+    return get_pool().getconn()
 
 def dict_from_row(row):
     """Converte row em dict (compatível com ambos os bancos)"""
@@ -49,34 +165,128 @@ def dict_from_row(row):
     else:
         return dict(row)
 
+# Benchmark: conta os comandos SQL de cada request e devolve no header X-DB-Queries
+DB_QUERY_HEADER = os.environ.get('DB_QUERY_HEADER', '0') == '1'
+
+def count_query():
+    if DB_QUERY_HEADER and has_request_context():
+        g.db_queries = g.get('db_queries', 0) + 1
+
+@app.after_request
+def add_query_count_header(response):
+    if DB_QUERY_HEADER:
+        response.headers['X-DB-Queries'] = str(g.get('db_queries', 0))
+    return response
+
+@lru_cache(maxsize=512)
+def _pg_placeholders(query):
+    """'?' -> '%s' (traduzido uma vez por texto de query)"""
+    return query.replace('?', '%s')
+
 def execute_query(conn, query, params=None):
     """Executa query compatível com ambos os bancos"""
-    if USE_POSTGRES:
-        # PostgreSQL usa %s
-        query = query.replace('?', '%s')
-        cur = conn.cursor()
-        if params:
-            cur.execute(query, params)
+    count_query()
+    started = time.perf_counter()
+    try:
+        if USE_POSTGRES:
+            # PostgreSQL usa %s
+            cur = conn.cursor()
+            if params:
+                cur.execute(_pg_placeholders(query), params)
+            else:
+                cur.execute(_pg_placeholders(query))
+            return cur
         else:
-            cur.execute(query)
+            # SQLite usa ?
+            if params:
+                return conn.execute(query, params)
+            else:
+                return conn.execute(query)
+    finally:
+        DB_QUERY_SECONDS.observe(time.perf_counter() - started, statement=statement_label(query))
+
+# ============================================================================
+# COMANDOS PREPARADOS
+# ============================================================================
+# Comandos fixos do caminho quente: no PostgreSQL cada conexão faz PREPARE uma
+# vez e as validações seguintes rodam só EXECUTE (sem parse/plan a cada chamada).
+# No SQLite o sqlite3 já reaproveita os statements compilados por conexão
+# (cache pelo texto da query), então lá é só execute_query.
+
+PREPARED_STATEMENTS = {}    # nome -> (query com ?, query com $n, EXECUTE com %s)
+
+def register_statement(name, query):
+    """Registra um comando com placeholders '?'; a tradução para $1..$n acontece aqui, uma vez"""
+    parts = query.split('?')
+    pg_query = parts[0] + ''.join(f'${i}{part}' for i, part in enumerate(parts[1:], 1))
+    args = f" ({', '.join(['%s'] * (len(parts) - 1))})" if len(parts) > 1 else ''
+    PREPARED_STATEMENTS[name] = (query, pg_query, f'EXECUTE {name}{args}')
+    return name
+
+def execute_prepared(conn, name, params=()):
+    """Executa um comando registrado (PREPARE na primeira vez em cada conexão)"""
+    query, pg_query, execute_sql = PREPARED_STATEMENTS[name]
+    if not USE_POSTGRES or not DB_PREPARED_STATEMENTS:
+        return execute_query(conn, query, params)
+    
+    # Nomes já preparados nesta sessão (o estado some quando o pool fecha a conexão)
+    prepared = conn.state.setdefault('prepared', set())
+    
+    count_query()
+    started = time.perf_counter()
+    cur = conn.cursor()
+    try:
+        if name not in prepared:
+            cur.execute(f'PREPARE {name} AS {pg_query}')
+            prepared.add(name)
+        cur.execute(execute_sql, params)
         return cur
-    else:
-        # SQLite usa ?
-        if params:
-            return conn.execute(query, params)
-        else:
-            return conn.execute(query)
+    except psycopg2.Error as e:
+        if e.pgcode == '26000':
+            # invalid_sql_statement_name: sessão resetada por fora (DISCARD ALL, pooler)
+            prepared.discard(name)
+        raise
+    finally:
+        DB_QUERY_SECONDS.observe(time.perf_counter() - started, statement=name)
+
+STMT_LICENSE_BY_KEY = register_statement('license_by_key', 'SELECT * FROM licenses WHERE license_key = ?')
+STMT_LICENSE_BY_ID = register_statement('license_by_id', 'SELECT * FROM licenses WHERE id = ?')
+STMT_LICENSES_BY_KEYS = register_statement('licenses_by_keys', 'SELECT * FROM licenses WHERE license_key = ANY(?)')
+STMT_BIND_LICENSE = register_statement(
+    'bind_license',
+    'UPDATE licenses SET bound_hwid = ?, last_check = ? WHERE id = ? AND bound_hwid IS NULL'
+    + (' RETURNING id' if USE_POSTGRES else '')
+)
+# Só licença ativa e dentro da validade é bloqueada: revogada/expirada fica como está e
+# tentativas repetidas do PC clonado não geram novo evento 'blocked'
+STMT_BLOCK_LICENSE = register_statement(
+    'block_license',
+    "UPDATE licenses SET status = ? WHERE id = ? AND status = 'active' AND expires_at > ? "
+    'AND bound_hwid IS NOT NULL AND bound_hwid <> ?'
+    + (' RETURNING id' if USE_POSTGRES else '')
+)
 
 # Monkey patch para db.execute funcionar com ambos
 class DBWrapper:
-    def __init__(self, conn):
-        self.conn = conn
+    def __init__(self, conn=None):
+        # conn=None: a conexão só é emprestada do pool no primeiro execute()
+        self._conn = conn
         self._cursor = None
+    
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = get_db()
+        return self._conn
         
     def execute(self, query, params=None):
         self._cursor = execute_query(self.conn, query, params)
         return self
     
+    def execute_prepared(self, name, params=()):
+        self._cursor = execute_prepared(self.conn, name, params)
+        return self
+    
     def fetchone(self):
         return self._cursor.fetchone() if self._cursor else None
     
@@ -84,23 +294,55 @@ class DBWrapper:
         return self._cursor.fetchall() if self._cursor else []
     
     def commit(self):
-        self.conn.commit()
+        if self._conn is not None:
+            self._conn.commit()
     
     def close(self):
+        if self._conn is None:
+            return
         if USE_POSTGRES and self._cursor:
             self._cursor.close()
-        self.conn.close()
+        self._conn.close()
+        self._conn = None
     
     @property
     def total_changes(self):
-        if USE_POSTGRES:
-            return self._cursor.rowcount if self._cursor else 0
-        else:
-            return self.conn.total_changes
+        # rowcount do último comando: total_changes do sqlite acumula
+        # durante toda a vida da conexão, que agora é reaproveitada pelo pool
+        return self._cursor.rowcount if self._cursor else 0
+
+def get_db_wrapped(lazy=False):
+    """Retorna conexão com wrapper compatível (lazy: só conecta se executar algo)"""
+    return DBWrapper(None if lazy else get_db())
+
+def stream_query(conn, query, params=None, batch_size=500):
+    """
+    Itera as linhas sem carregar o resultado inteiro em memória
+    (cursor nomeado do lado do servidor no PostgreSQL)
+    """
+    if USE_POSTGRES:
+        cur = conn.cursor(name=f'stream_{threading.get_ident()}_{time.monotonic_ns()}')
+        cur.itersize = batch_size
+        count_query()
+        cur.execute(query.replace('?', '%s'), params)
+        try:
+            for row in cur:
+                yield row
+        finally:
+            cur.close()
+    else:
+        cur = execute_query(conn, query, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
 
-def get_db_wrapped():
-    """Retorna conexão com wrapper compatível"""
-    return DBWrapper(get_db())
+LICENSE_COLUMNS = (
+    'id', 'license_key', 'hwid', 'bound_hwid', 'plan', 'created_at', 'expires_at',
+    'last_check', 'status', 'unbind_count', 'client_name'
+)
 
 def init_db():
     """Inicializa o banco de dados"""
@@ -204,8 +446,294 @@ def init_db():
         conn.commit()
         conn.close()
         print("✅ Banco SQLite inicializado")
+    run_migrations()
     print("✅ Banco de dados inicializado")
 
+# ============================================================================
+# MIGRAÇÕES DE SCHEMA
+# ============================================================================
+
+# {concurrently} vira CONCURRENTLY no PostgreSQL (não trava escrita na tabela)
+# e some no SQLite; comandos diferentes por banco vão em {'postgres': ..., 'sqlite': ...}
+# (None = nada a fazer naquele banco).
+# Migrações aplicadas nunca mudam: crie sempre uma nova versão.
+# Sem CONCURRENTLY, a migração roda em uma transação junto com o registro em schema_version;
+# com CONCURRENTLY (só PostgreSQL) cada comando é confirmado sozinho, então todos eles
+# precisam ser idempotentes (IF NOT EXISTS / IF EXISTS) para uma nova tentativa após queda.
+MIGRATIONS = [
+    (1, 'Índices do caminho quente', [
+        'CREATE INDEX {concurrently} IF NOT EXISTS idx_validation_logs_key_checked '
+        'ON validation_logs (license_key, checked_at)',
+        'CREATE INDEX {concurrently} IF NOT EXISTS idx_hwid_changes_license '
+        'ON hwid_changes (license_id, changed_at)',
+        'CREATE INDEX {concurrently} IF NOT EXISTS idx_licenses_status_created '
+        'ON licenses (status, created_at)',
+        'CREATE INDEX {concurrently} IF NOT EXISTS idx_licenses_created '
+        'ON licenses (created_at)',
+    ]),
+    (2, 'Índices de paginação por cursor (created_at, id)', [
+        'CREATE INDEX {concurrently} IF NOT EXISTS idx_licenses_created_id '
+        'ON licenses (created_at, id)',
+        'CREATE INDEX {concurrently} IF NOT EXISTS idx_licenses_status_created_id '
+        'ON licenses (status, created_at, id)',
+        'DROP INDEX {concurrently} IF EXISTS idx_licenses_created',
+        'DROP INDEX {concurrently} IF EXISTS idx_licenses_status_created',
+    ]),
+    (3, 'Rollup diário de validation_logs', [
+        {
+            'postgres': '''
+                CREATE TABLE IF NOT EXISTS validation_daily (
+                    license_key VARCHAR(255) NOT NULL,
+                    day DATE NOT NULL,
+                    result VARCHAR(20) NOT NULL,
+                    checks INTEGER NOT NULL,
+                    distinct_hwids INTEGER NOT NULL,
+                    distinct_ips INTEGER NOT NULL,
+                    PRIMARY KEY (license_key, day, result)
+                )
+            ''',
+            'sqlite': '''
+                CREATE TABLE IF NOT EXISTS validation_daily (
+                    license_key TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    checks INTEGER NOT NULL,
+                    distinct_hwids INTEGER NOT NULL,
+                    distinct_ips INTEGER NOT NULL,
+                    PRIMARY KEY (license_key, day, result)
+                )
+            ''',
+        },
+        'CREATE INDEX {concurrently} IF NOT EXISTS idx_validation_daily_day '
+        'ON validation_daily (day)',
+        'CREATE TABLE IF NOT EXISTS maintenance_state (name VARCHAR(100) PRIMARY KEY, value TEXT)',
+        # Faixas por dia do rollup e DELETE da retenção
+        'CREATE INDEX {concurrently} IF NOT EXISTS idx_validation_logs_checked '
+        'ON validation_logs (checked_at)',
+    ]),
+    (4, 'Varredura de expiração e license_events', [
+        # Varredura: status = 'active' AND expires_at <= agora, em ordem de expires_at
+        'CREATE INDEX {concurrently} IF NOT EXISTS idx_licenses_status_expires '
+        'ON licenses (status, expires_at)',
+        {
+            'postgres': '''
+                CREATE TABLE IF NOT EXISTS license_events (
+                    id BIGSERIAL PRIMARY KEY,
+                    license_id INTEGER NOT NULL,
+                    license_key VARCHAR(255) NOT NULL,
+                    event VARCHAR(30) NOT NULL,
+                    old_status VARCHAR(20),
+                    new_status VARCHAR(20),
+                    actor VARCHAR(100),
+                    created_at TIMESTAMP NOT NULL
+                )
+            ''',
+            'sqlite': '''
+                CREATE TABLE IF NOT EXISTS license_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    license_id INTEGER NOT NULL,
+                    license_key TEXT NOT NULL,
+                    event TEXT NOT NULL,
+                    old_status TEXT,
+                    new_status TEXT,
+                    actor TEXT,
+                    created_at TEXT NOT NULL
+                )
+            ''',
+        },
+        'CREATE INDEX {concurrently} IF NOT EXISTS idx_license_events_key '
+        'ON license_events (license_key, id)',
+    ]),
+    (5, 'Detalhe (JSON) em license_events para alertas de clonagem', [
+        {
+            'postgres': 'ALTER TABLE license_events ADD COLUMN IF NOT EXISTS detail TEXT',
+            'sqlite': 'ALTER TABLE license_events ADD COLUMN detail TEXT',
+        },
+    ]),
+    # A página da auditoria sai inteira do índice (index-only scan), sem ler a tabela
+    # (em validation_logs o índice largo foi trocado na versão 8).
+    # SQLite não tem INCLUDE: as colunas entram na chave, depois do id (ordem do cursor)
+    (6, 'Índices cobrindo a consulta de auditoria', [
+        {
+            'postgres': 'CREATE INDEX {concurrently} IF NOT EXISTS idx_validation_logs_audit '
+                        'ON validation_logs (license_key, checked_at, id) '
+                        'INCLUDE (result, hwid, detected_hwid, ip_address, message)',
+            'sqlite': 'CREATE INDEX IF NOT EXISTS idx_validation_logs_audit '
+                      'ON validation_logs (license_key, checked_at, id, result, hwid, detected_hwid, ip_address, message)',
+        },
+        {
+            'postgres': 'CREATE INDEX {concurrently} IF NOT EXISTS idx_hwid_changes_audit '
+                        'ON hwid_changes (license_id, changed_at, id) '
+                        'INCLUDE (old_hwid, new_hwid, reason, admin_user)',
+            'sqlite': 'CREATE INDEX IF NOT EXISTS idx_hwid_changes_audit '
+                      'ON hwid_changes (license_id, changed_at, id, reason, old_hwid, new_hwid, admin_user)',
+        },
+        # Prefixos dos novos índices
+        'DROP INDEX {concurrently} IF EXISTS idx_validation_logs_key_checked',
+        'DROP INDEX {concurrently} IF EXISTS idx_hwid_changes_license',
+    ]),
+    # Feed de revogações em ordem de commit: cada evento guarda a transação que o gravou
+    # (eventos anteriores ficam com tx = 0). No SQLite as escritas já são serializadas e o id basta.
+    (7, 'Transação de origem em license_events (cursor do feed de revogações)', [
+        {
+            'postgres': 'ALTER TABLE license_events ADD COLUMN IF NOT EXISTS tx BIGINT NOT NULL DEFAULT 0',
+            'sqlite': None,
+        },
+        {
+            'postgres': 'ALTER TABLE license_events ALTER COLUMN tx SET DEFAULT txid_current()',
+            'sqlite': None,
+        },
+        {
+            'postgres': 'CREATE INDEX {concurrently} IF NOT EXISTS idx_license_events_tx '
+                        'ON license_events (tx, id)',
+            'sqlite': None,
+        },
+    ]),
+    # validation_logs é a tabela mais escrita: o índice de auditoria da versão 6 levava
+    # hwid, detected_hwid e message (texto livre) em cada INSERT, e uma mensagem longa podia
+    # estourar o limite de tupla do btree no PostgreSQL. Fica só a chave da paginação;
+    # as demais colunas da página (até AUDIT_PAGE_MAX linhas) são lidas da tabela.
+    (8, 'Índice de auditoria enxuto em validation_logs', [
+        'CREATE INDEX {concurrently} IF NOT EXISTS idx_validation_logs_key_time '
+        'ON validation_logs (license_key, checked_at, id)',
+        'DROP INDEX {concurrently} IF EXISTS idx_validation_logs_audit',
+    ]),
+]
+
+# Consultas do caminho quente exibidas em `migrate --check`
+CHECK_QUERIES = [
+    ('license lookup', 'SELECT * FROM licenses WHERE license_key = ?', ('XXXX-XXXX-XXXX-XXXX',)),
+    ('logs by license', 'SELECT * FROM validation_logs WHERE license_key = ? ORDER BY checked_at DESC LIMIT 50',
+     ('XXXX-XXXX-XXXX-XXXX',)),
+    ('hwid changes by license', 'SELECT * FROM hwid_changes WHERE license_id = ? ORDER BY changed_at DESC', (1,)),
+    ('list by status', 'SELECT * FROM licenses WHERE status = ? ORDER BY created_at DESC, id DESC LIMIT 100',
+     ('active',)),
+    ('rollup day', "SELECT license_key, result, COUNT(*) FROM validation_logs "
+     "WHERE checked_at >= ? AND checked_at < ? GROUP BY license_key, result", ('2025-01-01', '2025-01-02')),
+    ('list page', 'SELECT * FROM licenses WHERE (created_at < ? OR (created_at = ? AND id < ?)) '
+     'ORDER BY created_at DESC, id DESC LIMIT 100', ('2025-01-01T00:00:00', '2025-01-01T00:00:00', 1)),
+    ('audit page', 'SELECT id, checked_at, result, hwid, detected_hwid, ip_address, message FROM validation_logs '
+     'WHERE license_key = ? AND checked_at >= ? AND checked_at < ? '
+     'AND (checked_at < ? OR (checked_at = ? AND id < ?)) ORDER BY checked_at DESC, id DESC LIMIT 501',
+     ('XXXX-XXXX-XXXX-XXXX', '2025-01-01', '2025-02-01', '2025-01-15T00:00:00', '2025-01-15T00:00:00', 1)),
+    ('expiry sweep', "SELECT id, license_key FROM licenses WHERE status = 'active' AND expires_at <= ? "
+     'ORDER BY expires_at LIMIT 500', ('2025-01-01T00:00:00',)),
+]
+
+# Chave do pg_advisory_lock que serializa migrações entre workers
+MIGRATION_LOCK_ID = 7301
+
+def _ensure_schema_version(conn):
+    execute_query(conn, '''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    ''')
+
+def _applied_versions(conn):
+    return {row['version'] for row in execute_query(conn, 'SELECT version FROM schema_version').fetchall()}
+
+def _schema_version_exists(conn):
+    """Consulta o catálogo sem criar nada (migrate --check é só leitura)"""
+    if USE_POSTGRES:
+        query = "SELECT 1 AS found FROM pg_catalog.pg_tables WHERE tablename = 'schema_version' AND schemaname = current_schema()"
+    else:
+        query = "SELECT 1 AS found FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    return execute_query(conn, query).fetchone() is not None
+
+def _drop_invalid_index(conn, statement):
+    """CREATE INDEX CONCURRENTLY interrompido deixa um índice INVALID que o IF NOT EXISTS pularia"""
+    name = statement.split('IF NOT EXISTS', 1)[1].split()[0]
+    invalid = execute_query(conn, '''
+        SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid
+        WHERE c.relname = ? AND NOT i.indisvalid
+    ''', (name,)).fetchone()
+    if invalid:
+        execute_query(conn, f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+def _migration_statements(statements):
+    """Comandos da migração para o banco atual, com {concurrently} resolvido"""
+    resolved = []
+    for statement in statements:
+        if isinstance(statement, dict):
+            statement = statement['postgres' if USE_POSTGRES else 'sqlite']
+            if statement is None:
+                continue
+        resolved.append(statement.format(concurrently='CONCURRENTLY' if USE_POSTGRES else ''))
+    return resolved
+
+def run_migrations():
+    """Aplica, em ordem, as migrações ainda não registradas em schema_version"""
+    conn = get_db()
+    applied_now = []
+    
+    try:
+        if USE_POSTGRES:
+            # CONCURRENTLY não roda dentro de transação
+            conn.raw.autocommit = True
+            execute_query(conn, 'SELECT pg_advisory_lock(?)', (MIGRATION_LOCK_ID,))
+        
+        _ensure_schema_version(conn)
+        applied = _applied_versions(conn)
+        
+        for version, description, statements in MIGRATIONS:
+            if version in applied:
+                continue
+            statements = _migration_statements(statements)
+            transactional = not any('CONCURRENTLY' in statement for statement in statements)
+            if transactional:
+                # Também no SQLite: o módulo sqlite3 não abre transação sozinho antes de DDL
+                execute_query(conn, 'BEGIN')
+            try:
+                for statement in statements:
+                    if 'CONCURRENTLY' in statement and 'CREATE INDEX' in statement:
+                        _drop_invalid_index(conn, statement)
+                    execute_query(conn, statement)
+                execute_query(conn,
+                    'INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                    (version, description, datetime.now().isoformat())
+                )
+                if transactional:
+                    execute_query(conn, 'COMMIT')
+            except Exception:
+                if transactional:
+                    execute_query(conn, 'ROLLBACK')
+                raise
+            applied_now.append(version)
+            print(f"✅ Migração {version} aplicada: {description}")
+    finally:
+        if USE_POSTGRES and not conn.raw.closed:
+            execute_query(conn, 'SELECT pg_advisory_unlock(?)', (MIGRATION_LOCK_ID,))
+            conn.raw.autocommit = False
+        conn.close()
+    
+    return applied_now
+
+def check_schema():
+    """Mostra versão do schema, migrações pendentes e os planos das consultas quentes"""
+    conn = get_db()
+    try:
+        # Sem a tabela (banco nunca migrado) a versão é 0 e tudo está pendente
+        applied = _applied_versions(conn) if _schema_version_exists(conn) else set()
+        pending = [(v, d) for v, d, _ in MIGRATIONS if v not in applied]
+        
+        print(f"Schema: versão {max(applied) if applied else 0}")
+        for version, description in pending:
+            print(f"⏳ Pendente: {version} - {description}")
+        
+        explain = 'EXPLAIN' if USE_POSTGRES else 'EXPLAIN QUERY PLAN'
+        for label, query, params in CHECK_QUERIES:
+            print(f"\n--- {label}: {query}")
+            for row in execute_query(conn, f'{explain} {query}', params).fetchall():
+                print('   ', row['QUERY PLAN'] if USE_POSTGRES else row['detail'])
+    finally:
+        conn.rollback()
+        conn.close()
+    
+    return not pending
+
 # ============================================================================
 # MIDDLEWARE DE AUTENTICAÇÃO
 # ============================================================================
@@ -238,226 +766,1288 @@ def require_admin(f):
     return decorated_function
 
 # ============================================================================
-# FUNÇÕES AUXILIARES
+# AUDITORIA ASSÍNCRONA
 # ============================================================================
 
+AUDIT_QUEUE_MAX = int(os.environ.get('AUDIT_QUEUE_MAX', 10000))
+AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', 500))
+AUDIT_FLUSH_MS = int(os.environ.get('AUDIT_FLUSH_MS', 200))
+
+AUDIT_COLUMNS = {
+    'validation_logs': ('license_key', 'hwid', 'checked_at', 'ip_address', 'result', 'detected_hwid', 'message'),
+    'hwid_changes': ('license_id', 'old_hwid', 'new_hwid', 'changed_at', 'reason', 'admin_user'),
+    'license_events': ('license_id', 'license_key', 'event', 'old_status', 'new_status', 'actor', 'created_at', 'detail'),
+}
+
+class AuditWriter:
+    """
+    Fila limitada + thread que grava validation_logs, hwid_changes e
+    license_events (alertas) em lotes.
+
+    O lote é gravado ao juntar `batch_size` linhas ou após `flush_interval`
+    segundos; com a fila cheia a linha é descartada e contada em `dropped`.
+    """
+    
+    def __init__(self, max_queue, batch_size, flush_interval):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+    
+    def _ensure_started(self):
+        """Sobe a thread no primeiro uso de cada processo (workers nascem por fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.max_queue)
+                self._stop = threading.Event()
+                self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+    
+    def enqueue(self, table, row):
+        """Enfileira uma linha sem bloquear"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((table, row))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+    
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+    
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                return batch
+    
+    def _write(self, batch):
+        by_table = {}
+        for table, row in batch:
+            by_table.setdefault(table, []).append(row)
+        
+        try:
+            conn = get_db()
+        except Exception as e:
+            with self._lock:
+                self.failed += len(batch)
+            print(f"❌ Auditoria: sem conexão para gravar {len(batch)} linhas: {e}")
+            return
+        
+        started = time.perf_counter()
+        try:
+            for table, rows in by_table.items():
+                columns = AUDIT_COLUMNS[table]
+                if USE_POSTGRES:
+                    # INSERT multi-linha em um único comando
+                    cur = conn.cursor()
+                    execute_values(cur, f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s", rows,
+                                   page_size=self.batch_size)
+                    cur.close()
+                else:
+                    conn.executemany(
+                        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                        rows
+                    )
+            conn.commit()
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, statement='batch_insert_audit')
+            with self._lock:
+                self.written += len(batch)
+                self.batches += 1
+        except Exception as e:
+            with self._lock:
+                self.failed += len(batch)
+            print(f"❌ Auditoria: falha ao gravar {len(batch)} linhas: {e}")
+        finally:
+            conn.close()
+    
+    def flush(self, timeout=5.0):
+        """Para a thread e grava o que restou na fila (chamado no desligamento)"""
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        pending = self._drain()
+        for start in range(0, len(pending), self.batch_size):
+            self._write(pending[start:start + self.batch_size])
+        self._pid = None
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self._queue.qsize() if self._pid == os.getpid() else 0,
+                'dropped': self.dropped,
+                'written': self.written,
+                'failed': self.failed,
+                'batches': self.batches,
+            }
+
+audit_writer = AuditWriter(AUDIT_QUEUE_MAX, AUDIT_BATCH_SIZE, AUDIT_FLUSH_MS / 1000.0)
+atexit.register(audit_writer.flush)
+
 def log_validation(license_key, hwid, result, detected_hwid, message, ip):
-    """Registra log de validação"""
-    db = get_db_wrapped()
-    db.execute('''
-        INSERT INTO validation_logs 
-        (license_key, hwid, checked_at, ip_address, result, detected_hwid, message)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (license_key, hwid, datetime.now().isoformat(), ip, result, detected_hwid, message))
-    db.commit()
-    db.close()
+    """Registra log de validação (enfileirado, não bloqueia a requisição)"""
+    audit_writer.enqueue('validation_logs', (
+        license_key, hwid, datetime.now().isoformat(), ip, result, detected_hwid, message
+    ))
 
 def log_hwid_change(license_id, old_hwid, new_hwid, reason, admin_user='system'):
-    """Registra mudança de HWID"""
-    db = get_db_wrapped()
-    db.execute('''
-        INSERT INTO hwid_changes 
-        (license_id, old_hwid, new_hwid, changed_at, reason, admin_user)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (license_id, old_hwid, new_hwid, datetime.now().isoformat(), reason, admin_user))
-    db.commit()
-    db.close()
+    """Registra mudança de HWID (enfileirado, não bloqueia a requisição)"""
+    audit_writer.enqueue('hwid_changes', (
+        license_id, old_hwid, new_hwid, datetime.now().isoformat(), reason, admin_user
+    ))
 
 # ============================================================================
-# ENDPOINTS DA API
+# CACHE DE LICENÇAS
 # ============================================================================
 
-@app.route('/')
-def index():
-    """Página inicial"""
-    return jsonify({
-        'service': 'License Validation API v3.0',
-        'status': 'online',
-        'timestamp': datetime.now().isoformat(),
-        'features': [
-            'Proteção anti-clonagem',
-            'Modo offline (30 dias)',
-            'Cache criptografado',
-            'Auditoria completa'
-        ]
-    })
+LICENSE_CACHE_ENABLED = os.environ.get('LICENSE_CACHE_ENABLED', '1') == '1'
+LICENSE_CACHE_TTL = float(os.environ.get('LICENSE_CACHE_TTL', 30))
+LICENSE_CACHE_MAX = int(os.environ.get('LICENSE_CACHE_MAX', 10000))
 
-@app.route('/health')
-def health():
-    """Health check"""
-    return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
+class LicenseCache:
+    """
+    Cache LRU com TTL das linhas de `licenses`, indexado por license_key.
 
-@app.route('/api/validate', methods=['POST'])
-@require_api_key
-def validate_license():
+    Mutações deste processo invalidam a entrada na hora; mudanças feitas por outros
+    workers aparecem no máximo após `ttl` segundos (vínculo e bloqueio continuam
+    corretos porque os UPDATEs de apply_validation são condicionais).
     """
-    Valida uma licença
     
-    Request:
-    {
-        "license_key": "XXXX-XXXX-XXXX-XXXX",
-        "hwid": "XXXX-XXXX-XXXX-XXXX"
-    }
+    def __init__(self, max_size, ttl, enabled=True):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # license_key -> (expira_em, linha)
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
     
-    Response:
-    {
-        "valid": true/false,
-        "message": "...",
-        "expires_at": "...",
-        "plan": "...",
-        "bound_hwid": "...",
-        "days_remaining": 30
-    }
+    def generation(self):
+        """Marca tirada antes de ler do banco; put() ignora a linha se houve invalidação depois"""
+        return self._generation
+    
+    def get(self, license_key):
+        """Retorna uma cópia da linha em cache ou None"""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(license_key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[license_key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(license_key)
+            self.hits += 1
+            return dict(entry[1])
+    
+    def put(self, license_key, row, generation):
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[license_key] = (time.monotonic() + self.ttl, dict(row))
+            self._entries.move_to_end(license_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def invalidate(self, license_key):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._entries.pop(license_key, None)
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+license_cache = LicenseCache(LICENSE_CACHE_MAX, LICENSE_CACHE_TTL, LICENSE_CACHE_ENABLED)
+
+# ============================================================================
+# LAST_CHECK EM WRITE-BEHIND
+# ============================================================================
+
+# Tempo máximo que o last_check de uma licença fica só em memória
+LAST_CHECK_MAX_STALENESS = float(os.environ.get('LAST_CHECK_MAX_STALENESS', 5))
+LAST_CHECK_MAX_PENDING = int(os.environ.get('LAST_CHECK_MAX_PENDING', 5000))
+
+class LastCheckBuffer:
+    """
+    Guarda o last_check mais recente de cada licença e grava todos em um
+    único UPDATE em lote a cada `max_staleness` segundos (ou antes, se
+    acumular `max_pending` licenças).
     """
-    data = request.get_json()
-    license_key = data.get('license_key', '').strip()
-    hwid_request = data.get('hwid', '').strip()
-    ip_address = request.remote_addr
     
-    if not license_key or not hwid_request:
-        return jsonify({
-            'valid': False,
-            'message': 'Chave de licença e HWID são obrigatórios'
-        }), 400
+    def __init__(self, max_staleness, max_pending):
+        self.max_staleness = max_staleness
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending = {}   # license_id -> timestamp ISO
+        self._pid = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self.flushed = 0
+        self.batches = 0
+        self.failed = 0
     
-    db = get_db_wrapped()
-    license_row = db.execute(
-        'SELECT * FROM licenses WHERE license_key = ?',
-        (license_key,)
-    ).fetchone()
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pending = {}
+                self._wake = threading.Event()
+                self._stop = threading.Event()
+                self._thread = threading.Thread(target=self._run, name='last-check-writer', daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
     
-    # Licença não encontrada
-    if not license_row:
-        log_validation(license_key, hwid_request, 'not_found', hwid_request, 'Licença não encontrada', ip_address)
-        db.close()
-        return jsonify({
-            'valid': False,
-            'message': 'Licença não encontrada'
-        }), 404
+    def touch(self, license_id, timestamp):
+        """Registra um check (sem I/O)"""
+        self._ensure_started()
+        with self._lock:
+            current = self._pending.get(license_id)
+            if current is None or timestamp > current:
+                self._pending[license_id] = timestamp
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._wake.set()
     
-    license_dict = dict(license_row)
-    license_id = license_dict['id']
-    bound_hwid = license_dict['bound_hwid']
-    status = license_dict['status']
-    expires_at_str = license_dict['expires_at']
+    def pending(self, license_id):
+        """last_check ainda não gravado desta licença (ou None)"""
+        with self._lock:
+            return self._pending.get(license_id)
     
-    # PROTEÇÃO ANTI-CLONAGEM
-    if bound_hwid is None:
-        # Primeira vez usando - vincular ao HWID atual
-        db.execute(
-            'UPDATE licenses SET bound_hwid = ?, last_check = ? WHERE id = ?',
-            (hwid_request, datetime.now().isoformat(), license_id)
-        )
-        db.commit()
-        log_hwid_change(license_id, None, hwid_request, 'first_bind')
-        bound_hwid = hwid_request
-        print(f"🔗 Licença {license_key} vinculada ao HWID {hwid_request}")
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.max_staleness)
+            self._wake.clear()
+            self.flush()
     
-    elif bound_hwid != hwid_request:
-        # TENTATIVA DE USO EM PC DIFERENTE - BLOQUEAR!
-        db.execute(
-            'UPDATE licenses SET status = ? WHERE id = ?',
-            ('blocked_multiple_pc', license_id)
-        )
-        db.commit()
-        log_validation(license_key, hwid_request, 'blocked_multiple_pc', hwid_request, 
-                      f'Tentativa de uso em PC diferente. Original: {bound_hwid}', ip_address)
-        log_hwid_change(license_id, bound_hwid, hwid_request, 'blocked_attempt')
-        db.close()
+    def flush(self):
+        """Grava o buffer em um UPDATE em lote"""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return
         
-        print(f"🚨 BLOQUEIO: Licença {license_key} tentou usar em PC diferente!")
-        print(f"   HWID Original: {bound_hwid}")
-        print(f"   HWID Tentativa: {hwid_request}")
+        rows = [(license_id, timestamp) for license_id, timestamp in batch.items()]
+        try:
+            conn = get_db()
+        except Exception as e:
+            self._requeue(batch)
+            print(f"❌ last_check: sem conexão para gravar {len(rows)} licenças: {e}")
+            return
         
-        return jsonify({
-            'valid': False,
-            'message': 'Licença bloqueada: detectado uso em múltiplos PCs. Entre em contato com o suporte.',
-            'status': 'blocked_multiple_pc'
-        }), 403
-    
-    # Verifica se está bloqueada
-    if status == 'blocked_multiple_pc':
-        log_validation(license_key, hwid_request, 'blocked', hwid_request, 'Licença bloqueada por uso múltiplo', ip_address)
-        db.close()
-        return jsonify({
-            'valid': False,
-            'message': 'Licença bloqueada por uso em múltiplos PCs. Entre em contato com o suporte.',
-            'status': 'blocked_multiple_pc'
-        }), 403
-    
-    if status == 'revoked':
-        log_validation(license_key, hwid_request, 'revoked', hwid_request, 'Licença revogada', ip_address)
-        db.close()
-        return jsonify({
-            'valid': False,
-            'message': 'Licença revogada',
-            'status': 'revoked'
-        }), 403
+        started = time.perf_counter()
+        try:
+            if USE_POSTGRES:
+                cur = conn.cursor()
+                execute_values(cur, '''
+                    UPDATE licenses AS l SET last_check = v.last_check::timestamp
+                    FROM (VALUES %s) AS v(id, last_check)
+                    WHERE l.id = v.id AND (l.last_check IS NULL OR l.last_check < v.last_check::timestamp)
+                ''', rows, page_size=len(rows))
+                cur.close()
+            else:
+                conn.executemany('''
+                    UPDATE licenses SET last_check = ?2
+                    WHERE id = ?1 AND (last_check IS NULL OR last_check < ?2)
+                ''', rows)
+            conn.commit()
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, statement='batch_update_last_check')
+            with self._lock:
+                self.flushed += len(rows)
+                self.batches += 1
+        except Exception as e:
+            self._requeue(batch)
+            print(f"❌ last_check: falha ao gravar {len(rows)} licenças: {e}")
+        finally:
+            conn.close()
     
-    # Verifica expiração
-    # Converte para string se necessário (PostgreSQL pode retornar datetime)
-    if isinstance(expires_at_str, str):
-        expires_at = datetime.fromisoformat(expires_at_str)
-    else:
-        expires_at = expires_at_str  # Já é datetime
+    def _requeue(self, batch):
+        """Devolve ao buffer o que não foi gravado (sem sobrescrever checks mais novos)"""
+        with self._lock:
+            self.failed += 1
+            for license_id, timestamp in batch.items():
+                current = self._pending.get(license_id)
+                if current is None or timestamp > current:
+                    self._pending[license_id] = timestamp
     
-    now = datetime.now()
+    def shutdown(self):
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._wake.set()
+        self.flush()
     
-    if now > expires_at:
-        db.execute(
-            'UPDATE licenses SET status = ? WHERE id = ?',
-            ('expired', license_id)
-        )
-        db.commit()
-        log_validation(license_key, hwid_request, 'expired', hwid_request, 'Licença expirada', ip_address)
-        db.close()
-        return jsonify({
-            'valid': False,
-            'message': 'Licença expirada',
-            'status': 'expired',
-            'expired_at': expires_at_str
-        }), 403
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'flushed': self.flushed,
+                'batches': self.batches,
+                'failed': self.failed,
+            }
+
+last_check_buffer = LastCheckBuffer(LAST_CHECK_MAX_STALENESS, LAST_CHECK_MAX_PENDING)
+atexit.register(last_check_buffer.shutdown)
+
+# ============================================================================
+# TAREFAS PERIÓDICAS
+# ============================================================================
+
+class PeriodicJob:
+    """Executa `func` a cada `interval` segundos em uma thread daemon (uma por processo)"""
     
-    # Atualiza último check
-    last_check_time = now.isoformat()
-    db.execute(
-        'UPDATE licenses SET last_check = ? WHERE id = ?',
-        (last_check_time, license_id)
-    )
-    db.commit()
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self._pid = None
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.failures = 0
+        self.last_run = None
     
-    # Calcula dias restantes
-    days_remaining = (expires_at - now).days
+    def start(self):
+        if self.interval <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name=self.name, daemon=True).start()
     
-    log_validation(license_key, hwid_request, 'success', hwid_request, 'Validação bem-sucedida', ip_address)
-    db.close()
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.func()
+                self.runs += 1
+            except Exception as e:
+                self.failures += 1
+                print(f"❌ Tarefa {self.name} falhou: {e}")
+            self.last_run = datetime.now().isoformat()
     
-    return jsonify({
-        'valid': True,
-        'message': 'Licença válida',
-        'expires_at': expires_at_str,
-        'plan': license_dict['plan'],
-        'bound_hwid': bound_hwid,
-        'days_remaining': days_remaining,
-        'status': 'active',
-        'client_name': license_dict.get('client_name', 'Não informado'),
-        'last_check_at': last_check_time
-    })
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'runs': self.runs,
+            'failures': self.failures,
+            'last_run': self.last_run,
+        }
 
-@app.route('/api/licenses/create', methods=['POST'])
-@require_admin
-def create_license():
+periodic_jobs = []
+
+def start_periodic_jobs():
+    """Sobe as tarefas periódicas no processo atual (idempotente)"""
+    for job in periodic_jobs:
+        job.start()
+
+# ============================================================================
+# ROLLUP E RETENÇÃO DE validation_logs
+# ============================================================================
+
+VALIDATION_LOG_RETENTION_DAYS = int(os.environ.get('VALIDATION_LOG_RETENTION_DAYS', 90))
+ROLLUP_DELETE_BATCH = int(os.environ.get('ROLLUP_DELETE_BATCH', 5000))
+ROLLUP_DELETE_PAUSE_MS = int(os.environ.get('ROLLUP_DELETE_PAUSE_MS', 50))
+ROLLUP_INTERVAL_HOURS = float(os.environ.get('ROLLUP_INTERVAL_HOURS', 0))   # 0 = só pela linha de comando
+
+# Chave do pg_try_advisory_lock: um rollup por vez entre workers
+ROLLUP_LOCK_ID = 7302
+
+def get_state(conn, name):
+    row = execute_query(conn, 'SELECT value FROM maintenance_state WHERE name = ?', (name,)).fetchone()
+    return row['value'] if row else None
+
+def set_state(conn, name, value):
+    if execute_query(conn, 'UPDATE maintenance_state SET value = ? WHERE name = ?', (value, name)).rowcount == 0:
+        execute_query(conn, 'INSERT INTO maintenance_state (name, value) VALUES (?, ?)', (name, value))
+
+def _first_log_day(conn):
+    row = execute_query(conn, 'SELECT MIN(checked_at) AS first FROM validation_logs').fetchone()
+    first = row['first'] if row else None
+    if first is None:
+        return None
+    if isinstance(first, str):
+        return date.fromisoformat(first[:10])
+    return first.date()
+
+def rollup_validation_logs(retention_days=None, delete_batch=None):
     """
-    Cria uma nova licença
+    Agrega os dias completos de validation_logs em validation_daily e apaga,
+    em lotes, os logs brutos mais antigos que a retenção (só dias já agregados).
+
+    Returns:
+        dict: dias agregados, linhas apagadas e último dia agregado
+    """
+    retention_days = VALIDATION_LOG_RETENTION_DAYS if retention_days is None else retention_days
+    delete_batch = delete_batch or ROLLUP_DELETE_BATCH
+    today = date.today()
+    summary = {'days_rolled_up': 0, 'rows_deleted': 0, 'rolled_up_to': None}
     
-    Request:
-    {
-        "license_key": "XXXX-XXXX-XXXX-XXXX",
-        "hwid": "XXXX-XXXX-XXXX-XXXX",
-        "client_name": "Nome do Cliente",
+    conn = get_db()
+    try:
+        if USE_POSTGRES:
+            locked = execute_query(conn, 'SELECT pg_try_advisory_lock(?) AS locked', (ROLLUP_LOCK_ID,)).fetchone()
+            conn.commit()
+            if not locked['locked']:
+                summary['skipped'] = 'rollup já em execução em outro processo'
+                return summary
+        
+        last_day = get_state(conn, 'rollup_last_day')
+        day = date.fromisoformat(last_day) + timedelta(days=1) if last_day else _first_log_day(conn)
+        conn.rollback()
+        
+        # Um dia por transação: DELETE + INSERT deixa a reexecução idempotente
+        day_param = 'CAST(? AS DATE)' if USE_POSTGRES else '?'
+        while day is not None and day < today:
+            start, end = day.isoformat(), (day + timedelta(days=1)).isoformat()
+            execute_query(conn, 'DELETE FROM validation_daily WHERE day = ?', (start,))
+            execute_query(conn, f'''
+                INSERT INTO validation_daily
+                (license_key, day, result, checks, distinct_hwids, distinct_ips)
+                SELECT license_key, {day_param}, COALESCE(result, ''), COUNT(*),
+                       COUNT(DISTINCT hwid), COUNT(DISTINCT ip_address)
+                FROM validation_logs
+                WHERE checked_at >= ? AND checked_at < ?
+                GROUP BY license_key, COALESCE(result, '')
+            ''', (start, start, end))
+            set_state(conn, 'rollup_last_day', start)
+            conn.commit()
+            summary['days_rolled_up'] += 1
+            last_day = start
+            day += timedelta(days=1)
+        
+        summary['rolled_up_to'] = last_day
+        if last_day is None:
+            return summary
+        
+        # Retenção: nunca apaga dia que ainda não foi agregado
+        cutoff = min(today - timedelta(days=retention_days), date.fromisoformat(last_day) + timedelta(days=1))
+        while True:
+            cur = execute_query(conn, '''
+                DELETE FROM validation_logs WHERE id IN (
+                    SELECT id FROM validation_logs WHERE checked_at < ? LIMIT ?
+                )
+            ''', (cutoff.isoformat(), delete_batch))
+            deleted = cur.rowcount
+            conn.commit()
+            summary['rows_deleted'] += deleted
+            if deleted < delete_batch:
+                break
+            # Lotes curtos com pausa: não segura lock nem disputa com o /api/validate
+            time.sleep(ROLLUP_DELETE_PAUSE_MS / 1000.0)
+        
+        return summary
+    finally:
+        if USE_POSTGRES and not conn.raw.closed:
+            conn.rollback()
+            execute_query(conn, 'SELECT pg_advisory_unlock(?)', (ROLLUP_LOCK_ID,))
+            conn.commit()
+        conn.close()
+
+def _scheduled_rollup():
+    summary = rollup_validation_logs()
+    if summary['days_rolled_up'] or summary['rows_deleted']:
+        print(f"🧹 Rollup: {summary['days_rolled_up']} dia(s) agregados, {summary['rows_deleted']} log(s) apagados")
+
+rollup_job = PeriodicJob('rollup-validation-logs', ROLLUP_INTERVAL_HOURS * 3600, _scheduled_rollup)
+periodic_jobs.append(rollup_job)
+
+# ============================================================================
+# VARREDURA DE EXPIRAÇÃO
+# ============================================================================
+
+EXPIRY_SWEEP_INTERVAL = float(os.environ.get('EXPIRY_SWEEP_INTERVAL', 60))   # 0 = só pela linha de comando
+EXPIRY_SWEEP_BATCH = int(os.environ.get('EXPIRY_SWEEP_BATCH', 500))
+EXPIRY_SWEEP_PAUSE_MS = int(os.environ.get('EXPIRY_SWEEP_PAUSE_MS', 50))
+
+# Chave do pg_try_advisory_lock: uma varredura por vez entre workers
+EXPIRY_SWEEP_LOCK_ID = 7303
+
+LICENSES_EXPIRED = metrics.counter('license_expired_total', 'Licenças marcadas como expiradas pela varredura')
+
+def record_license_events(conn, events, actor='system'):
+    """
+    Registra transições de licença em license_events (sem commit).
+
+    Args:
+        events: [(license_id, license_key, event, old_status, new_status), ...]
+    """
+    if not events:
+        return
+    now_iso = datetime.now().isoformat()
+    rows = [event + (actor, now_iso) for event in events]
+    query = '''
+        INSERT INTO license_events (license_id, license_key, event, old_status, new_status, actor, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    '''
+    count_query()
+    if USE_POSTGRES:
+        cur = conn.cursor()
+        cur.executemany(_pg_placeholders(query), rows)
+        cur.close()
+    else:
+        conn.executemany(query, rows)
+
+def _expire_batch(conn, now_iso, batch_size):
+    """Marca até batch_size licenças vencidas como 'expired'; retorna [(id, license_key)] alteradas"""
+    if USE_POSTGRES:
+        # SKIP LOCKED: não espera por linhas presas em uma validação em andamento
+        return [(row['id'], row['license_key']) for row in execute_query(conn, '''
+            UPDATE licenses SET status = 'expired'
+            WHERE id IN (
+                SELECT id FROM licenses
+                WHERE status = 'active' AND expires_at <= ?
+                ORDER BY expires_at
+                LIMIT ?
+                FOR UPDATE SKIP LOCKED
+            ) AND status = 'active'
+            RETURNING id, license_key
+        ''', (now_iso, batch_size)).fetchall()]
+    
+    candidates = execute_query(conn, '''
+        SELECT id, license_key FROM licenses
+        WHERE status = 'active' AND expires_at <= ?
+        ORDER BY expires_at
+        LIMIT ?
+    ''', (now_iso, batch_size)).fetchall()
+    expired = []
+    for row in candidates:
+        # Condicional: revogação/bloqueio concorrente entre o SELECT e o UPDATE prevalece
+        cur = execute_query(conn, "UPDATE licenses SET status = 'expired' WHERE id = ? AND status = 'active'",
+                            (row['id'],))
+        if cur.rowcount:
+            expired.append((row['id'], row['license_key']))
+    return expired
+
+def sweep_expired_licenses(batch_size=None, now=None):
+    """
+    Marca como 'expired', em lotes (um commit por lote), as licenças ativas
+    vencidas; cada transição vai para license_events e sai do license_cache.
+
+    Returns:
+        dict: licenças expiradas e lotes executados
+    """
+    batch_size = batch_size or EXPIRY_SWEEP_BATCH
+    now_iso = (now or datetime.now()).isoformat()
+    summary = {'expired': 0, 'batches': 0}
+    
+    conn = get_db()
+    try:
+        if USE_POSTGRES:
+            locked = execute_query(conn, 'SELECT pg_try_advisory_lock(?) AS locked', (EXPIRY_SWEEP_LOCK_ID,)).fetchone()
+            conn.commit()
+            if not locked['locked']:
+                summary['skipped'] = 'varredura já em execução em outro processo'
+                return summary
+        
+        while True:
+            expired = _expire_batch(conn, now_iso, batch_size)
+            record_license_events(conn, [(license_id, license_key, 'expired', 'active', 'expired')
+                                         for license_id, license_key in expired], actor='expiry_sweeper')
+            conn.commit()
+            for _, license_key in expired:
+                license_cache.invalidate(license_key)
+            summary['batches'] += 1
+            summary['expired'] += len(expired)
+            LICENSES_EXPIRED.inc(len(expired))
+            if len(expired) < batch_size:
+                break
+            # Lotes curtos com pausa: não disputa com o /api/validate
+            time.sleep(EXPIRY_SWEEP_PAUSE_MS / 1000.0)
+        
+        return summary
+    finally:
+        if USE_POSTGRES and not conn.raw.closed:
+            conn.rollback()
+            execute_query(conn, 'SELECT pg_advisory_unlock(?)', (EXPIRY_SWEEP_LOCK_ID,))
+            conn.commit()
+        conn.close()
+
+def _scheduled_expiry_sweep():
+    summary = sweep_expired_licenses()
+    if summary['expired']:
+        print(f"⌛ Varredura: {summary['expired']} licença(s) expirada(s) em {summary['batches']} lote(s)")
+
+expiry_sweep_job = PeriodicJob('expiry-sweeper', EXPIRY_SWEEP_INTERVAL, _scheduled_expiry_sweep)
+periodic_jobs.append(expiry_sweep_job)
+
+# ============================================================================
+# DETECTOR DE CLONAGEM
+# ============================================================================
+
+clone_detector = CloneDetector(
+    windows=CLONE_WINDOWS,
+    hwid_points=CLONE_HWID_POINTS,
+    ip_points=CLONE_IP_POINTS,
+    ip_allowance=CLONE_IP_ALLOWANCE,
+    alert_score=CLONE_ALERT_SCORE,
+    alert_cooldown=CLONE_ALERT_COOLDOWN,
+    state_dir=CLONE_STATE_DIR,
+    enabled=CLONE_DETECTOR_ENABLED,
+)
+telegram_notifier = TelegramNotifier(ALERT_TELEGRAM_TOKEN, ALERT_TELEGRAM_CHAT_ID)
+
+def _windows_text(windows):
+    return ', '.join(f"{int(w) // 60} min: {c['hwids']} HWID/{c['ips']} IP" for w, c in
+                     sorted(windows.items(), key=lambda item: int(item[0])))
+
+def on_clone_alert(alert):
+    """Alerta de risco: log, license_events (via audit_writer) e Telegram"""
+    print(f"🚨 RISCO DE CLONAGEM: {alert['license_key']} score {alert['score']} ({_windows_text(alert['windows'])})")
+    audit_writer.enqueue('license_events', (
+        alert['license_id'], alert['license_key'], 'clone_alert', alert['status'], alert['status'],
+        'clone_detector', datetime.fromtimestamp(alert['at']).isoformat(),
+        app.json.dumps({key: alert[key] for key in ('score', 'windows', 'hwid', 'ip_address')})
+    ))
+    telegram_notifier.send(
+        f"🚨 Risco de clonagem (score {alert['score']})\n"
+        f"Licença: {alert['license_key']}\n"
+        f"HWID: {alert['hwid']}\nIP: {alert['ip_address']}\n"
+        f"{_windows_text(alert['windows'])}"
+    )
+
+clone_detector.alert_handlers.append(on_clone_alert)
+atexit.register(clone_detector.save)
+
+clone_snapshot_job = PeriodicJob('clone-detector-snapshot', CLONE_SNAPSHOT_INTERVAL if CLONE_STATE_DIR else 0,
+                                 clone_detector.save)
+periodic_jobs.append(clone_snapshot_job)
+
+# ============================================================================
+# TOKENS OFFLINE
+# ============================================================================
+
+# O cliente confere com a chave pública embutida e só volta ao servidor a cada poucos dias
+token_signer = TokenSigner(OFFLINE_TOKEN_KID, OFFLINE_TOKEN_KEY, ttl=OFFLINE_TOKEN_TTL_DAYS * 86400)
+
+# ============================================================================
+# LIMITE DE TAXA
+# ============================================================================
+
+ip_limiter = TokenBucketLimiter(RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST,
+                                max_keys=RATE_LIMIT_MAX_KEYS, enabled=RATE_LIMIT_ENABLED)
+key_limiter = TokenBucketLimiter(RATE_LIMIT_KEY_RATE, RATE_LIMIT_KEY_BURST,
+                                 max_keys=RATE_LIMIT_MAX_KEYS, enabled=RATE_LIMIT_ENABLED)
+
+def check_rate_limit(ip_address, license_keys):
+    """
+    Aplica os limites por IP e por chave antes de qualquer acesso ao banco.
+    Retorna a resposta 429 (com Retry-After) ou None se liberado.
+    Se uma chave é recusada, as fichas já consumidas (IP e chaves anteriores) são devolvidas.
+    """
+    ip_cost = max(1, len(license_keys))
+    wait = ip_limiter.acquire(ip_address, cost=ip_cost)
+    if not wait:
+        for i, key in enumerate(license_keys):
+            wait = key_limiter.acquire(key)
+            if wait:
+                ip_limiter.refund(ip_address, ip_cost)
+                for earlier in license_keys[:i]:
+                    key_limiter.refund(earlier)
+                break
+    if not wait:
+        return None
+    
+    response = jsonify({
+        'valid': False,
+        'message': 'Muitas requisições. Tente novamente mais tarde.',
+        'retry_after': retry_after_header(wait)
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = retry_after_header(wait)
+    return response
+
+# ============================================================================
+# FILTRO DE CHAVES EXISTENTES
+# ============================================================================
+
+# Ids SERIAL podem ficar visíveis fora de ordem (transações concorrentes):
+# a atualização incremental relê uma janela de ids antes do último visto
+LICENSE_FILTER_ID_OVERLAP = 1000
+
+def _load_license_keys(since_id=None):
+    """Chaves de `licenses` (todas, ou com id recente) e o maior id visto"""
+    if since_id is None:
+        query, params = 'SELECT id, license_key FROM licenses', None
+    else:
+        query, params = 'SELECT id, license_key FROM licenses WHERE id > ?', (since_id - LICENSE_FILTER_ID_OVERLAP,)
+    conn = get_db()
+    try:
+        keys = []
+        max_id = since_id or 0
+        for row in stream_query(conn, query, params, batch_size=5000):
+            keys.append(row['license_key'])
+            max_id = max(max_id, row['id'])
+        return keys, max_id
+    finally:
+        conn.rollback()
+        conn.close()
+
+license_filter = KeyFilter(
+    lambda: _load_license_keys(),
+    _load_license_keys,
+    refresh_interval=LICENSE_FILTER_REFRESH_SECONDS,
+    rebuild_interval=LICENSE_FILTER_REBUILD_MINUTES * 60,
+    error_rate=LICENSE_FILTER_ERROR_RATE,
+    enabled=LICENSE_FILTER_ENABLED,
+)
+
+UNKNOWN_KEYS = metrics.counter('license_unknown_key_total', 'Validações de chaves inexistentes')
+_unknown_key_seq = itertools.count()
+
+def record_unknown_key(license_key, hwid, ip_address, source):
+    """
+    Conta uma tentativa com chave inexistente (source: 'filter' ou 'database')
+    e grava só uma amostra em validation_logs, para enxurradas não virarem escrita
+    """
+    UNKNOWN_KEYS.inc(source=source)
+    if UNKNOWN_KEY_LOG_SAMPLE <= 1:
+        log_validation(license_key, hwid, 'not_found', hwid, 'Licença não encontrada', ip_address)
+    elif next(_unknown_key_seq) % UNKNOWN_KEY_LOG_SAMPLE == 0:
+        log_validation(license_key, hwid, 'not_found', hwid,
+                       f'Licença não encontrada (amostra 1/{UNKNOWN_KEY_LOG_SAMPLE})', ip_address)
+
+# ============================================================================
+# FUNÇÕES AUXILIARES
+# ============================================================================
+
+def update_if(db, statement, params):
+    """
+    UPDATE condicional (comando preparado): retorna True se alguma linha foi alterada.
+    No PostgreSQL usa RETURNING (a linha travada é reavaliada após commits concorrentes).
+    """
+    db.execute_prepared(statement, params)
+    if USE_POSTGRES:
+        return db.fetchone() is not None
+    return db.total_changes > 0
+
+def as_datetime(value):
+    """Data/hora de uma coluna TIMESTAMP (PostgreSQL: datetime; SQLite: texto ISO)"""
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+def apply_validation(db, license_dict, hwid_request, ip_address, now):
+    """
+    Aplica as regras de validação a uma licença já lida, dentro da transação de `db`.
+
+    Vínculo e bloqueio são gravados sem commit (quem chama faz um único
+    commit); last_check vai para o last_check_buffer e a auditoria para a fila
+    do audit_writer. Expiração só é lida aqui: quem grava 'expired' é a
+    varredura (sweep_expired_licenses).
+    `license_dict` é atualizado com o novo estado.
+
+    Returns:
+        tuple: (resposta, status_http)
+    """
+    license_key = license_dict['license_key']
+    license_id = license_dict['id']
+    now_iso = now.isoformat()
+    last_check_time = None
+    
+    # Janelas de HWID/IP distintos (só memória); alertas saem em segundo plano
+    clone_detector.observe(license_key, hwid_request, ip_address,
+                           context={'license_id': license_id, 'status': license_dict['status']})
+    
+    # PROTEÇÃO ANTI-CLONAGEM
+    # Os UPDATEs só valem se o vínculo ainda for o que foi lido; se outra requisição
+    # mudou antes (ex.: dois first-binds simultâneos), relê a licença e decide de novo
+    for _ in range(3):
+        bound_hwid = license_dict['bound_hwid']
+        
+        if bound_hwid is None:
+            # Primeira vez usando - vincular ao HWID atual
+            if update_if(db, STMT_BIND_LICENSE, (hwid_request, now_iso, license_id)):
+                log_hwid_change(license_id, None, hwid_request, 'first_bind')
+                license_dict['bound_hwid'] = hwid_request
+                license_dict['last_check'] = last_check_time = now_iso
+                print(f"🔗 Licença {license_key} vinculada ao HWID {hwid_request}")
+                break
+        
+        elif bound_hwid == hwid_request:
+            break
+        
+        # Já bloqueada, revogada ou expirada: nada a gravar, as verificações abaixo recusam
+        elif license_dict['status'] != 'active' or as_datetime(license_dict['expires_at']) <= now:
+            break
+        
+        # TENTATIVA DE USO EM PC DIFERENTE - BLOQUEAR!
+        elif update_if(db, STMT_BLOCK_LICENSE, ('blocked_multiple_pc', license_id, now_iso, hwid_request)):
+            # Na mesma transação do bloqueio: o feed de revogações não pode perder o evento
+            record_license_events(db.conn, [(license_id, license_key, 'blocked', license_dict['status'],
+                                             'blocked_multiple_pc')], actor='validation')
+            log_validation(license_key, hwid_request, 'blocked_multiple_pc', hwid_request,
+                           f'Tentativa de uso em PC diferente. Original: {bound_hwid}', ip_address)
+            log_hwid_change(license_id, bound_hwid, hwid_request, 'blocked_attempt')
+            license_dict['status'] = 'blocked_multiple_pc'
+            
+            print(f"🚨 BLOQUEIO: Licença {license_key} tentou usar em PC diferente!")
+            print(f"   HWID Original: {bound_hwid}")
+            print(f"   HWID Tentativa: {hwid_request}")
+            
+            return {
+                'valid': False,
+                'message': 'Licença bloqueada: detectado uso em múltiplos PCs. Entre em contato com o suporte.',
+                'status': 'blocked_multiple_pc'
+            }, 403
+        
+        current = db.execute_prepared(STMT_LICENSE_BY_ID, (license_id,)).fetchone()
+        if not current:
+            return {'valid': False, 'message': 'Licença não encontrada'}, 404
+        license_dict.update(dict(current))
+    else:
+        return {
+            'valid': False,
+            'message': 'Licença alterada durante a validação. Tente novamente.'
+        }, 409
+    
+    status = license_dict['status']
+    expires_at_str = license_dict['expires_at']
+    
+    # Verifica se está bloqueada
+    if status == 'blocked_multiple_pc':
+        log_validation(license_key, hwid_request, 'blocked', hwid_request, 'Licença bloqueada por uso múltiplo', ip_address)
+        return {
+            'valid': False,
+            'message': 'Licença bloqueada por uso em múltiplos PCs. Entre em contato com o suporte.',
+            'status': 'blocked_multiple_pc'
+        }, 403
+    
+    if status == 'revoked':
+        log_validation(license_key, hwid_request, 'revoked', hwid_request, 'Licença revogada', ip_address)
+        return {
+            'valid': False,
+            'message': 'Licença revogada',
+            'status': 'revoked'
+        }, 403
+    
+    # Verifica expiração
+    expires_at = as_datetime(expires_at_str)
+    
+    if now > expires_at:
+        log_validation(license_key, hwid_request, 'expired', hwid_request, 'Licença expirada', ip_address)
+        return {
+            'valid': False,
+            'message': 'Licença expirada',
+            'status': 'expired',
+            'expired_at': expires_at_str
+        }, 403
+    
+    # Atualiza último check (o first-bind já gravou; o resto vai em lote)
+    if last_check_time is None:
+        last_check_time = now_iso
+        last_check_buffer.touch(license_id, last_check_time)
+    
+    # Calcula dias restantes
+    days_remaining = (expires_at - now).days
+    
+    log_validation(license_key, hwid_request, 'success', hwid_request, 'Validação bem-sucedida', ip_address)
+    
+    result = {
+        'valid': True,
+        'message': 'Licença válida',
+        'expires_at': expires_at_str,
+        'plan': license_dict['plan'],
+        'bound_hwid': license_dict['bound_hwid'],
+        'days_remaining': days_remaining,
+        'status': 'active',
+        'client_name': license_dict.get('client_name', 'Não informado'),
+        'last_check_at': last_check_time
+    }
+    
+    # Token assinado para validação local (offline) no cliente
+    offline_token = token_signer.issue(license_key, license_dict['bound_hwid'], license_dict['plan'],
+                                       expires_at.timestamp(), now.timestamp())
+    if offline_token:
+        result['offline_token'] = offline_token
+    
+    return result, 200
+
+# ============================================================================
+# MÉTRICAS
+# ============================================================================
+
+def _pool_metric(field):
+    def read():
+        stats = pool_stats()
+        return stats[field] if stats else None
+    return read
+
+metrics.gauge_callback('db_pool_connections_in_use', 'Conexões emprestadas do pool', _pool_metric('in_use'))
+metrics.gauge_callback('db_pool_connections_idle', 'Conexões ociosas no pool', _pool_metric('idle'))
+metrics.counter_callback('db_pool_checkouts_total', 'Conexões emprestadas do pool', _pool_metric('checkouts'))
+metrics.counter_callback('db_pool_exhausted_total', 'Checkouts que esperaram por pool cheio', _pool_metric('exhausted'))
+metrics.counter_callback('db_pool_timeouts_total', 'Checkouts que desistiram por timeout', _pool_metric('timeouts'))
+metrics.counter_callback('db_pool_reconnects_total', 'Conexões mortas substituídas', _pool_metric('reconnects'))
+
+metrics.counter_callback('license_cache_hits_total', 'Validações servidas do cache', lambda: license_cache.hits)
+metrics.counter_callback('license_cache_misses_total', 'Validações que leram do banco', lambda: license_cache.misses)
+metrics.counter_callback('license_cache_evictions_total', 'Entradas removidas por LRU', lambda: license_cache.evictions)
+metrics.ratio_gauge('license_cache_hit_ratio', 'Fração de leituras servidas do cache',
+                    'license_cache_hits_total', ('license_cache_hits_total', 'license_cache_misses_total'))
+
+metrics.gauge_callback('audit_queue_depth', 'Linhas de auditoria aguardando gravação',
+                       lambda: audit_writer.stats()['queued'])
+metrics.counter_callback('audit_dropped_total', 'Linhas de auditoria descartadas (fila cheia)', lambda: audit_writer.dropped)
+metrics.counter_callback('audit_written_total', 'Linhas de auditoria gravadas', lambda: audit_writer.written)
+metrics.gauge_callback('last_check_pending', 'Licenças com last_check aguardando gravação',
+                       lambda: last_check_buffer.stats()['pending'])
+
+metrics.counter_callback('rate_limited_total', 'Requisições recusadas pelo limite de taxa',
+                         lambda: {(('scope', 'ip'),): ip_limiter.limited,
+                                  (('scope', 'license_key'),): key_limiter.limited})
+metrics.gauge_callback('rate_limit_buckets', 'Baldes de limite de taxa em memória',
+                       lambda: {(('scope', 'ip'),): ip_limiter.stats()['keys'],
+                                (('scope', 'license_key'),): key_limiter.stats()['keys']})
+
+metrics.gauge_callback('license_filter_keys', 'Chaves no filtro de chaves existentes',
+                       lambda: license_filter.stats()['keys'])
+metrics.counter_callback('license_filter_rejected_total', 'Chaves recusadas pelo filtro sem ir ao banco',
+                         lambda: license_filter.rejected)
+metrics.counter_callback('license_filter_refreshes_total', 'Atualizações incrementais do filtro',
+                         lambda: license_filter.refreshes)
+
+metrics.gauge_callback('clone_detector_licenses', 'Licenças acompanhadas pelo detector de clonagem',
+                       lambda: clone_detector.stats()['licenses'])
+metrics.counter_callback('clone_alerts_total', 'Alertas de risco de clonagem', lambda: clone_detector.alerts)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.start()
+
+@app.after_request
+def observe_request(response):
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        labels = {'route': route, 'method': request.method, 'status': response.status_code}
+        elapsed = time.perf_counter() - started
+        HTTP_LATENCY.observe(elapsed, **labels)
+        HTTP_REQUESTS.inc(**labels)
+        if startup['first_request_seconds'] is None and startup['pid'] == os.getpid():
+            record_first_request(elapsed)
+    return response
+
+# ============================================================================
+# ENDPOINTS DA API
+# ============================================================================
+
+# Probes e métricas não conectam nem sobem tarefas: com o banco fora do ar, cada health check
+# viraria uma tentativa de conexão. O /ready tenta (senão o worker nunca ficaria pronto sem
+# tráfego), limitado por DB_CONNECT_RETRY_SECONDS como as demais rotas.
+PROBE_ENDPOINTS = frozenset({'health', 'metrics_endpoint'})
+
+@app.before_request
+def ensure_periodic_jobs():
+    """Conexão inicial e tarefas periódicas sobem no primeiro request de cada worker"""
+    if request.endpoint in PROBE_ENDPOINTS:
+        return
+    ensure_ready()
+    start_periodic_jobs()
+
+@app.route('/')
+def index():
+    """Página inicial"""
+    return jsonify({
+        'service': 'License Validation API v3.0',
+        'status': 'online',
+        'timestamp': datetime.now().isoformat(),
+        'features': [
+            'Proteção anti-clonagem',
+            'Modo offline (30 dias)',
+            'Cache criptografado',
+            'Auditoria completa'
+        ]
+    })
+
+@app.route('/health')
+def health():
+    """Health check"""
+    return jsonify({
+        'status': 'healthy',
+        'timestamp': datetime.now().isoformat(),
+        'db_pool': pool_stats(),
+        'audit': audit_writer.stats(),
+        'license_cache': license_cache.stats(),
+        'last_check': last_check_buffer.stats(),
+        'rate_limit': {'ip': ip_limiter.stats(), 'license_key': key_limiter.stats()},
+        'license_filter': license_filter.stats(),
+        'clone_detector': clone_detector.stats(),
+        'offline_tokens': token_signer.stats(),
+        'startup': startup_stats()
+    })
+
+@app.route('/ready')
+def ready():
+    """Readiness: 200 quando este worker já conectou ao banco, 503 se ainda não conseguiu"""
+    stats = startup_stats()
+    return jsonify(stats), 200 if stats['ready'] else 503
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Métricas no formato Prometheus (somadas entre workers com METRICS_DIR)"""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return jsonify({'error': 'Token de métricas inválido'}), 401
+    return app.response_class(metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.route('/api/validate', methods=['POST'])
+@require_api_key
+def validate_license():
+    """
+    Valida uma licença
+    
+    Request:
+    {
+        "license_key": "LIC2-XXXX-XXXX-XXXX-XXXX",
+        "hwid": "XXXX-XXXX-XXXX-XXXX"
+    }
+    
+    Response:
+    {
+        "valid": true/false,
+        "message": "...",
+        "expires_at": "...",
+        "plan": "...",
+        "bound_hwid": "...",
+        "days_remaining": 30,
+        "offline_token": "LT1.<kid>.<payload>.<assinatura>"
+    }
+    """
+    data = request.get_json()
+    license_key = data.get('license_key', '').strip()
+    hwid_request = data.get('hwid', '').strip()
+    ip_address = request.remote_addr
+    
+    if not license_key or not hwid_request:
+        return jsonify({
+            'valid': False,
+            'message': 'Chave de licença e HWID são obrigatórios'
+        }), 400
+    
+    # Formato/dígito verificador: chave digitada errado ou inventada não chega ao banco
+    if not is_valid_key(license_key):
+        UNKNOWN_KEYS.inc(source='format')
+        return jsonify({
+            'valid': False,
+            'message': 'Formato de chave de licença inválido'
+        }), 400
+    
+    limited = check_rate_limit(ip_address, [license_key])
+    if limited is not None:
+        return limited
+    
+    if not license_filter.might_exist(license_key):
+        record_unknown_key(license_key, hwid_request, ip_address, 'filter')
+        return jsonify({
+            'valid': False,
+            'message': 'Licença não encontrada'
+        }), 404
+    
+    # Uma conexão, uma transação e um único commit por validação
+    # (com a licença em cache e sem mudança de estado, nem chega a conectar)
+    db = get_db_wrapped(lazy=True)
+    try:
+        license_dict = license_cache.get(license_key)
+        if license_dict is None:
+            generation = license_cache.generation()
+            license_row = db.execute_prepared(STMT_LICENSE_BY_KEY, (license_key,)).fetchone()
+            
+            # Licença não encontrada
+            if not license_row:
+                record_unknown_key(license_key, hwid_request, ip_address, 'database')
+                return jsonify({
+                    'valid': False,
+                    'message': 'Licença não encontrada'
+                }), 404
+            
+            license_dict = dict(license_row)
+            license_cache.put(license_key, license_dict, generation)
+        
+        before = (license_dict['bound_hwid'], license_dict['status'])
+        result, status_code = apply_validation(db, license_dict, hwid_request, ip_address, datetime.now())
+        db.commit()
+    finally:
+        db.close()
+    
+    # Vínculo ou bloqueio mudaram a licença: invalida após o commit
+    if (license_dict['bound_hwid'], license_dict['status']) != before:
+        license_cache.invalidate(license_key)
+    
+    return jsonify(result), status_code
+
+@app.route('/api/validate/batch', methods=['POST'])
+@require_api_key
+def validate_license_batch():
+    """
+    Valida várias licenças em uma requisição (vários PDVs do mesmo cliente)
+    
+    Request:
+    {
+        "items": [
+            {"license_key": "XXXX-XXXX-XXXX-XXXX", "hwid": "XXXX-XXXX-XXXX-XXXX"},
+            ...
+        ]
+    }
+    
+    Response (na mesma ordem dos itens; cada um com as mesmas regras de /api/validate):
+    {
+        "results": [
+            {"license_key": "...", "http_status": 200, "valid": true, ...},
+            ...
+        ]
+    }
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+    ip_address = request.remote_addr
+    
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'items deve ser uma lista não vazia'}), 400
+    if len(items) > VALIDATE_BATCH_MAX:
+        return jsonify({'error': f'Máximo de {VALIDATE_BATCH_MAX} itens por lote'}), 413
+    
+    pairs = []
+    for item in items:
+        item = item if isinstance(item, dict) else {}
+        pairs.append((str(item.get('license_key') or '').strip(), str(item.get('hwid') or '').strip()))
+    
+    keys = list(dict.fromkeys(key for key, hwid in pairs if key and hwid and is_valid_key(key)))
+    
+    limited = check_rate_limit(ip_address, keys)
+    if limited is not None:
+        return limited
+    
+    # Uma leitura (IN/ANY) para o que não está em cache, uma transação para o lote todo
+    db = get_db_wrapped(lazy=True)
+    try:
+        licenses = {}
+        missing = []
+        absent = set()
+        for key in keys:
+            cached = license_cache.get(key)
+            if cached is not None:
+                licenses[key] = cached
+            elif license_filter.might_exist(key):
+                missing.append(key)
+            else:
+                absent.add(key)
+        
+        if missing:
+            generation = license_cache.generation()
+            if USE_POSTGRES:
+                rows = db.execute_prepared(STMT_LICENSES_BY_KEYS, (missing,)).fetchall()
+            else:
+                placeholders = ', '.join('?' * len(missing))
+                rows = db.execute(f'SELECT * FROM licenses WHERE license_key IN ({placeholders})', missing).fetchall()
+            for row in rows:
+                license_dict = dict(row)
+                licenses[license_dict['license_key']] = license_dict
+                license_cache.put(license_dict['license_key'], license_dict, generation)
+        
+        before = {key: (lic['bound_hwid'], lic['status']) for key, lic in licenses.items()}
+        now = datetime.now()
+        results = []
+        
+        # Chaves repetidas compartilham o mesmo dict: o item seguinte vê o vínculo/bloqueio do anterior
+        for license_key, hwid_request in pairs:
+            if not license_key or not hwid_request:
+                result, status_code = {
+                    'valid': False,
+                    'message': 'Chave de licença e HWID são obrigatórios'
+                }, 400
+            elif not is_valid_key(license_key):
+                UNKNOWN_KEYS.inc(source='format')
+                result, status_code = {
+                    'valid': False,
+                    'message': 'Formato de chave de licença inválido'
+                }, 400
+            elif license_key not in licenses:
+                record_unknown_key(license_key, hwid_request, ip_address,
+                                   'filter' if license_key in absent else 'database')
+                result, status_code = {
+                    'valid': False,
+                    'message': 'Licença não encontrada'
+                }, 404
+            else:
+                result, status_code = apply_validation(db, licenses[license_key], hwid_request, ip_address, now)
+            
+            result['license_key'] = license_key
+            result['http_status'] = status_code
+            results.append(result)
+        
+        db.commit()
+    finally:
+        db.close()
+    
+    for key, lic in licenses.items():
+        if (lic['bound_hwid'], lic['status']) != before[key]:
+            license_cache.invalidate(key)
+    
+    return jsonify({'results': results})
+
+@app.route('/api/licenses/create', methods=['POST'])
+@require_admin
+def create_license():
+    """
+    Cria uma nova licença
+    
+    Request:
+    {
+        "license_key": "LIC2-XXXX-XXXX-XXXX-XXXX",
+        "hwid": "XXXX-XXXX-XXXX-XXXX",
+        "client_name": "Nome do Cliente",
         "duration_days": 365,
         "plan": "premium"
     }
+    
+    license_key precisa estar num formato que a validação aceita (license_keys.is_valid_key):
+    chaves livres, aceitas antes das chaves v2, são recusadas com 400.
     """
     data = request.get_json()
     license_key = data.get('license_key', '').strip()
@@ -468,6 +2058,9 @@ def create_license():
     
     if not license_key or not hwid:
         return jsonify({'error': 'license_key e hwid são obrigatórios'}), 400
+    if not is_valid_key(license_key):
+        # Uma chave fora do formato seria recusada em toda validação
+        return jsonify({'error': 'license_key fora do formato (use LIC2-... com dígito verificador)'}), 400
     
     now = datetime.now()
     expires_at = now + timedelta(days=duration_days)
@@ -481,6 +2074,8 @@ def create_license():
         ''', (license_key, hwid, plan, now.isoformat(), expires_at.isoformat(), client_name))
         db.commit()
         db.close()
+        license_cache.invalidate(license_key)
+        license_filter.add(license_key)
         
         return jsonify({
             'success': True,
@@ -496,6 +2091,170 @@ def create_license():
             return jsonify({'error': 'Licença já existe'}), 409
         return jsonify({'error': str(e)}), 500
 
+def _existing_license_keys(conn, keys):
+    """Quais das `keys` já existem em `licenses` (consultas em blocos)"""
+    existing = set()
+    for start in range(0, len(keys), 500):
+        chunk = keys[start:start + 500]
+        if USE_POSTGRES:
+            rows = execute_query(conn, 'SELECT license_key FROM licenses WHERE license_key = ANY(?)', (chunk,))
+        else:
+            placeholders = ', '.join('?' * len(chunk))
+            rows = execute_query(conn, f'SELECT license_key FROM licenses WHERE license_key IN ({placeholders})', chunk)
+        existing.update(row['license_key'] for row in rows.fetchall())
+    return existing
+
+@app.route('/api/licenses/bulk', methods=['POST'])
+@require_admin
+def create_licenses_bulk():
+    """
+    Cria várias licenças em uma única transação (lote de revenda)
+    
+    Request (campos ausentes vêm de "defaults"; sem license_key a chave é gerada no servidor):
+    {
+        "licenses": [
+            {"license_key": "LIC2-...", "hwid": "...", "client_name": "...", "duration_days": 365, "plan": "premium"},
+            ...
+        ],
+        "defaults": {"hwid": "...", "client_name": "...", "duration_days": 365, "plan": "standard"}
+    }
+    ou só quantidade + padrões:
+    {"count": 500, "defaults": {"hwid": "...", "client_name": "Revenda X"}}
+    
+    Response:
+    {
+        "created": [{"index": 0, "license_key": "...", "client_name": "...", "plan": "...", "expires_at": "..."}, ...],
+        "conflicts": [{"index": 3, "license_key": "...", "error": "Licença já existe"}, ...],
+        "created_at": "..."
+    }
+    """
+    data = request.get_json(silent=True) or {}
+    defaults = data.get('defaults') or {}
+    specs = data.get('licenses')
+    
+    if not isinstance(defaults, dict):
+        return jsonify({'error': 'defaults deve ser um objeto'}), 400
+    if specs is None:
+        count = data.get('count')
+        if not isinstance(count, int) or isinstance(count, bool) or count < 1:
+            return jsonify({'error': 'Informe licenses (lista) ou count (inteiro > 0)'}), 400
+        if count > LICENSE_BULK_MAX:
+            return jsonify({'error': f'Máximo de {LICENSE_BULK_MAX} licenças por lote'}), 413
+        specs = [{}] * count
+    elif not isinstance(specs, list) or not specs:
+        return jsonify({'error': 'licenses deve ser uma lista não vazia'}), 400
+    if len(specs) > LICENSE_BULK_MAX:
+        return jsonify({'error': f'Máximo de {LICENSE_BULK_MAX} licenças por lote'}), 413
+    
+    # Valida tudo antes de gravar: ou o lote entra inteiro (menos conflitos), ou nada entra
+    now = datetime.now()
+    rows = []
+    errors = []
+    for index, spec in enumerate(specs):
+        if not isinstance(spec, dict):
+            errors.append({'index': index, 'error': 'Item deve ser um objeto'})
+            continue
+        item = {**defaults, **spec}
+        license_key = str(item.get('license_key') or '').strip()
+        hwid = str(item.get('hwid') or '').strip()
+        duration_days = item.get('duration_days', 365)
+        if not hwid:
+            errors.append({'index': index, 'error': 'hwid é obrigatório'})
+        elif license_key and not is_valid_key(license_key):
+            errors.append({'index': index, 'error': 'license_key fora do formato'})
+        elif not isinstance(duration_days, int) or isinstance(duration_days, bool) or duration_days < 1:
+            errors.append({'index': index, 'error': 'duration_days deve ser um inteiro > 0'})
+        else:
+            rows.append({
+                'index': index,
+                'license_key': license_key,
+                'hwid': hwid,
+                'plan': item.get('plan') or 'standard',
+                'expires_at': (now + timedelta(days=duration_days)).isoformat(),
+                'client_name': item.get('client_name', ''),
+            })
+    if errors:
+        return jsonify({'error': 'Lote inválido; nenhuma licença criada', 'errors': errors}), 400
+    
+    conflicts = []
+    conn = get_db()
+    try:
+        # Chaves informadas repetidas no próprio lote: a primeira vence
+        seen = set()
+        for row in rows:
+            if row['license_key'] and row['license_key'] in seen:
+                conflicts.append({'index': row['index'], 'license_key': row['license_key'], 'error': 'Chave repetida no lote'})
+                row['skip'] = True
+            seen.add(row['license_key'])
+        rows = [row for row in rows if not row.get('skip')]
+        
+        supplied = [row['license_key'] for row in rows if row['license_key']]
+        existing = _existing_license_keys(conn, supplied)
+        
+        # Chaves geradas: sorteia de novo até não colidir (na prática, uma rodada)
+        pending = [row for row in rows if not row['license_key']]
+        while pending:
+            for row in pending:
+                key = generate_key()
+                while key in seen:
+                    key = generate_key()
+                row['license_key'] = key
+                seen.add(key)
+            clashes = _existing_license_keys(conn, [row['license_key'] for row in pending])
+            pending = [row for row in pending if row['license_key'] in clashes]
+        
+        for row in rows:
+            if row['license_key'] in existing:
+                conflicts.append({'index': row['index'], 'license_key': row['license_key'], 'error': 'Licença já existe'})
+        rows = [row for row in rows if row['license_key'] not in existing]
+        
+        values = [(row['license_key'], row['hwid'], row['plan'], now.isoformat(), row['expires_at'], row['client_name'])
+                  for row in rows]
+        started = time.perf_counter()
+        if USE_POSTGRES:
+            # Um INSERT multi-linha; ON CONFLICT cobre quem criou a mesma chave nesse meio tempo
+            cur = conn.cursor()
+            inserted = execute_values(cur, '''
+                INSERT INTO licenses (license_key, hwid, plan, created_at, expires_at, status, client_name)
+                VALUES %s
+                ON CONFLICT (license_key) DO NOTHING
+                RETURNING license_key
+            ''', values, template="(%s, %s, %s, %s, %s, 'active', %s)", page_size=len(values) or 1, fetch=True)
+            inserted = {row['license_key'] for row in inserted}
+            cur.close()
+        else:
+            cur = conn.executemany('''
+                INSERT OR IGNORE INTO licenses (license_key, hwid, plan, created_at, expires_at, status, client_name)
+                VALUES (?, ?, ?, ?, ?, 'active', ?)
+            ''', values)
+            if cur.rowcount == len(values):
+                inserted = {row['license_key'] for row in rows}
+            else:
+                # Alguém inseriu a mesma chave entre a checagem e o INSERT: as que ficaram são as nossas
+                created = execute_query(conn, 'SELECT license_key FROM licenses WHERE created_at = ?', (now.isoformat(),))
+                inserted = {row['license_key'] for row in created.fetchall()} & {row['license_key'] for row in rows}
+        count_query()
+        conn.commit()
+        DB_QUERY_SECONDS.observe(time.perf_counter() - started, statement='batch_insert_licenses')
+    except Exception as e:
+        conn.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+    
+    created = []
+    for row in rows:
+        if row['license_key'] in inserted:
+            license_cache.invalidate(row['license_key'])
+            license_filter.add(row['license_key'])
+            created.append({key: row[key] for key in ('index', 'license_key', 'client_name', 'plan', 'expires_at')})
+        else:
+            conflicts.append({'index': row['index'], 'license_key': row['license_key'], 'error': 'Licença já existe'})
+    conflicts.sort(key=lambda conflict: conflict['index'])
+    
+    print(f"📦 Lote: {len(created)} licença(s) criadas, {len(conflicts)} conflito(s)")
+    return jsonify({'created': created, 'conflicts': conflicts, 'created_at': now.isoformat()})
+
 @app.route('/api/licenses/unbind/<license_key>', methods=['POST'])
 @require_admin
 def unbind_license(license_key):
@@ -518,7 +2277,11 @@ def unbind_license(license_key):
         SET bound_hwid = NULL, unbind_count = unbind_count + 1
         WHERE license_key = ?
     ''', (license_key,))
+    # O PC antigo deixa de valer: entra no feed de revogações
+    record_license_events(db.conn, [(license_dict['id'], license_key, 'unbound', license_dict['status'],
+                                     license_dict['status'])], actor='admin')
     db.commit()
+    license_cache.invalidate(license_key)
     
     log_hwid_change(license_dict['id'], old_hwid, None, 'admin_unbind', 'admin')
     db.close()
@@ -534,18 +2297,25 @@ def unbind_license(license_key):
 def unblock_license(license_key):
     """Desbloqueia licença que foi bloqueada por uso múltiplo"""
     db = get_db_wrapped()
-    db.execute('''
-        UPDATE licenses 
-        SET status = 'active'
-        WHERE license_key = ? AND status = 'blocked_multiple_pc'
-    ''', (license_key,))
+    license_row = db.execute_prepared(STMT_LICENSE_BY_KEY, (license_key,)).fetchone()
+    unblocked = False
+    if license_row:
+        db.execute('''
+            UPDATE licenses 
+            SET status = 'active'
+            WHERE id = ? AND status = 'blocked_multiple_pc'
+        ''', (license_row['id'],))
+        unblocked = db.total_changes > 0
+    if unblocked:
+        record_license_events(db.conn, [(license_row['id'], license_key, 'unblocked', 'blocked_multiple_pc',
+                                         'active')], actor='admin')
     db.commit()
+    db.close()
+    license_cache.invalidate(license_key)
     
-    if db.total_changes == 0:
-        db.close()
+    if not unblocked:
         return jsonify({'error': 'Licença não encontrada ou não está bloqueada'}), 404
     
-    db.close()
     return jsonify({
         'success': True,
         'message': 'Licença desbloqueada'
@@ -568,70 +2338,585 @@ def get_license(license_key):
     license_dict = dict(license_row)
     db.close()
     
+    # Checks ainda no buffer de write-behind deste processo
+    pending_check = last_check_buffer.pending(license_dict['id'])
+    if pending_check:
+        license_dict['last_check'] = pending_check
+    
     return jsonify(license_dict)
 
+# Colunas devolvidas por tipo de auditoria: (tabela, coluna de tempo, coluna do filtro `result`, colunas)
+AUDIT_KINDS = {
+    'validations': ('validation_logs', 'checked_at', 'result',
+                    ('id', 'checked_at', 'result', 'hwid', 'detected_hwid', 'ip_address', 'message')),
+    'hwid_changes': ('hwid_changes', 'changed_at', 'reason',
+                     ('id', 'changed_at', 'reason', 'old_hwid', 'new_hwid', 'admin_user')),
+}
+
+# Leituras de auditoria simultâneas por worker: nunca tomam o pool inteiro do /api/validate
+audit_read_slots = threading.BoundedSemaphore(AUDIT_MAX_CONCURRENT)
+
+def _isoformat(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+@app.route('/api/licenses/<license_key>/audit', methods=['GET'])
+@require_admin
+def license_audit(license_key):
+    """
+    Auditoria de uma licença (mais recentes primeiro), em streaming
+    
+    Query string (todos opcionais):
+        kind:    validations (validation_logs, padrão) ou hwid_changes
+        from:    início ISO (inclusivo), ex.: 2025-01-01 ou 2025-01-01T10:00:00
+        to:      fim ISO (exclusivo)
+        result:  filtra result (validations) ou reason (hwid_changes)
+        limit:   linhas por página (padrão e máximo AUDIT_PAGE_MAX)
+        after:   cursor "<instante>,<id>" devolvido em next_cursor
+    
+    Resposta: {"license_key", "kind", "items": [...], "next_cursor"} (next_cursor null na última página).
+    Logs mais antigos que a retenção só existem agregados em /api/stats/validations.
+    """
+    kind = request.args.get('kind', 'validations')
+    if kind not in AUDIT_KINDS:
+        return jsonify({'error': 'kind deve ser validations ou hwid_changes'}), 400
+    table, time_column, filter_column, columns = AUDIT_KINDS[kind]
+    
+    try:
+        start = request.args.get('from')
+        end = request.args.get('to')
+        start = datetime.fromisoformat(start).isoformat() if start else None
+        end = datetime.fromisoformat(end).isoformat() if end else None
+        limit = min(int(request.args.get('limit', AUDIT_PAGE_MAX)), AUDIT_PAGE_MAX)
+        if limit < 1:
+            raise ValueError
+        after = request.args.get('after')
+        after_time, after_id = after.rsplit(',', 1) if after else (None, None)
+        after_time = datetime.fromisoformat(after_time).isoformat() if after else None
+        after_id = int(after_id) if after else None
+    except ValueError:
+        return jsonify({'error': 'from, to, limit ou after inválido'}), 400
+    
+    if kind == 'hwid_changes':
+        # hwid_changes é por license_id
+        conn = get_db()
+        try:
+            license_row = execute_prepared(conn, STMT_LICENSE_BY_KEY, (license_key,)).fetchone()
+            conn.rollback()
+        finally:
+            conn.close()
+        if not license_row:
+            return jsonify({'error': 'Licença não encontrada'}), 404
+        where, params = ['license_id = ?'], [license_row['id']]
+    else:
+        where, params = ['license_key = ?'], [license_key]
+    
+    if start:
+        where.append(f'{time_column} >= ?')
+        params.append(start)
+    if end:
+        where.append(f'{time_column} < ?')
+        params.append(end)
+    if request.args.get('result'):
+        where.append(f'{filter_column} = ?')
+        params.append(request.args['result'])
+    if after:
+        where.append(f'({time_column} < ? OR ({time_column} = ? AND id < ?))')
+        params += [after_time, after_time, after_id]
+    
+    query = (f"SELECT {', '.join(columns)} FROM {table} WHERE {' AND '.join(where)} "
+             f"ORDER BY {time_column} DESC, id DESC LIMIT {limit + 1}")
+    
+    if not audit_read_slots.acquire(blocking=False):
+        response = jsonify({'error': 'Muitas consultas de auditoria em andamento. Tente novamente.'})
+        response.status_code = 429
+        response.headers['Retry-After'] = '1'
+        return response
+    
+    def generate():
+        conn = get_db()
+        try:
+            if USE_POSTGRES:
+                execute_query(conn, f'SET LOCAL statement_timeout = {AUDIT_STATEMENT_TIMEOUT_MS}')
+            yield '{' + f'"license_key":{app.json.dumps(license_key)},"kind":"{kind}","items":['
+            next_cursor = None
+            for count, row in enumerate(stream_query(conn, query, params, batch_size=limit + 1)):
+                item = {column: _isoformat(row[column]) for column in columns}
+                if count == limit:
+                    # Linha extra: só indica que existe próxima página
+                    next_cursor = f"{last[time_column]},{last['id']}"
+                    break
+                yield (',' if count else '') + app.json.dumps(item)
+                last = item
+            yield f'],"next_cursor":{app.json.dumps(next_cursor)}' + '}'
+        finally:
+            conn.rollback()
+            conn.close()
+    
+    response = app.response_class(stream_with_context(generate()), mimetype='application/json')
+    response.call_on_close(audit_read_slots.release)
+    return response
+
+@app.route('/api/licenses/<license_key>/risk', methods=['GET'])
+@require_admin
+def license_risk(license_key):
+    """
+    Score de risco de clonagem e HWIDs/IPs distintos por janela
+    
+    Só memória, sem consulta ao banco. O estado é do worker que respondeu
+    ('worker' na resposta): com vários workers cada um vê parte do tráfego.
+    """
+    risk = clone_detector.risk(license_key)
+    if risk is None:
+        risk = {'license_key': license_key, 'score': 0, 'windows': {}, 'last_seen': None, 'last_alert': None}
+    risk['alerts'] = [alert for alert in clone_detector.recent_alerts if alert['license_key'] == license_key]
+    risk['worker'] = os.getpid()
+    return jsonify(risk)
+
 @app.route('/api/licenses', methods=['GET'])
 @require_admin
 def list_licenses():
-    """Lista todas as licenças"""
+    """
+    Lista licenças (mais novas primeiro)
+    
+    Query string (todos opcionais):
+        status:  filtra pelo status
+        fields:  colunas separadas por vírgula (ex.: license_key,status,expires_at)
+        limit:   tamanho da página (máx. LIST_PAGE_MAX); sem limit a lista inteira
+                 é transmitida em streaming direto do cursor do banco
+        after:   cursor "<created_at>,<id>" devolvido no header X-Next-Cursor
+        format:  json (padrão, array) ou ndjson (um objeto por linha)
+    """
     status_filter = request.args.get('status')
+    output_format = request.args.get('format', 'json')
     
-    conn = get_db()
+    if output_format not in ('json', 'ndjson'):
+        return jsonify({'error': 'format deve ser json ou ndjson'}), 400
+    
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+    unknown = [f for f in fields if f not in LICENSE_COLUMNS]
+    if unknown:
+        return jsonify({'error': f"Campos inválidos: {', '.join(unknown)}"}), 400
+    fields = fields or list(LICENSE_COLUMNS)
     
+    limit = request.args.get('limit')
+    after = request.args.get('after')
+    try:
+        limit = min(int(limit), LIST_PAGE_MAX) if limit else None
+        if limit is not None and limit < 1:
+            raise ValueError
+        after_created, after_id = after.rsplit(',', 1) if after else (None, None)
+        after_id = int(after_id) if after else None
+    except ValueError:
+        return jsonify({'error': 'limit ou after inválido'}), 400
+    
+    # created_at e id sempre vêm do banco: são o cursor da paginação
+    columns = list(dict.fromkeys(fields + ['created_at', 'id']))
+    where = []
+    params = []
     if status_filter:
-        cur = execute_query(conn,
-            'SELECT * FROM licenses WHERE status = ? ORDER BY created_at DESC',
-            (status_filter,)
-        )
-    else:
-        cur = execute_query(conn,
-            'SELECT * FROM licenses ORDER BY created_at DESC'
-        )
+        where.append('status = ?')
+        params.append(status_filter)
+    if after:
+        where.append('(created_at < ? OR (created_at = ? AND id < ?))')
+        params += [after_created, after_created, after_id]
     
-    rows = cur.fetchall()
-    licenses = [dict(row) for row in rows]
+    query = f"SELECT {', '.join(columns)} FROM licenses"
+    if where:
+        query += ' WHERE ' + ' AND '.join(where)
+    query += ' ORDER BY created_at DESC, id DESC'
+    if limit is not None:
+        query += f' LIMIT {limit + 1}'
     
-    if USE_POSTGRES:
-        cur.close()
-    conn.close()
+    def project(row):
+        row = dict(row)
+        return {field: row[field] for field in fields}
     
-    return jsonify(licenses)
+    if limit is not None:
+        # Página limitada: lê limit+1 linhas para saber se há próxima página
+        conn = get_db()
+        try:
+            rows = execute_query(conn, query, params).fetchall()
+        finally:
+            conn.close()
+        
+        page = rows[:limit]
+        if output_format == 'ndjson':
+            body = ''.join(app.json.dumps(project(row)) + '\n' for row in page)
+            response = app.response_class(body, mimetype='application/x-ndjson')
+        else:
+            response = jsonify([project(row) for row in page])
+        
+        if len(rows) > limit:
+            last = dict(page[-1])
+            created = last['created_at']
+            created = created.isoformat() if hasattr(created, 'isoformat') else created
+            response.headers['X-Next-Cursor'] = f"{created},{last['id']}"
+        return response
+    
+    def generate():
+        conn = get_db()
+        try:
+            first = True
+            if output_format == 'json':
+                yield '['
+            for row in stream_query(conn, query, params):
+                item = app.json.dumps(project(row))
+                if output_format == 'ndjson':
+                    yield item + '\n'
+                else:
+                    yield item if first else ',' + item
+                first = False
+            if output_format == 'json':
+                yield ']'
+        finally:
+            conn.rollback()
+            conn.close()
+    
+    mimetype = 'application/x-ndjson' if output_format == 'ndjson' else 'application/json'
+    return app.response_class(stream_with_context(generate()), mimetype=mimetype)
 
-@app.route('/api/licenses/<license_key>', methods=['DELETE'])
+@app.route('/api/stats/validations', methods=['GET'])
 @require_admin
-def revoke_license(license_key):
-    """Revoga uma licença"""
-    conn = get_db()
-    cur = execute_query(conn, '''
-        UPDATE licenses 
-        SET status = 'revoked'
-        WHERE license_key = ?
-    ''', (license_key,))
-    conn.commit()
+def validation_stats():
+    """
+    Estatísticas de validação por dia, lidas do rollup (validation_daily)
     
-    if USE_POSTGRES:
-        affected = cur.rowcount
-        cur.close()
-    else:
-        affected = conn.total_changes
+    Query string:
+        days:         janela em dias (padrão 30, máx. 366)
+        license_key:  restringe a uma licença
+    """
+    try:
+        days = min(max(int(request.args.get('days', 30)), 1), 366)
+    except ValueError:
+        return jsonify({'error': 'days inválido'}), 400
+    license_key = request.args.get('license_key')
+    since = (date.today() - timedelta(days=days)).isoformat()
     
-    conn.close()
+    query = '''
+        SELECT day, result, SUM(checks) AS checks, COUNT(DISTINCT license_key) AS licenses
+        FROM validation_daily WHERE day >= ?
+    '''
+    params = [since]
+    if license_key:
+        query += ' AND license_key = ?'
+        params.append(license_key)
+    query += ' GROUP BY day, result ORDER BY day'
     
-    if affected == 0:
-        return jsonify({'error': 'Licença não encontrada'}), 404
+    db = get_db_wrapped()
+    try:
+        rows = db.execute(query, params).fetchall()
+        rolled_up_to = get_state(db.conn, 'rollup_last_day')
+    finally:
+        db.close()
+    
+    by_day = {}
+    totals = {}
+    for row in rows:
+        row = dict(row)
+        day = row['day'] if isinstance(row['day'], str) else row['day'].isoformat()
+        by_day.setdefault(day, {})[row['result']] = int(row['checks'])
+        totals[row['result']] = totals.get(row['result'], 0) + int(row['checks'])
+    
+    return jsonify({
+        'since': since,
+        'rolled_up_to': rolled_up_to,
+        'totals': totals,
+        'days': [{'day': day, 'results': results} for day, results in by_day.items()]
+    })
+
+@app.route('/api/licenses/<license_key>', methods=['DELETE'])
+@require_admin
+def revoke_license(license_key):
+    """Revoga uma licença (e registra 'revoked' em license_events para o feed de revogações)"""
+    conn = get_db()
+    try:
+        license_row = execute_prepared(conn, STMT_LICENSE_BY_KEY, (license_key,)).fetchone()
+        if license_row is None:
+            return jsonify({'error': 'Licença não encontrada'}), 404
+        
+        cur = execute_query(conn, '''
+            UPDATE licenses 
+            SET status = 'revoked'
+            WHERE id = ? AND status <> 'revoked'
+        ''', (license_row['id'],))
+        if cur.rowcount:
+            record_license_events(conn, [(license_row['id'], license_key, 'revoked', license_row['status'],
+                                          'revoked')], actor='admin')
+        if USE_POSTGRES:
+            cur.close()
+        conn.commit()
+    finally:
+        conn.close()
+    license_cache.invalidate(license_key)
     
     return jsonify({
         'success': True,
         'message': 'Licença revogada'
     })
 
+# ============================================================================
+# FEED DE REVOGAÇÕES
+# ============================================================================
+
+# Eventos que mudam o que o cliente pode fazer offline (expiração ele já sabe pelo token)
+REVOCATION_FEED_EVENTS = ('revoked', 'blocked', 'unblocked', 'unbound')
+
+REVOCATION_FEED_REQUESTS = metrics.counter('revocation_feed_requests_total',
+                                           'Requisições ao feed de revogações por resultado do cache')
+
+# (since, limit) -> (válido até, corpo JSON): os clientes em dia pedem todos o mesmo cursor
+revocation_pages = OrderedDict()
+revocation_pages_lock = threading.Lock()
+REVOCATION_PAGES_MAX = 256
+
+def revocation_key_hash(license_key):
+    """Identificador da chave no feed (o feed não expõe chaves de outros clientes)"""
+    return hashlib.sha256(license_key.encode('utf-8')).hexdigest()[:16]
+
+def format_revocation_cursor(tx, event_id):
+    return f'{tx}.{event_id}'
+
+def parse_revocation_cursor(cursor):
+    """'<tx>.<id>' -> (tx, id); ValueError se malformado"""
+    tx, _, event_id = cursor.partition('.')
+    tx, event_id = int(tx), int(event_id)
+    if tx < 0 or event_id < 0:
+        raise ValueError(cursor)
+    return tx, event_id
+
+# PostgreSQL: só entram eventos de transações abaixo do xmin do snapshot (todas já terminaram).
+# Qualquer evento que ainda vá aparecer é de uma transação >= xmin, logo fica depois do cursor
+# (tx, id) já entregue: nada é pulado, por mais longa que seja a transação. Uma transação
+# longa em qualquer tabela só atrasa o feed até terminar.
+REVOCATION_FEED_VISIBLE = 'tx < txid_snapshot_xmin(txid_current_snapshot())'
+
+def load_revocation_page(since, limit):
+    """
+    Mudanças depois do cursor `since` ((tx, id) de license_events), em ordem de commit.
+
+    No SQLite as transações de escrita são serializadas: a ordem do id já é a
+    ordem de commit e tx é sempre 0.
+
+    Returns:
+        dict: since, next_cursor, more (página cheia: há mais para buscar), changes
+    """
+    conn = get_db()
+    try:
+        if since is None:
+            # Sem cursor: começa do ponto atual (o cliente acabou de validar online)
+            if USE_POSTGRES:
+                row = execute_query(conn, f'''
+                    SELECT tx, id FROM license_events WHERE {REVOCATION_FEED_VISIBLE}
+                    ORDER BY tx DESC, id DESC LIMIT 1
+                ''').fetchone()
+            else:
+                row = execute_query(conn, 'SELECT 0 AS tx, MAX(id) AS id FROM license_events').fetchone()
+            conn.rollback()
+            head = (row['tx'], row['id']) if row and row['id'] is not None else (0, 0)
+            return {'since': None, 'next_cursor': format_revocation_cursor(*head), 'more': False, 'changes': []}
+        
+        if USE_POSTGRES:
+            rows = execute_query(conn, f'''
+                SELECT tx, id, license_key, event, new_status FROM license_events
+                WHERE (tx, id) > (?, ?) AND {REVOCATION_FEED_VISIBLE}
+                ORDER BY tx, id
+                LIMIT ?
+            ''', (since[0], since[1], limit)).fetchall()
+        else:
+            rows = execute_query(conn, '''
+                SELECT 0 AS tx, id, license_key, event, new_status FROM license_events
+                WHERE id > ?
+                ORDER BY id
+                LIMIT ?
+            ''', (since[1], limit)).fetchall()
+        conn.rollback()
+    finally:
+        conn.close()
+    
+    next_cursor, changes = since, []
+    for row in rows:
+        next_cursor = (row['tx'], row['id'])
+        if row['event'] in REVOCATION_FEED_EVENTS:
+            changes.append({'key_hash': revocation_key_hash(row['license_key']), 'event': row['event'],
+                            'status': row['new_status'], 'cursor': format_revocation_cursor(*next_cursor)})
+    return {'since': format_revocation_cursor(*since), 'next_cursor': format_revocation_cursor(*next_cursor),
+            'more': len(rows) == limit, 'changes': changes}
+
+@app.route('/api/revocations', methods=['GET'])
+@require_api_key
+def revocations():
+    """
+    Feed de revogações/bloqueios para o cliente consultar entre validações completas
+    
+    Query string:
+        since:  cursor opaco ('<tx>.<id>') devolvido em next_cursor (sem ele: só o cursor atual)
+        limit:  eventos por página (padrão e máximo REVOCATION_FEED_PAGE_MAX)
+    
+    Resposta: {"since", "next_cursor", "more", "changes": [{"key_hash", "event", "status", "cursor"}]}
+    key_hash = sha256(chave)[:16] em hex. Uma página cheia ("more": true) nunca muda e
+    sai com cache longo; a última página fica em cache por REVOCATION_FEED_MAX_AGE segundos
+    (neste worker e em proxies/CDN), então quase nenhuma consulta chega ao banco.
+    """
+    try:
+        since = request.args.get('since')
+        since = parse_revocation_cursor(since) if since else None
+        limit = min(int(request.args.get('limit', REVOCATION_FEED_PAGE_MAX)), REVOCATION_FEED_PAGE_MAX)
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'since ou limit inválido'}), 400
+    
+    cache_key = (since, limit)
+    now = time.monotonic()
+    with revocation_pages_lock:
+        cached = revocation_pages.get(cache_key)
+        if cached is not None and cached[0] > now:
+            revocation_pages.move_to_end(cache_key)
+    
+    if cached is not None and cached[0] > now:
+        REVOCATION_FEED_REQUESTS.inc(cache='hit')
+        body, max_age = cached[1], cached[2]
+    else:
+        REVOCATION_FEED_REQUESTS.inc(cache='miss')
+        page = load_revocation_page(since, limit)
+        max_age = 86400 if page['more'] else REVOCATION_FEED_MAX_AGE
+        body = app.json.dumps(page)
+        with revocation_pages_lock:
+            revocation_pages[cache_key] = (now + max_age, body, max_age)
+            revocation_pages.move_to_end(cache_key)
+            while len(revocation_pages) > REVOCATION_PAGES_MAX:
+                revocation_pages.popitem(last=False)
+    
+    response = app.response_class(body, mimetype='application/json')
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.add_etag()
+    return response.make_conditional(request)
+
 # ============================================================================
 # INICIALIZAÇÃO
 # ============================================================================
 
-# Inicializa o banco ao importar (necessário para Gunicorn)
-init_db()
+# Nada de banco no import: cada worker conecta na primeira requisição (ensure_ready)
+# e o schema vem de `init` / on_starting do gunicorn.conf.py
+STARTUP_TIMING = os.environ.get('STARTUP_TIMING', '0') == '1'
 
-if __name__ == '__main__':
+startup = {
+    'pid': os.getpid(),
+    'ready': False,
+    'import_seconds': time.perf_counter() - IMPORT_STARTED,
+    'db_connect_seconds': None,
+    'first_request_seconds': None,
+    'error': None,
+}
+_startup_lock = threading.Lock()
+
+# Depois de uma falha ao conectar, as requisições seguintes não tentam de novo por este intervalo
+DB_CONNECT_RETRY_SECONDS = float(os.environ.get('DB_CONNECT_RETRY_SECONDS', 5))
+_connect_retry = {'pid': None, 'at': 0.0}
+
+def _connect_backing_off():
+    return _connect_retry['pid'] == os.getpid() and time.monotonic() < _connect_retry['at']
+
+def ensure_ready():
+    """Abre as conexões iniciais do pool deste processo (DB_POOL_MIN, uma vez por worker)"""
+    if startup['ready'] and startup['pid'] == os.getpid():
+        return
+    if _connect_backing_off():
+        return
+    with _startup_lock:
+        if startup['pid'] != os.getpid():
+            # Worker forkado de um master que já importou o módulo (on_starting/--preload)
+            startup.update(pid=os.getpid(), ready=False, import_seconds=0.0,
+                           db_connect_seconds=None, first_request_seconds=None, error=None)
+        if startup['ready'] or _connect_backing_off():
+            return
+        started = time.perf_counter()
+        try:
+            get_db().close()
+            get_pool().warmup()
+        except Exception as e:
+            startup['error'] = str(e)
+            _connect_retry.update(pid=os.getpid(), at=time.monotonic() + DB_CONNECT_RETRY_SECONDS)
+            print(f"❌ Worker {os.getpid()}: banco indisponível: {e}")
+            return
+        startup.update(ready=True, error=None, db_connect_seconds=time.perf_counter() - started)
+
+def record_first_request(seconds):
+    startup['first_request_seconds'] = seconds
+    if STARTUP_TIMING:
+        connect = startup['db_connect_seconds']
+        print(f"⏱️ Worker {os.getpid()}: import {startup['import_seconds'] * 1000:.1f} ms, "
+              f"conexão {connect * 1000 if connect is not None else float('nan'):.1f} ms, "
+              f"1ª requisição {seconds * 1000:.1f} ms")
+
+def startup_stats():
+    stats = dict(startup)
+    if stats['pid'] != os.getpid():
+        stats.update(pid=os.getpid(), ready=False)
+    return stats
+
+def init_schema():
+    """Cria/migra o schema e devolve as conexões (para o master não passá-las aos workers)"""
+    init_db()
+    get_pool().closeall()
+
+def main(argv=None):
+    """
+    Linha de comando:
+        python servidor_licencas_v3.py                  cria/migra o schema e sobe o servidor
+        python servidor_licencas_v3.py init             cria as tabelas e aplica migrações (deploy)
+        python servidor_licencas_v3.py migrate          aplica migrações pendentes
+        python servidor_licencas_v3.py migrate --check  só mostra versão, pendências e planos
+        python servidor_licencas_v3.py rollup           agrega validation_logs e aplica a retenção
+        python servidor_licencas_v3.py expire           marca como expiradas as licenças vencidas
+    """
+    parser = argparse.ArgumentParser(description='Servidor de licenças V3')
+    commands = parser.add_subparsers(dest='command')
+    
+    commands.add_parser('serve', help='sobe o servidor HTTP (padrão)')
+    commands.add_parser('init', help='cria as tabelas e aplica migrações (uma vez por deploy)')
+    
+    migrate = commands.add_parser('migrate', help='migrações de schema')
+    migrate.add_argument('--check', action='store_true',
+                         help='não aplica nada; mostra pendências e planos das consultas quentes')
+    
+    rollup = commands.add_parser('rollup', help='agrega validation_logs por dia e aplica a retenção')
+    rollup.add_argument('--retention-days', type=int, default=VALIDATION_LOG_RETENTION_DAYS,
+                        help=f'dias de log bruto mantidos (padrão {VALIDATION_LOG_RETENTION_DAYS})')
+    
+    expire = commands.add_parser('expire', help='marca como expiradas as licenças vencidas')
+    expire.add_argument('--batch-size', type=int, default=EXPIRY_SWEEP_BATCH,
+                        help=f'licenças por lote/commit (padrão {EXPIRY_SWEEP_BATCH})')
+    
+    args = parser.parse_args(argv)
+    
+    if args.command == 'expire':
+        summary = sweep_expired_licenses(batch_size=args.batch_size)
+        print(f"✅ Varredura: {summary}")
+        return 0
+    
+    if args.command == 'rollup':
+        summary = rollup_validation_logs(retention_days=args.retention_days)
+        print(f"✅ Rollup: {summary}")
+        return 0
+    
+    if args.command == 'migrate':
+        if args.check:
+            return 0 if check_schema() else 1
+        init_db()
+        return 0
+    
+    if args.command == 'init':
+        started = time.perf_counter()
+        init_schema()
+        print(f"✅ Schema pronto em {time.perf_counter() - started:.2f}s")
+        return 0
+    
+    init_schema()
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
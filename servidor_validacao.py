@@ -1,13 +1,28 @@
 """
 Servidor de Validação de Licenças
 Roda em paralelo com o bot para receber requisições HTTP dos clientes
+
+O import não toca no banco: a tabela é criada por `python servidor_validacao.py init`
+(ou pelo on_starting do gunicorn.conf.py, uma vez no master antes dos workers).
 """
 
-from flask import Flask, request, jsonify
+import time
+INICIO_IMPORT = time.perf_counter()   # STARTUP_TIMING: duração do import do módulo
+
+from flask import Flask, request, jsonify, g, has_request_context
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
 import sqlite3
 from datetime import datetime, timedelta
 import hashlib
+import sys
+import threading
+from metrics import MetricsRegistry, statement_label, PROMETHEUS_CONTENT_TYPE
+from rate_limit import TokenBucketLimiter, retry_after_header
+from bloom import KeyFilter
+from license_keys import is_valid_key
+from offline_tokens import TokenSigner
+from db_pool import create_postgres_pool, create_sqlite_pool, PoolTimeout
 try:
     import psycopg2
     import psycopg2.extras
@@ -22,10 +37,113 @@ CHAVE_SECRETA = os.environ.get("LICENCA_SECRET", "CRIATIVA_2025_LICENCA_SEGURA_X
 # Grace period (dias offline permitidos)
 GRACE_PERIOD_DIAS = 30
 
+# Tokens offline Ed25519 (offline_tokens.py): o cliente confere com a chave pública embutida,
+# sem o segredo; sem OFFLINE_TOKEN_KEY as respostas saem só com a 'assinatura' antiga
+assinador_tokens = TokenSigner(os.environ.get("OFFLINE_TOKEN_KID") or "k1",
+                               os.environ.get("OFFLINE_TOKEN_KEY", ""),
+                               ttl=float(os.environ.get("OFFLINE_TOKEN_TTL_DAYS", 7)) * 86400)
+
+# Proxies confiáveis na frente do app (Render = 1): request.remote_addr passa a ser o IP real
+TRUST_PROXY_HOPS = int(os.environ.get("TRUST_PROXY_HOPS", 0))
+if TRUST_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUST_PROXY_HOPS)
+
+# Limite de taxa de ativação/validação por IP e por código (fichas/s e rajada, por processo)
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1") == "1"
+limite_ip = TokenBucketLimiter(float(os.environ.get("RATE_LIMIT_IP_RATE", 10)),
+                               int(os.environ.get("RATE_LIMIT_IP_BURST", 60)),
+                               max_keys=int(os.environ.get("RATE_LIMIT_MAX_KEYS", 100000)),
+                               enabled=RATE_LIMIT_ENABLED)
+limite_codigo = TokenBucketLimiter(float(os.environ.get("RATE_LIMIT_KEY_RATE", 1)),
+                                   int(os.environ.get("RATE_LIMIT_KEY_BURST", 10)),
+                                   max_keys=int(os.environ.get("RATE_LIMIT_MAX_KEYS", 100000)),
+                                   enabled=RATE_LIMIT_ENABLED)
+
+
+def _verificar_limite(codigo, campo_status):
+    """Resposta 429 (com Retry-After) se o IP ou o código passou do limite; None se liberado"""
+    espera = limite_ip.acquire(request.remote_addr)
+    if not espera:
+        espera = limite_codigo.acquire(codigo)
+        if espera:
+            # Recusada pelo código: a ficha do IP não foi usada
+            limite_ip.refund(request.remote_addr)
+    if not espera:
+        return None
+    resposta = jsonify({
+        campo_status: False,
+        'erro': 'Muitas requisições. Tente novamente mais tarde.'
+    })
+    resposta.status_code = 429
+    resposta.headers['Retry-After'] = retry_after_header(espera)
+    return resposta
+
+
+# Benchmark: conta os comandos SQL de cada request no header X-DB-Queries
+DB_QUERY_HEADER = os.environ.get("DB_QUERY_HEADER", "0") == "1"
+
+# Métricas Prometheus (/metrics); METRICS_DIR agrega os workers do gunicorn
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+metricas = MetricsRegistry(os.environ.get("METRICS_DIR", ""),
+                           float(os.environ.get("METRICS_FLUSH_INTERVAL", 5)))
+REQUISICOES = metricas.counter('http_requests_total', 'Requisições HTTP por rota, método e status')
+LATENCIA = metricas.histogram('http_request_duration_seconds', 'Latência das requisições HTTP')
+TEMPO_SQL = metricas.histogram('db_query_duration_seconds', 'Tempo de execução de SQL por comando')
+metricas.counter_callback('rate_limited_total', 'Requisições recusadas pelo limite de taxa',
+                          lambda: {(('scope', 'ip'),): limite_ip.limited,
+                                   (('scope', 'license_key'),): limite_codigo.limited})
+
+
+def _executar(cursor, sql, params=()):
+    """Executa um comando medindo o tempo; devolve o cursor (psycopg2 devolve None no execute)"""
+    inicio = time.perf_counter()
+    try:
+        cursor.execute(sql, params)
+    finally:
+        TEMPO_SQL.observe(time.perf_counter() - inicio, statement=statement_label(sql))
+        if has_request_context():
+            g.db_queries = g.get('db_queries', 0) + 1
+    return cursor
+
+
+# Probes e métricas não testam o banco: com ele fora do ar, cada health check viraria uma
+# tentativa de conexão. O /ready testa (com o intervalo de ESPERA_RECONEXAO_S após falha).
+ENDPOINTS_SONDA = frozenset({'health', 'metrics'})
+
+
+@app.before_request
+def _iniciar_cronometro():
+    g.inicio_request = time.perf_counter()
+    metricas.start()
+    if request.endpoint not in ENDPOINTS_SONDA:
+        _garantir_pronto()
+
+
+@app.after_request
+def _registrar_request(response):
+    inicio = g.get('inicio_request')
+    if inicio is not None:
+        rota = request.url_rule.rule if request.url_rule else 'unmatched'
+        rotulos = {'route': rota, 'method': request.method, 'status': response.status_code}
+        duracao = time.perf_counter() - inicio
+        LATENCIA.observe(duracao, **rotulos)
+        REQUISICOES.inc(**rotulos)
+        if inicializacao['primeira_requisicao_s'] is None and inicializacao['pid'] == os.getpid():
+            _registrar_primeira_requisicao(duracao)
+    if DB_QUERY_HEADER:
+        response.headers['X-DB-Queries'] = str(g.get('db_queries', 0))
+    return response
+
 
 def _is_postgres():
     return bool(os.environ.get("DATABASE_URL")) and (psycopg2 is not None)
 
+# Varredura de expiração: status + data_expiracao (também usado pelas contagens do bot)
+SQL_INDICE_EXPIRACAO = "CREATE INDEX IF NOT EXISTS idx_licencas_status_expiracao ON licencas (status, data_expiracao)"
+# Atualização incremental do filtro de códigos (data_criacao >= cursor) sem varrer a tabela
+SQL_INDICE_CRIACAO = "CREATE INDEX IF NOT EXISTS idx_licencas_data_criacao ON licencas (data_criacao)"
+
+
 def init_db():
     """Garante que a tabela de licenças exista (Postgres ou SQLite)."""
     if _is_postgres():
@@ -46,6 +164,21 @@ def init_db():
             )
             """
         )
+        cur.execute(SQL_INDICE_EXPIRACAO)
+        cur.execute(SQL_INDICE_CRIACAO)
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS eventos_licenca (
+                id BIGSERIAL PRIMARY KEY,
+                codigo TEXT NOT NULL,
+                evento TEXT NOT NULL,
+                status_anterior TEXT,
+                status_novo TEXT,
+                origem TEXT,
+                data TEXT NOT NULL
+            )
+            """
+        )
         conn.commit()
         conn.close()
     else:
@@ -63,31 +196,343 @@ def init_db():
                 observacoes TEXT
             )
         ''')
+        db.execute(SQL_INDICE_EXPIRACAO)
+        db.execute(SQL_INDICE_CRIACAO)
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS eventos_licenca (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                codigo TEXT NOT NULL,
+                evento TEXT NOT NULL,
+                status_anterior TEXT,
+                status_novo TEXT,
+                origem TEXT,
+                data TEXT NOT NULL
+            )
+        ''')
         db.commit()
         db.close()
 
 
-# Garante que o banco esteja pronto ao iniciar o servidor
-init_db()
+# Inicialização do worker: sem DDL no import (ver `init`); a primeira requisição
+# confirma que o banco responde e marca o processo como pronto
+STARTUP_TIMING = os.environ.get("STARTUP_TIMING", "0") == "1"
+
+inicializacao = {
+    'pid': os.getpid(),
+    'pronto': False,
+    'import_s': time.perf_counter() - INICIO_IMPORT,
+    'conexao_s': None,
+    'primeira_requisicao_s': None,
+    'erro': None,
+}
+_lock_inicializacao = threading.Lock()
+
+# Depois de uma falha ao conectar, as requisições seguintes não tentam de novo por este intervalo
+ESPERA_RECONEXAO_S = float(os.environ.get("DB_CONNECT_RETRY_SECONDS", 5))
+_nova_tentativa = {'pid': None, 'em': 0.0}
+
+
+def _aguardando_reconexao():
+    return _nova_tentativa['pid'] == os.getpid() and time.monotonic() < _nova_tentativa['em']
+
+
+def _garantir_pronto():
+    """Testa a conexão com o banco e abre as DB_POOL_MIN iniciais do pool, uma vez por worker"""
+    if inicializacao['pronto'] and inicializacao['pid'] == os.getpid():
+        return
+    _iniciar_varredura()
+    if _aguardando_reconexao():
+        return
+    with _lock_inicializacao:
+        if inicializacao['pid'] != os.getpid():
+            # Worker forkado de um master que já importou o módulo
+            inicializacao.update(pid=os.getpid(), pronto=False, import_s=0.0, conexao_s=None,
+                                 primeira_requisicao_s=None, erro=None)
+        if inicializacao['pronto'] or _aguardando_reconexao():
+            return
+        inicio = time.perf_counter()
+        try:
+            get_db().close()
+            _get_pool().warmup()
+        except Exception as e:
+            inicializacao['erro'] = str(e)
+            _nova_tentativa.update(pid=os.getpid(), em=time.monotonic() + ESPERA_RECONEXAO_S)
+            print(f"❌ Worker {os.getpid()}: banco indisponível: {e}")
+            return
+        inicializacao.update(pronto=True, erro=None, conexao_s=time.perf_counter() - inicio)
+
+
+def _registrar_primeira_requisicao(duracao):
+    inicializacao['primeira_requisicao_s'] = duracao
+    if STARTUP_TIMING:
+        conexao = inicializacao['conexao_s']
+        print(f"⏱️ Worker {os.getpid()}: import {inicializacao['import_s'] * 1000:.1f} ms, "
+              f"conexão {conexao * 1000 if conexao is not None else float('nan'):.1f} ms, "
+              f"1ª requisição {duracao * 1000:.1f} ms")
+
+
+def init_schema():
+    """Cria a tabela de licenças (deploy / on_starting do gunicorn)"""
+    init_db()
+
+
+# Pool de conexões por worker (mesmo db_pool do servidor_licencas_v3)
+DB_POOL_OPCOES = dict(
+    minconn=int(os.environ.get("DB_POOL_MIN", 1)),
+    maxconn=int(os.environ.get("DB_POOL_MAX", 5)),
+    timeout=float(os.environ.get("DB_POOL_TIMEOUT", 10)),
+    healthcheck_interval=float(os.environ.get("DB_POOL_HEALTHCHECK", 30)),
+    max_idle=float(os.environ.get("DB_POOL_MAX_IDLE", 300)),
+)
+_pool = None
+_lock_pool = threading.Lock()
+ESPERA_POOL = metricas.histogram('db_pool_wait_seconds', 'Espera para obter conexão do pool')
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _lock_pool:
+            if _pool is None:
+                if _is_postgres():
+                    _pool = create_postgres_pool(os.environ.get("DATABASE_URL"), **DB_POOL_OPCOES)
+                else:
+                    _pool = create_sqlite_pool('licencas.db', **DB_POOL_OPCOES)
+                _pool.on_checkout = ESPERA_POOL.observe
+    return _pool
 
 
 def get_db():
-    """Conecta ao banco de licenças (Postgres se disponível, senão SQLite)."""
-    if _is_postgres():
-        conn = psycopg2.connect(os.environ.get("DATABASE_URL"))
-        return conn
-    else:
-        db = sqlite3.connect('licencas.db')
-        db.row_factory = sqlite3.Row
-        return db
+    """
+    Conexão do pool (Postgres se disponível, senão SQLite). Use `with get_db() as db:`:
+    a conexão volta ao pool em qualquer saída (return antecipado ou exceção) e
+    sockets derrubados são descartados/reabertos pelo pool.
+    """
+    return _get_pool().getconn()
+
+
+def _estatistica_pool(campo):
+    def ler():
+        return _pool.stats()[campo] if _pool is not None else None
+    return ler
+
+
+metricas.gauge_callback('db_pool_connections_in_use', 'Conexões emprestadas do pool', _estatistica_pool('in_use'))
+metricas.gauge_callback('db_pool_connections_idle', 'Conexões ociosas no pool', _estatistica_pool('idle'))
+metricas.counter_callback('db_pool_exhausted_total', 'Checkouts que esperaram por pool cheio',
+                          _estatistica_pool('exhausted'))
+metricas.counter_callback('db_pool_timeouts_total', 'Checkouts que desistiram por timeout',
+                          _estatistica_pool('timeouts'))
+metricas.counter_callback('db_pool_reconnects_total', 'Conexões mortas substituídas', _estatistica_pool('reconnects'))
+
+
+def _pool_esgotado(campo_status):
+    """503 com Retry-After quando nenhuma conexão ficou livre a tempo"""
+    print(f"⚠️ Pool de conexões esgotado: {_pool.stats() if _pool else None}")
+    resposta = jsonify({
+        campo_status: False,
+        'erro': 'Servidor ocupado. Tente novamente em instantes.'
+    })
+    resposta.status_code = 503
+    resposta.headers['Retry-After'] = '1'
+    return resposta
+
+
+def _carregar_codigos(desde=None):
+    """Códigos de `licencas` (todos, ou criados a partir da data `desde`) e o próximo cursor"""
+    # Cursor com um dia de folga: data_criacao é só a data (e o bot pode criar perto da meia-noite)
+    proximo = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+    db = get_db()
+    try:
+        cursor = db.cursor()
+        if desde is None:
+            _executar(cursor, 'SELECT codigo FROM licencas')
+        else:
+            q = ('SELECT codigo FROM licencas WHERE data_criacao >= %s' if _is_postgres()
+                 else 'SELECT codigo FROM licencas WHERE data_criacao >= ?')
+            _executar(cursor, q, (desde,))
+        return [linha[0] for linha in cursor.fetchall()], proximo
+    finally:
+        db.close()
+
+
+# Filtro (Bloom) dos códigos existentes: códigos inexistentes são recusados sem ir ao banco
+filtro_codigos = KeyFilter(
+    lambda: _carregar_codigos(),
+    _carregar_codigos,
+    refresh_interval=float(os.environ.get("LICENSE_FILTER_REFRESH_SECONDS", 5)),
+    rebuild_interval=float(os.environ.get("LICENSE_FILTER_REBUILD_MINUTES", 10)) * 60,
+    error_rate=float(os.environ.get("LICENSE_FILTER_ERROR_RATE", 0.001)),
+    enabled=os.environ.get("LICENSE_FILTER_ENABLED", "1") == "1",
+)
+CODIGOS_DESCONHECIDOS = metricas.counter('license_unknown_key_total', 'Requisições com códigos inexistentes')
+metricas.counter_callback('license_filter_rejected_total', 'Códigos recusados pelo filtro sem ir ao banco',
+                          lambda: filtro_codigos.rejected)
+
+
+# Varredura de expiração: marca 'expirada' em lotes (ativas e pendentes vencidas)
+VARREDURA_INTERVALO = float(os.environ.get("EXPIRY_SWEEP_INTERVAL", 60))   # 0 = desligada
+VARREDURA_LOTE = int(os.environ.get("EXPIRY_SWEEP_BATCH", 500))
+VARREDURA_PAUSA_MS = int(os.environ.get("EXPIRY_SWEEP_PAUSE_MS", 50))
+STATUS_EXPIRAVEIS = ('ativa', 'pendente')
+EXPIRADAS = metricas.counter('license_expired_total', 'Licenças marcadas como expiradas pela varredura')
+_varredura = {'pid': None}
+_lock_varredura = threading.Lock()
+
+
+def varrer_expiradas(lote=None, hoje=None):
+    """
+    Marca como 'expirada' as licenças ativas/pendentes com data_expiracao até hoje,
+    em lotes de `lote` (um commit por lote), registrando cada troca em eventos_licenca.
+
+    Returns:
+        int: licenças expiradas
+    """
+    lote = lote or VARREDURA_LOTE
+    # data_expiracao é só a data e /api/validar já recusa a partir da 0h desse dia
+    hoje = (hoje or datetime.now()).strftime('%Y-%m-%d')
+    agora = datetime.now().isoformat()
+    p = '%s' if _is_postgres() else '?'
+    total = 0
+    db = get_db()
+    try:
+        cursor = db.cursor()
+        while True:
+            _executar(cursor, f'''
+                SELECT codigo, status FROM licencas
+                WHERE status IN ({p}, {p}) AND data_expiracao <= {p}
+                ORDER BY data_expiracao
+                LIMIT {p}
+            ''', STATUS_EXPIRAVEIS + (hoje, lote))
+            candidatas = cursor.fetchall()
+            eventos = []
+            for codigo, status_anterior in candidatas:
+                # Condicional: ativação/revogação concorrente entre o SELECT e o UPDATE prevalece
+                _executar(cursor, f"UPDATE licencas SET status = 'expirada' WHERE codigo = {p} AND status = {p}",
+                          (codigo, status_anterior))
+                if cursor.rowcount:
+                    eventos.append((codigo, 'expirada', status_anterior, 'expirada', 'varredura', agora))
+            if eventos:
+                cursor.executemany(f'''
+                    INSERT INTO eventos_licenca (codigo, evento, status_anterior, status_novo, origem, data)
+                    VALUES ({p}, {p}, {p}, {p}, {p}, {p})
+                ''', eventos)
+            db.commit()
+            total += len(eventos)
+            EXPIRADAS.inc(len(eventos))
+            if eventos:
+                _invalidar_status()
+            if len(candidatas) < lote:
+                break
+            time.sleep(VARREDURA_PAUSA_MS / 1000.0)
+    finally:
+        db.close()
+    return total
+
+
+def _loop_varredura():
+    while True:
+        time.sleep(VARREDURA_INTERVALO)
+        try:
+            expiradas = varrer_expiradas()
+            if expiradas:
+                print(f"⌛ Varredura: {expiradas} licença(s) expirada(s)")
+        except Exception as e:
+            print(f"❌ Varredura de expiração falhou: {e}")
+
+
+def _iniciar_varredura():
+    """Sobe a thread de varredura no processo atual (uma por worker)"""
+    if VARREDURA_INTERVALO <= 0 or _varredura['pid'] == os.getpid():
+        return
+    with _lock_varredura:
+        if _varredura['pid'] != os.getpid():
+            _varredura['pid'] = os.getpid()
+            threading.Thread(target=_loop_varredura, name='varredura-expiracao', daemon=True).start()
 
 
 def gerar_assinatura(codigo, hwid, data_expiracao):
-    """Gera assinatura criptográfica"""
+    """Gera assinatura criptográfica (clientes antigos; conferir exige CHAVE_SECRETA)"""
     dados = f"{codigo}|{hwid}|{data_expiracao}|{CHAVE_SECRETA}"
     return hashlib.sha256(dados.encode()).hexdigest()
 
 
+def _com_token_offline(resposta, codigo, hwid, licenca):
+    """Acrescenta 'token_offline' (Ed25519) à resposta, se há chave configurada"""
+    # A licença vale até o início do dia de data_expiracao (mesma regra da varredura)
+    expira = datetime.strptime(licenca['data_expiracao'], '%Y-%m-%d').timestamp()
+    token = assinador_tokens.issue(codigo, hwid, f"{licenca['dias_validade']} dias", expira)
+    if token:
+        resposta['token_offline'] = token
+    return resposta
+
+
+# RETURNING no SQLite só a partir da 3.35; antes disso, UPDATE + SELECT na mesma transação
+SQLITE_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+def _ativar_pendente(cursor, codigo, hwid, hoje):
+    """
+    UPDATE condicional pendente -> ativa (ainda dentro da validade).
+    Retorna cliente/data_expiracao/dias_validade se ativou; None se a licença não estava pendente.
+    """
+    p = '%s' if _is_postgres() else '?'
+    sql = f"""
+        UPDATE licencas SET status = 'ativa', hwid = {p}, data_ativacao = {p}
+        WHERE codigo = {p} AND status = 'pendente' AND data_expiracao > {p}
+    """
+    params = (hwid, hoje, codigo, hoje)
+    if _is_postgres() or SQLITE_RETURNING:
+        return _executar(cursor, sql + ' RETURNING cliente, data_expiracao, dias_validade', params).fetchone()
+    if _executar(cursor, sql, params).rowcount == 0:
+        return None
+    return _executar(cursor, 'SELECT cliente, data_expiracao, dias_validade FROM licencas WHERE codigo = ?',
+                     (codigo,)).fetchone()
+
+
+def _motivo_ativacao_recusada(codigo, hwid, licenca, hoje):
+    """Resposta de erro para uma licença que não pôde ser ativada; None se já está ativa neste HWID"""
+    if not licenca:
+        CODIGOS_DESCONHECIDOS.inc(source='database')
+        return jsonify({
+            'sucesso': False,
+            'erro': 'Código de licença não encontrado'
+        }), 404
+    
+    # Verifica se já está ativada
+    if licenca['status'] == 'ativa':
+        # Verifica se é o mesmo HWID
+        if licenca['hwid'] != hwid:
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Esta licença já está ativada em outro computador',
+                'bloqueada': True
+            }), 403
+        return None
+    
+    # Verifica se está revogada
+    if licenca['status'] == 'revogada':
+        return jsonify({
+            'sucesso': False,
+            'erro': 'Esta licença foi revogada. Entre em contato com o suporte.',
+            'bloqueada': True
+        }), 403
+    
+    # 'expirada' ou pendente já vencida que a varredura ainda não marcou
+    if licenca['status'] == 'expirada' or licenca['data_expiracao'] <= hoje:
+        return jsonify({
+            'sucesso': False,
+            'erro': 'Esta licença expirou. Entre em contato com o suporte para renovar.',
+            'data_expiracao': licenca['data_expiracao']
+        }), 403
+    
+    print(f"⚠️ Ativação recusada: {codigo} com status inesperado '{licenca['status']}'")
+    return jsonify({
+        'sucesso': False,
+        'erro': 'Esta licença não pode ser ativada. Entre em contato com o suporte.'
+    }), 409
+
+
 @app.route('/api/ativar', methods=['POST'])
 def ativar_licenca():
     """
@@ -104,70 +549,68 @@ def ativar_licenca():
                 'erro': 'Código e HWID são obrigatórios'
             }), 400
         
-        db = get_db()
-        cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor) if _is_postgres() else db.cursor()
+        # Formato/dígito verificador: código digitado errado não chega ao banco
+        if not is_valid_key(codigo):
+            CODIGOS_DESCONHECIDOS.inc(source='format')
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Formato de código inválido. Confira os caracteres digitados.'
+            }), 400
         
-        # Busca a licença
-        q_sel = 'SELECT * FROM licencas WHERE codigo = %s' if _is_postgres() else 'SELECT * FROM licencas WHERE codigo = ?'
-        cursor.execute(q_sel, (codigo,))
-        licenca = cursor.fetchone()
+        limitada = _verificar_limite(codigo, 'sucesso')
+        if limitada is not None:
+            return limitada
         
-        if not licenca:
+        if not filtro_codigos.might_exist(codigo):
+            CODIGOS_DESCONHECIDOS.inc(source='filter')
             return jsonify({
                 'sucesso': False,
                 'erro': 'Código de licença não encontrado'
             }), 404
         
-        # Verifica se já está ativada
-        if licenca['status'] == 'ativa':
-            # Verifica se é o mesmo HWID
-            if licenca['hwid'] != hwid:
-                return jsonify({
-                    'sucesso': False,
-                    'erro': 'Esta licença já está ativada em outro computador',
-                    'bloqueada': True
-                }), 403
+        hoje = datetime.now().strftime('%Y-%m-%d')
+        with get_db() as db:
+            cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor) if _is_postgres() else db.cursor()
             
-            # Mesmo HWID - permite (renovação/reinstalação)
-            return jsonify({
-                'sucesso': True,
-                'mensagem': 'Licença já ativada neste computador',
-                'cliente': licenca['cliente'],
-                'data_expiracao': licenca['data_expiracao'],
-                'dias_validade': licenca['dias_validade'],
-                'assinatura': gerar_assinatura(codigo, hwid, licenca['data_expiracao'])
-            })
-        
-        # Verifica se está revogada
-        if licenca['status'] == 'revogada':
-            return jsonify({
-                'sucesso': False,
-                'erro': 'Esta licença foi revogada. Entre em contato com o suporte.',
-                'bloqueada': True
-            }), 403
-        
-        # Ativa a licença
-        data_ativacao = datetime.now().strftime('%Y-%m-%d')
-        q_up = (
-            "UPDATE licencas SET status = 'ativa', hwid = %s, data_ativacao = %s WHERE codigo = %s"
-            if _is_postgres() else
-            "UPDATE licencas SET status = 'ativa', hwid = ?, data_ativacao = ? WHERE codigo = ?"
-        )
-        cursor.execute(q_up, (hwid, data_ativacao, codigo))
-        db.commit()
-        db.close()
+            # Ativação em um único comando condicional: só uma requisição tira a licença de
+            # 'pendente' (duas ativações simultâneas em PCs diferentes não passam as duas)
+            licenca = _ativar_pendente(cursor, codigo, hwid, hoje)
+            
+            if licenca is None:
+                # Não estava pendente (ou não existe): uma leitura para explicar o motivo
+                # (nada a gravar: a transação é desfeita na devolução ao pool)
+                p = '%s' if _is_postgres() else '?'
+                licenca = _executar(cursor, f'SELECT * FROM licencas WHERE codigo = {p}', (codigo,)).fetchone()
+                resposta = _motivo_ativacao_recusada(codigo, hwid, licenca, hoje)
+                if resposta is not None:
+                    return resposta
+                
+                # Mesmo HWID - permite (renovação/reinstalação)
+                return jsonify(_com_token_offline({
+                    'sucesso': True,
+                    'mensagem': 'Licença já ativada neste computador',
+                    'cliente': licenca['cliente'],
+                    'data_expiracao': licenca['data_expiracao'],
+                    'dias_validade': licenca['dias_validade'],
+                    'assinatura': gerar_assinatura(codigo, hwid, licenca['data_expiracao'])
+                }, codigo, hwid, licenca))
+            
+            db.commit()
+        _invalidar_status()
         
         print(f"✅ Licença ativada: {codigo} | HWID: {hwid[:16]}... | Cliente: {licenca['cliente']}")
         
-        return jsonify({
+        return jsonify(_com_token_offline({
             'sucesso': True,
             'mensagem': 'Licença ativada com sucesso!',
             'cliente': licenca['cliente'],
             'data_expiracao': licenca['data_expiracao'],
             'dias_validade': licenca['dias_validade'],
             'assinatura': gerar_assinatura(codigo, hwid, licenca['data_expiracao'])
-        })
+        }, codigo, hwid, licenca))
     
+    except PoolTimeout:
+        return _pool_esgotado('sucesso')
     except Exception as e:
         print(f"❌ Erro ao ativar licença: {e}")
         return jsonify({
@@ -192,61 +635,82 @@ def validar_licenca():
                 'erro': 'Código e HWID são obrigatórios'
             }), 400
         
-        db = get_db()
-        cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor) if _is_postgres() else db.cursor()
+        # Formato/dígito verificador: código digitado errado não chega ao banco
+        if not is_valid_key(codigo):
+            CODIGOS_DESCONHECIDOS.inc(source='format')
+            return jsonify({
+                'valida': False,
+                'erro': 'Formato de código inválido',
+                'bloqueada': False
+            }), 400
         
-        # Busca a licença
-        q_sel = 'SELECT * FROM licencas WHERE codigo = %s' if _is_postgres() else 'SELECT * FROM licencas WHERE codigo = ?'
-        cursor.execute(q_sel, (codigo,))
-        licenca = cursor.fetchone()
+        limitada = _verificar_limite(codigo, 'valida')
+        if limitada is not None:
+            return limitada
         
-        if not licenca:
+        if not filtro_codigos.might_exist(codigo):
+            CODIGOS_DESCONHECIDOS.inc(source='filter')
             return jsonify({
                 'valida': False,
                 'erro': 'Licença não encontrada',
                 'bloqueada': False
             }), 404
         
-        # Verifica se está revogada
-        if licenca['status'] == 'revogada':
-            return jsonify({
-                'valida': False,
-                'erro': 'Licença revogada',
-                'bloqueada': True
-            }), 403
+        with get_db() as db:
+            cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor) if _is_postgres() else db.cursor()
         
-        # Verifica HWID
-        if licenca['hwid'] != hwid:
-            db.close()
-            return jsonify({
-                'valida': False,
-                'erro': 'HWID diferente do autorizado',
-                'bloqueada': False
-            }), 403
+            # Busca a licença
+            q_sel = 'SELECT * FROM licencas WHERE codigo = %s' if _is_postgres() else 'SELECT * FROM licencas WHERE codigo = ?'
+            _executar(cursor, q_sel, (codigo,))
+            licenca = cursor.fetchone()
         
-        # Verifica expiração
-        data_exp = datetime.strptime(licenca['data_expiracao'], '%Y-%m-%d')
-        if datetime.now() > data_exp:
-            return jsonify({
-                'valida': False,
-                'erro': 'Licença expirada',
-                'data_expiracao': licenca['data_expiracao']
-            }), 403
+            if not licenca:
+                CODIGOS_DESCONHECIDOS.inc(source='database')
+                return jsonify({
+                    'valida': False,
+                    'erro': 'Licença não encontrada',
+                    'bloqueada': False
+                }), 404
         
-        db.close()
+            # Verifica se está revogada
+            if licenca['status'] == 'revogada':
+                return jsonify({
+                    'valida': False,
+                    'erro': 'Licença revogada',
+                    'bloqueada': True
+                }), 403
+        
+            # Verifica HWID
+            if licenca['hwid'] != hwid:
+                return jsonify({
+                    'valida': False,
+                    'erro': 'HWID diferente do autorizado',
+                    'bloqueada': False
+                }), 403
+        
+            # Verifica expiração (a varredura marca 'expirada'; a data cobre o intervalo até ela rodar)
+            data_exp = datetime.strptime(licenca['data_expiracao'], '%Y-%m-%d')
+            if licenca['status'] == 'expirada' or datetime.now() > data_exp:
+                return jsonify({
+                    'valida': False,
+                    'erro': 'Licença expirada',
+                    'data_expiracao': licenca['data_expiracao']
+                }), 403
         
         # Licença válida!
         dias_restantes = (data_exp - datetime.now()).days
         
-        return jsonify({
+        return jsonify(_com_token_offline({
             'valida': True,
             'mensagem': 'Licença válida',
             'cliente': licenca['cliente'],
             'data_expiracao': licenca['data_expiracao'],
             'dias_restantes': dias_restantes,
             'assinatura': gerar_assinatura(codigo, hwid, licenca['data_expiracao'])
-        })
+        }, codigo, hwid, licenca))
     
+    except PoolTimeout:
+        return _pool_esgotado('valida')
     except Exception as e:
         print(f"❌ Erro ao validar licença: {e}")
         return jsonify({
@@ -255,29 +719,64 @@ def validar_licenca():
         }), 500
 
 
+# Contagens do /api/status: um GROUP BY (índice status + data_expiracao) guardado por STATUS_CACHE_TTL;
+# ativação e varredura deste processo invalidam na hora, revogações do bot aparecem após o TTL
+STATUS_CACHE_TTL = float(os.environ.get("STATUS_CACHE_TTL", 30))
+_cache_status = {'valor': None, 'expira_em': 0.0, 'geracao': 0}
+_lock_status = threading.Lock()
+
+
+def _contagens_por_status():
+    """{'por_status': {status: n}, 'atualizado_em': ISO} do cache ou de uma única consulta"""
+    valor = _cache_status['valor']
+    if valor is not None and time.monotonic() < _cache_status['expira_em']:
+        return valor
+    # Uma consulta por vez: requisições simultâneas com cache vencido esperam a mesma leitura
+    with _lock_status:
+        valor = _cache_status['valor']
+        if valor is not None and time.monotonic() < _cache_status['expira_em']:
+            return valor
+        geracao = _cache_status['geracao']
+        with get_db() as db:
+            cursor = db.cursor()
+            linhas = _executar(cursor, 'SELECT status, COUNT(*) FROM licencas GROUP BY status').fetchall()
+        valor = {
+            'por_status': {status: total for status, total in linhas},
+            'atualizado_em': datetime.now().isoformat(timespec='seconds'),
+        }
+        # Invalidação durante a leitura: devolve, mas não guarda
+        if geracao == _cache_status['geracao'] and STATUS_CACHE_TTL > 0:
+            _cache_status.update(valor=valor, expira_em=time.monotonic() + STATUS_CACHE_TTL)
+        return valor
+
+
+def _invalidar_status():
+    _cache_status['geracao'] += 1
+    _cache_status['valor'] = None
+
+
 @app.route('/api/status', methods=['GET'])
 def status():
-    """Status do servidor"""
+    """Status do servidor (contagens por status em cache por STATUS_CACHE_TTL segundos)"""
     try:
-        db = get_db()
-        cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor) if _is_postgres() else db.cursor()
-        
-        total = cursor.execute('SELECT COUNT(*) AS count FROM licencas').fetchone()
-        total = total['count'] if isinstance(total, dict) else total[0]
-        ativas = cursor.execute("SELECT COUNT(*) AS count FROM licencas WHERE status = 'ativa'").fetchone()
-        ativas = ativas['count'] if isinstance(ativas, dict) else ativas[0]
-        pendentes = cursor.execute("SELECT COUNT(*) AS count FROM licencas WHERE status = 'pendente'").fetchone()
-        pendentes = pendentes['count'] if isinstance(pendentes, dict) else pendentes[0]
-        
-        db.close()
+        contagens = _contagens_por_status()
+        por_status = contagens['por_status']
         
         return jsonify({
             'online': True,
-            'total_licencas': total,
-            'ativas': ativas,
-            'pendentes': pendentes,
+            'total_licencas': sum(por_status.values()),
+            'ativas': por_status.get('ativa', 0),
+            'pendentes': por_status.get('pendente', 0),
+            'revogadas': por_status.get('revogada', 0),
+            'expiradas': por_status.get('expirada', 0),
+            'atualizado_em': contagens['atualizado_em'],
             'grace_period_dias': GRACE_PERIOD_DIAS
         })
+    except PoolTimeout:
+        return jsonify({
+            'online': True,
+            'erro': 'Servidor ocupado. Tente novamente em instantes.'
+        }), 503
     except Exception as e:
         return jsonify({
             'online': True,
@@ -285,6 +784,23 @@ def status():
         }), 500
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas no formato Prometheus (somadas entre workers com METRICS_DIR)"""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return jsonify({'erro': 'Token de métricas inválido'}), 401
+    return app.response_class(metricas.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness: 200 quando este worker já conectou ao banco, 503 se ainda não conseguiu"""
+    estado = dict(inicializacao)
+    if estado['pid'] != os.getpid():
+        estado.update(pid=os.getpid(), pronto=False)
+    return jsonify(estado), 200 if estado['pronto'] else 503
+
+
 @app.route('/health', methods=['GET'])
 def health():
     """Endpoint de health check para uso no Render e no bot/cliente."""
@@ -292,6 +808,8 @@ def health():
         return jsonify({
             'status': 'online',
             'timestamp': datetime.now().isoformat(),
+            'db_pool': _pool.stats() if _pool is not None else None,
+            'tokens_offline': assinador_tokens.stats(),
             'endpoints': {
                 'ativar': 'POST /api/ativar',
                 'validar': 'POST /api/validar',
@@ -306,6 +824,16 @@ def health():
 
 
 if __name__ == '__main__':
+    # python servidor_validacao.py init    -> só cria a tabela (deploy) e sai
+    # python servidor_validacao.py expirar -> uma varredura de expiração e sai
+    init_db()
+    if sys.argv[1:] == ['init']:
+        print("✅ Banco de licenças inicializado")
+        sys.exit(0)
+    if sys.argv[1:] == ['expirar']:
+        print(f"✅ Varredura: {varrer_expiradas()} licença(s) expirada(s)")
+        sys.exit(0)
+    
     print("="*60)
     print("🌐 SERVIDOR DE VALIDAÇÃO INICIADO")
     print("="*60)
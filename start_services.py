@@ -16,9 +16,12 @@ def run_server():
     """Roda o servidor de validação via gunicorn."""
     port = os.environ.get("PORT", "10000")
     print(f"[start_services] Iniciando servidor_validacao na porta {port}...")
+    # gunicorn.conf.py cria a tabela uma vez no master (on_starting); os workers não fazem DDL
     subprocess.call([
         "gunicorn",
         "servidor_validacao:app",
+        "-c",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py"),
         "-b",
         f"0.0.0.0:{port}",
     ])
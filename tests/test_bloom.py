@@ -0,0 +1,59 @@
+import unittest
+from unittest import mock
+
+from bloom import KeyFilter
+
+
+class KeyFilterRefreshTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.created = []      # chaves criadas "em outro processo"
+        self.reloads = 0
+        patcher = mock.patch('bloom.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.filter = KeyFilter(self._load_all, self._load_since, refresh_interval=5.0,
+                                rebuild_interval=3600.0, min_capacity=100)
+
+    def _load_all(self):
+        return ['LIC-EXISTENTE'], 0
+
+    def _load_since(self, cursor):
+        self.reloads += 1
+        return self.created[cursor:], len(self.created)
+
+    def test_unknown_keys_reload_at_most_once_per_interval(self):
+        for i in range(200):
+            self.assertFalse(self.filter.might_exist(f'LIC-INVENTADA-{i}'))
+            self.now += 0.01          # 200 chaves em 2s: dentro de um intervalo
+        self.assertEqual(self.reloads, 1)
+
+        self.now += 5.0
+        for i in range(200):
+            self.filter.might_exist(f'LIC-OUTRA-{i}')
+        self.assertEqual(self.reloads, 2)
+
+    def test_key_created_elsewhere_is_found_after_interval(self):
+        self.assertFalse(self.filter.might_exist('LIC-NOVA'))
+        self.created.append('LIC-NOVA')
+        self.assertFalse(self.filter.might_exist('LIC-NOVA'))
+        self.now += 5.0
+        self.assertTrue(self.filter.might_exist('LIC-NOVA'))
+        self.assertTrue(self.filter.might_exist('LIC-EXISTENTE'))
+
+    def test_failed_refresh_fails_open_without_retrying_each_miss(self):
+        self.filter.might_exist('LIC-EXISTENTE')
+
+        def failing(cursor):
+            self.reloads += 1
+            raise ConnectionError('banco fora do ar')
+
+        self.filter._load_since = failing
+        with mock.patch('builtins.print'):
+            for i in range(50):
+                self.assertTrue(self.filter.might_exist(f'LIC-X-{i}'))
+        self.assertEqual(self.reloads, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from license_keys import ALPHABET, PREFIX_CRIAT, PREFIX_LIC, generate_key, is_valid_key
+
+
+def _swaps(key):
+    """Todas as transposições de caracteres vizinhos do corpo (atravessando os hífens)"""
+    prefix, body = key.split('-', 1)
+    chars = body.replace('-', '')
+    for i in range(len(chars) - 1):
+        if chars[i] == chars[i + 1]:
+            continue
+        swapped = chars[:i] + chars[i + 1] + chars[i] + chars[i + 2:]
+        yield '-'.join([prefix] + [swapped[j:j + 4] for j in range(0, len(swapped), 4)])
+
+
+class CheckCharTest(unittest.TestCase):
+    def test_sample_keys_from_review(self):
+        self.assertFalse(is_valid_key('LIC2-D127-SKVE-US1O-33TK')
+                         and is_valid_key('LIC2-D217-SKVE-US1O-33TK'))
+
+    def test_every_adjacent_swap_is_rejected(self):
+        for prefix in (PREFIX_LIC, PREFIX_CRIAT):
+            for _ in range(200):
+                key = generate_key(prefix)
+                self.assertTrue(is_valid_key(key), key)
+                for swapped in _swaps(key):
+                    self.assertFalse(is_valid_key(swapped), f'{key} -> {swapped}')
+
+    def test_every_single_substitution_is_rejected(self):
+        key = generate_key()
+        for i, ch in enumerate(key):
+            if i < 5 or ch == '-':
+                continue
+            for other in ALPHABET.replace(ch, ''):
+                self.assertFalse(is_valid_key(key[:i] + other + key[i + 1:]))
+
+    def test_legacy_formats_still_accepted(self):
+        self.assertTrue(is_valid_key('ABCD-EFGH-JKLM-NPQR'))
+        self.assertTrue(is_valid_key('CRIAT-ABCD-EFGH-JKLM'))
+        self.assertFalse(is_valid_key('CLIENTE-ANTIGO-001'))
+
+
+class CreateLicenseFormatTest(unittest.TestCase):
+    """Chaves livres (aceitas antes das v2) são recusadas na criação, como na validação"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls._cwd = os.getcwd()
+        cls._tmp = tempfile.TemporaryDirectory()
+        os.chdir(cls._tmp.name)     # licenses.db do SQLite fica no diretório temporário
+        with mock.patch.dict(os.environ, {'DATABASE_URL': ''}), mock.patch('builtins.print'):
+            import servidor_licencas_v3
+            servidor_licencas_v3.init_db()
+        cls.server = servidor_licencas_v3
+        cls.client = servidor_licencas_v3.app.test_client()
+        cls.headers = {'X-API-Key': servidor_licencas_v3.API_KEY,
+                       'X-Admin-Password': servidor_licencas_v3.ADMIN_PASSWORD}
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls._cwd)
+        cls._tmp.cleanup()
+
+    def _create(self, license_key):
+        response = self.client.post('/api/licenses/create', headers=self.headers,
+                                    json={'license_key': license_key, 'hwid': 'AAAA-BBBB-CCCC-DDDD'})
+        response.close()
+        return response.status_code
+
+    def test_freeform_key_is_rejected(self):
+        self.assertEqual(self._create('CLIENTE-ANTIGO-001'), 400)
+
+    def test_v2_and_legacy_keys_are_created(self):
+        self.assertEqual(self._create(generate_key()), 200)
+        self.assertEqual(self._create('ABCD-EFGH-JKLM-NPQR'), 200)
+
+
+if __name__ == '__main__':
+    sys.exit(unittest.main())
@@ -0,0 +1,95 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+# O cliente PDV importa as cópias de Criativa/ (license_keys, offline_tokens), que têm o mesmo
+# nome dos módulos da raiz: importa com Criativa/ no path e devolve o sys.modules como estava
+_CRIATIVA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Criativa')
+_SHARED = ('license_keys', 'offline_tokens')
+_saved = {name: sys.modules.pop(name) for name in _SHARED if name in sys.modules}
+sys.path.insert(0, _CRIATIVA)
+try:
+    import license_validator
+    from license_validator import LicenseValidator
+finally:
+    sys.path.remove(_CRIATIVA)
+    for _name in _SHARED:
+        sys.modules.pop(_name, None)
+    sys.modules.update(_saved)
+
+LICENSE_KEY = 'ABCD-EFGH-JKLM-NPQR'
+HWID = 'AAAA-BBBB-CCCC-DDDD'
+
+
+class FakeResponse:
+    def __init__(self, status_code, data, headers=None):
+        self.status_code = status_code
+        self._data = data
+        self.headers = headers or {}
+
+    def json(self):
+        return self._data
+
+
+class TransientErrorTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.validator = LicenseValidator('http://servidor', 'api-key', 'x' * 32, public_keys={})
+        self.validator.cache_file = os.path.join(tmp.name, '.license_cache')
+        self.validator.ONLINE_CHECK_INTERVAL = 0
+        self.validator.REVOCATION_POLL_INTERVAL = 0
+        self.validator.get_hwid = lambda: HWID
+        for patcher in (mock.patch('builtins.print'),
+                        mock.patch.object(license_validator.requests, 'post')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.post = license_validator.requests.post
+
+    def _validate_online_ok(self):
+        self.post.return_value = FakeResponse(200, {
+            'valid': True, 'status': 'active', 'message': 'Licença válida',
+            'bound_hwid': HWID, 'offline_token': 'LT1.k1.payload.assinatura',
+        })
+        valid, _ = self.validator.validate(LICENSE_KEY)
+        self.assertTrue(valid)
+
+    def test_rate_limited_keeps_cache_and_honors_retry_after(self):
+        self._validate_online_ok()
+        self.post.reset_mock()
+        self.post.return_value = FakeResponse(
+            429, {'valid': False, 'message': 'Muitas requisições.'}, {'Retry-After': '30'})
+
+        valid, info = self.validator.validate(LICENSE_KEY)
+        self.assertTrue(valid)
+        self.assertEqual(info['status'], 'offline')
+        cache = self.validator._load_cache()
+        self.assertTrue(cache['license']['valid'])
+        self.assertEqual(cache['offline_token'], 'LT1.k1.payload.assinatura')
+        self.assertEqual(self.post.call_count, 1)
+
+        # Dentro do Retry-After nem tenta a rede
+        valid, _ = self.validator.validate(LICENSE_KEY)
+        self.assertTrue(valid)
+        self.assertEqual(self.post.call_count, 1)
+
+    def test_server_error_is_transient(self):
+        self._validate_online_ok()
+        self.post.return_value = FakeResponse(503, None, {'Retry-After': '1'})
+        valid, _ = self.validator.validate(LICENSE_KEY)
+        self.assertTrue(valid)
+        self.assertEqual(self.validator._load_cache()['offline_token'], 'LT1.k1.payload.assinatura')
+
+    def test_definitive_refusal_still_updates_cache(self):
+        self._validate_online_ok()
+        self.post.return_value = FakeResponse(403, {'valid': False, 'status': 'revoked',
+                                                    'message': 'Licença revogada'})
+        valid, _ = self.validator.validate(LICENSE_KEY)
+        self.assertFalse(valid)
+        self.assertIsNone(self.validator._load_cache()['offline_token'])
+
+
+if __name__ == '__main__':
+    unittest.main()